@@ -0,0 +1,689 @@
+# -*- coding: utf-8 -*-
+"""
+In-process AWS stand-in
+=======================
+
+A minimal, thread safe fake of the EC2 (tags, instances, volumes, snapshots),
+autoscaling, DynamoDB and CloudWatch APIs used by :mod:`ec2helper`, good
+enough to run its high level operations offline. Every call sleeps for a
+configurable latency and tag writes only become visible after a configurable
+eventual consistency delay, like they do on the real EC2 API. The calls and
+the (JSON encoded) size of requests and responses are counted.
+
+.. code-block:: python
+
+    from benchmarks.fake_aws import FakeAWS
+
+    aws = FakeAWS(latency=0.05, consistency_delay=1.0)
+    aws.add_autoscaling_group("my-asg", 100)
+    aws.install()
+"""
+from __future__ import unicode_literals, absolute_import, division
+import collections
+import functools
+import itertools
+import json
+import random
+import threading
+import time
+from botocore.exceptions import ClientError, ReadTimeoutError
+from ec2helper.clients import set_client_factory
+
+_OK = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def _ok(**kwargs):
+    """
+    Build a successful response.
+    """
+    kwargs.update(_OK)
+    return kwargs
+
+
+def _size(data):
+    """
+    The JSON encoded size of a request or response in bytes.
+    """
+    return len(json.dumps(data, default=str))
+
+
+def _client_error(code, operation):
+    """
+    Build a :py:class:`botocore.exceptions.ClientError` like the real API
+    raises it.
+    """
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakePaginator(object):
+    """
+    Paginator yielding the pages of a fake operation using NextToken.
+    """
+
+    def __init__(self, method):
+        """Constructor - see class docu."""
+        self._method = method
+
+    def paginate(self, **kwargs):
+        """
+        Yield all pages, each page is a separate (counted) API call.
+        """
+        token = None
+        while True:
+            if token is not None:
+                kwargs["NextToken"] = token
+            page = self._method(**kwargs)
+            yield page
+            token = page.get("NextToken")
+            if not token:
+                return
+
+
+_ServiceModel = collections.namedtuple("_ServiceModel", "service_name")
+_OperationModel = collections.namedtuple("_OperationModel",
+                                         "service_model name")
+_Meta = collections.namedtuple("_Meta", "events")
+
+
+class FakeEvents(object):
+    """
+    The events of botocore's event system used by :mod:`ec2helper.clients`
+    ("before-call", "before-send" and "after-call-error"), so its call hooks
+    and deadlines work with the fake clients.
+    """
+
+    def __init__(self):
+        """Constructor - see class docu."""
+        self._handlers = collections.defaultdict(list)
+
+    def register(self, event_name, handler, **kwargs):
+        """
+        Register a handler.
+        """
+        self._handlers[event_name.split(".")[0]].append(handler)
+
+    def register_first(self, event_name, handler, **kwargs):
+        """
+        Register a handler to run before the others.
+        """
+        self._handlers[event_name.split(".")[0]].insert(0, handler)
+
+    def emit(self, event_name, service_name, operation_name, **kwargs):
+        """
+        Run the handlers of an event.
+        """
+        model = _OperationModel(_ServiceModel(service_name), operation_name)
+        for handler in self._handlers[event_name]:
+            handler(model=model, **kwargs)
+
+
+class FakeClient(object):
+    """
+    Base class of the fake service clients. Public methods are API
+    operations, every call is counted and delayed by the backend's latency.
+    """
+    service_name = None
+
+    def __init__(self, aws, timeout=None):
+        """Constructor - see class docu."""
+        self._aws = aws
+        self._timeout = timeout
+        #: Client metadata, with the :code:`events` of :class:`FakeEvents`.
+        self.meta = _Meta(FakeEvents())
+
+    def __getattribute__(self, name):
+        """
+        Wrap the API operations to count the bytes sent and received.
+        """
+        attribute = object.__getattribute__(self, name)
+        if name.startswith("_") or name == "get_paginator" or \
+                not callable(attribute):
+            return attribute
+        aws = object.__getattribute__(self, "_aws")
+
+        @functools.wraps(attribute)
+        def operation(**kwargs):
+            aws.count_bytes("sent", _size(kwargs))
+            response = attribute(**kwargs)
+            aws.count_bytes("received", _size(response))
+            return response
+        return operation
+
+    def get_paginator(self, operation_name):
+        """
+        Get a paginator for the given operation.
+        """
+        return FakePaginator(getattr(self, operation_name))
+
+    def _call(self, operation_name, function):
+        """
+        Emit the events, count the call and run :attr:`function` between
+        two halves of the simulated network latency.
+        """
+        events = self.meta.events
+        events.emit("before-call", self.service_name, operation_name,
+                    params=dict(), request_signer=None, context=dict())
+        self._aws.count(self.service_name, operation_name)
+        events.emit("before-send", self.service_name, operation_name,
+                    request=None)
+        try:
+            self._aws.delay(self._timeout)
+        except ReadTimeoutError as e:
+            events.emit("after-call-error", self.service_name,
+                        operation_name, exception=e, context=dict())
+            raise
+        try:
+            return function()
+        finally:
+            self._aws.delay()
+
+
+class FakeEC2(FakeClient):
+    """
+    Fake EC2 client (tags, instances, volumes and snapshots).
+    """
+    service_name = "ec2"
+
+    def describe_tags(self, Filters=(), **kwargs):
+        def run():
+            ids = set()
+            for f in Filters:
+                if f["Name"] == "resource-id":
+                    ids.update(f["Values"])
+            tags = list()
+            for instance_id in sorted(ids):
+                for k, v in sorted(self._aws.visible_tags(instance_id).items()):
+                    tags.append({"Key": k, "Value": v,
+                                 "ResourceId": instance_id,
+                                 "ResourceType": "instance"})
+            return _ok(Tags=tags)
+        return self._call("DescribeTags", run)
+
+    def create_tags(self, Resources, Tags, **kwargs):
+        def run():
+            for resource in Resources:
+                if resource.startswith("snap-"):
+                    with self._aws.lock:
+                        snapshot = self._aws.snapshots[resource]
+                        tags = dict((x["Key"], x["Value"]) for x in
+                                    snapshot["Tags"])
+                        tags.update((x["Key"], x["Value"]) for x in Tags)
+                        snapshot["Tags"] = [{"Key": k, "Value": v} for k, v
+                                            in sorted(tags.items())]
+                    continue
+                for tag in Tags:
+                    self._aws.write_tag(resource, tag["Key"], tag["Value"])
+            return _ok()
+        return self._call("CreateTags", run)
+
+    def delete_tags(self, Resources, Tags=(), **kwargs):
+        def run():
+            for resource in Resources:
+                keys = [t["Key"] for t in Tags] or list(
+                    self._aws.visible_tags(resource))
+                for key in keys:
+                    self._aws.write_tag(resource, key, None)
+            return _ok()
+        return self._call("DeleteTags", run)
+
+    def describe_instances(self, Filters=(), InstanceIds=(), NextToken=None,
+                           MaxResults=1000, **kwargs):
+        def run():
+            ids = list(InstanceIds) if InstanceIds else sorted(
+                self._aws.instances)
+            selected = list()
+            for instance_id in ids:
+                tags = self._aws.visible_tags(instance_id)
+                if all(self.__matches(f, tags) for f in Filters):
+                    selected.append(instance_id)
+            start = int(NextToken or 0)
+            page = selected[start:start + MaxResults]
+            response = _ok(Reservations=[{"Instances": [{
+                "InstanceId": x,
+                "State": {"Name": "running"},
+                "RootDeviceName": "/dev/xvda",
+                "Tags": [{"Key": k, "Value": v} for k, v in
+                         sorted(self._aws.visible_tags(x).items())]
+            } for x in page]}] if page else [])
+            if start + MaxResults < len(selected):
+                response["NextToken"] = str(start + MaxResults)
+            return response
+        return self._call("DescribeInstances", run)
+
+    def describe_volumes(self, Filters=(), VolumeIds=(), NextToken=None,
+                         MaxResults=500, **kwargs):
+        def run():
+            with self._aws.lock:
+                volumes = [self._aws.volumes[x] for x in VolumeIds if x in
+                           self._aws.volumes] if VolumeIds else \
+                    list(self._aws.volumes.values())
+                for f in Filters:
+                    if f["Name"] == "attachment.instance-id":
+                        volumes = [x for x in volumes if x["Attachments"][0][
+                            "InstanceId"] in f["Values"]]
+                page, token = self.__page(sorted(
+                    volumes, key=lambda x: x["VolumeId"]), "VolumeId",
+                    NextToken, MaxResults)
+                response = _ok(Volumes=[dict(x, Attachments=[
+                    dict(a) for a in x["Attachments"]], Tags=list(x["Tags"]))
+                    for x in page])
+            if token:
+                response["NextToken"] = token
+            return response
+        return self._call("DescribeVolumes", run)
+
+    def create_snapshot(self, VolumeId, Description="", TagSpecifications=(),
+                        **kwargs):
+        def run():
+            tags = TagSpecifications[0]["Tags"] if TagSpecifications else []
+            return _ok(SnapshotId=self._aws.add_snapshot(VolumeId, tags))
+        return self._call("CreateSnapshot", run)
+
+    def create_snapshots(self, InstanceSpecification, Description="",
+                         TagSpecifications=(), **kwargs):
+        def run():
+            spec = InstanceSpecification
+            tags = TagSpecifications[0]["Tags"] if TagSpecifications else []
+            snapshots = list()
+            with self._aws.lock:
+                volumes = sorted(
+                    x for x, v in self._aws.volumes.items() if
+                    v["Attachments"][0]["InstanceId"] == spec["InstanceId"])
+            for volume_id in volumes:
+                root = self._aws.volumes[volume_id]["Attachments"][0][
+                    "Device"] == "/dev/xvda"
+                if root and volume_id in spec.get("ExcludeDataVolumeIds",
+                                                  ()):
+                    raise _client_error("InvalidParameterValue",
+                                        "CreateSnapshots")
+                if (root and spec.get("ExcludeBootVolume")) or \
+                        volume_id in spec.get("ExcludeDataVolumeIds", ()):
+                    continue
+                snapshots.append({
+                    "SnapshotId": self._aws.add_snapshot(volume_id, tags),
+                    "VolumeId": volume_id})
+            return _ok(Snapshots=snapshots)
+        return self._call("CreateSnapshots", run)
+
+    def describe_snapshots(self, Filters=(), SnapshotIds=(), OwnerIds=(),
+                           NextToken=None, MaxResults=1000, **kwargs):
+        def run():
+            with self._aws.lock:
+                if SnapshotIds:
+                    missing = [x for x in SnapshotIds if x not in
+                               self._aws.snapshots]
+                    if missing:
+                        raise _client_error("InvalidSnapshot.NotFound",
+                                            "DescribeSnapshots")
+                    snapshots = [self._aws.snapshots[x] for x in SnapshotIds]
+                else:
+                    snapshots = list(self._aws.snapshots.values())
+                for f in Filters:
+                    snapshots = [x for x in snapshots if self.__matches(
+                        f, dict((t["Key"], t["Value"]) for t in x["Tags"]))]
+                page, token = self.__page(sorted(
+                    snapshots, key=lambda x: x["SnapshotId"]), "SnapshotId",
+                    NextToken, MaxResults)
+                response = _ok(Snapshots=[dict(x, Tags=list(x["Tags"])) for
+                                          x in page])
+            if token:
+                response["NextToken"] = token
+            return response
+        return self._call("DescribeSnapshots", run)
+
+    def delete_snapshot(self, SnapshotId, **kwargs):
+        def run():
+            with self._aws.lock:
+                if self._aws.snapshots.pop(SnapshotId, None) is None:
+                    raise _client_error("InvalidSnapshot.NotFound",
+                                        "DeleteSnapshot")
+            return _ok()
+        return self._call("DeleteSnapshot", run)
+
+    @staticmethod
+    def __page(items, id_key, token, size):
+        """
+        Cut a page out of items sorted by id, the token is the last id of the
+        previous page so deletions don't shift the pages.
+        """
+        if token:
+            items = [x for x in items if x[id_key] > token]
+        page = items[:size]
+        return page, page[-1][id_key] if len(items) > size else None
+
+    @staticmethod
+    def __matches(tag_filter, tags):
+        """
+        Evaluate a "tag-key" or "tag:<key>" filter.
+        """
+        if tag_filter["Name"] == "tag-key":
+            return any(x in tags for x in tag_filter["Values"])
+        if tag_filter["Name"].startswith("tag:"):
+            return tags.get(tag_filter["Name"][4:]) in tag_filter["Values"]
+        return True
+
+
+class FakeAutoscaling(FakeClient):
+    """
+    Fake autoscaling client.
+    """
+    service_name = "autoscaling"
+
+    def describe_auto_scaling_instances(self, InstanceIds=(), **kwargs):
+        def run():
+            return _ok(AutoScalingInstances=[
+                dict(self._aws.asg_instances[x]) for x in InstanceIds
+                if x in self._aws.asg_instances])
+        return self._call("DescribeAutoScalingInstances", run)
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames=(),
+                                     **kwargs):
+        def run():
+            groups = list()
+            for name in AutoScalingGroupNames:
+                groups.append({
+                    "AutoScalingGroupName": name,
+                    "Instances": [dict(x) for x in
+                                  self._aws.asg_instances.values()
+                                  if x["AutoScalingGroupName"] == name]
+                })
+            return _ok(AutoScalingGroups=groups)
+        return self._call("DescribeAutoScalingGroups", run)
+
+    def set_instance_protection(self, InstanceIds, AutoScalingGroupName,
+                                ProtectedFromScaleIn, **kwargs):
+        def run():
+            with self._aws.lock:
+                for x in InstanceIds:
+                    self._aws.asg_instances[x]["ProtectedFromScaleIn"] = \
+                        ProtectedFromScaleIn
+            return _ok()
+        return self._call("SetInstanceProtection", run)
+
+    def set_instance_health(self, InstanceId, HealthStatus, **kwargs):
+        def run():
+            with self._aws.lock:
+                self._aws.asg_instances[InstanceId]["HealthStatus"] = \
+                    HealthStatus.upper()
+            return _ok()
+        return self._call("SetInstanceHealth", run)
+
+
+class FakeDynamoDB(FakeClient):
+    """
+    Fake DynamoDB client supporting the conditions used by
+    :class:`ec2helper.dynamodb_lock.DynamoDBLock`. Writes are strongly
+    consistent.
+    """
+    service_name = "dynamodb"
+
+    def put_item(self, TableName, Item, **kwargs):
+        def run():
+            key = self.__key(TableName, Item, kwargs)
+            with self._aws.lock:
+                old = self._aws.items.get(key)
+                now = kwargs.get("ExpressionAttributeValues", {}).get(":now")
+                if old is not None and "ConditionExpression" in kwargs and (
+                        now is None or float(old["ExpiresAt"]["N"]) > float(
+                        now["N"])):
+                    raise _client_error("ConditionalCheckFailedException",
+                                        "PutItem")
+                self._aws.items[key] = dict(Item)
+            return _ok()
+        return self._call("PutItem", run)
+
+    def delete_item(self, TableName, Key, **kwargs):
+        def run():
+            key = self.__key(TableName, Key, kwargs)
+            values = kwargs.get("ExpressionAttributeValues", {})
+            with self._aws.lock:
+                old = self._aws.items.get(key)
+                if "ConditionExpression" in kwargs and (
+                        old is None or old["Owner"] != values[":owner"] or
+                        old["AcquiredAt"] != values[":time"]):
+                    raise _client_error("ConditionalCheckFailedException",
+                                        "DeleteItem")
+                self._aws.items.pop(key, None)
+            return _ok()
+        return self._call("DeleteItem", run)
+
+    @staticmethod
+    def __key(table_name, item, kwargs):
+        """
+        The hash key value is the only string attribute not named like the
+        lock attributes.
+        """
+        for name, value in item.items():
+            if name not in ("Owner", "AcquiredAt", "ExpiresAt") and "S" in value:
+                return table_name, value["S"]
+        raise _client_error("ValidationException", "PutItem")
+
+
+class FakeCloudWatch(FakeClient):
+    """
+    Fake CloudWatch client storing received datums.
+    """
+    service_name = "cloudwatch"
+
+    def put_metric_data(self, Namespace, MetricData, **kwargs):
+        def run():
+            with self._aws.lock:
+                self._aws.metric_data.extend(
+                    (Namespace, datum) for datum in MetricData)
+            return _ok()
+        return self._call("PutMetricData", run)
+
+
+class FakeAWS(object):
+    """
+    State and configuration of the fake AWS backend.
+
+    :param float latency: Mean round trip time of an API call in seconds.
+    :param float jitter: Maximum random deviation of :attr:`latency` in
+        seconds.
+    :param float consistency_delay: Seconds until a tag write becomes visible
+        to readers.
+    """
+    clients = {
+        "ec2": FakeEC2,
+        "autoscaling": FakeAutoscaling,
+        "dynamodb": FakeDynamoDB,
+        "cloudwatch": FakeCloudWatch,
+    }
+
+    def __init__(self, latency=0.0, jitter=0.0, consistency_delay=0.0):
+        """Constructor - see class docu."""
+        self.latency = latency
+        self.jitter = jitter
+        self.consistency_delay = consistency_delay
+        self.lock = threading.RLock()
+        #: Instance id to committed tags.
+        self.instances = dict()
+        #: Instance id to autoscaling instance record.
+        self.asg_instances = dict()
+        #: DynamoDB (table, key) to item.
+        self.items = dict()
+        #: (Namespace, datum) tuples received by PutMetricData.
+        self.metric_data = list()
+        #: Volume id to volume (as returned by DescribeVolumes).
+        self.volumes = dict()
+        #: Snapshot id to snapshot (as returned by DescribeSnapshots).
+        self.snapshots = dict()
+        #: (service, operation) to number of calls.
+        self.calls = collections.Counter()
+        #: "sent" and "received" to the JSON encoded bytes of the calls.
+        self.bytes = collections.Counter()
+        self._ids = itertools.count()
+        self._pending = collections.deque()
+
+    def install(self):
+        """
+        Make :mod:`ec2helper` use this backend for all clients.
+        """
+        set_client_factory(self.client)
+
+    @staticmethod
+    def uninstall():
+        """
+        Restore the default boto3 clients.
+        """
+        set_client_factory(None)
+
+    def client(self, service_name, region=None, endpoint_url=None,
+               timeout=None):
+        """
+        Client factory for :func:`ec2helper.clients.set_client_factory`.
+        Calls with a round trip time above the :code:`timeout` raise
+        :py:class:`botocore.exceptions.ReadTimeoutError` after it.
+        """
+        return self.clients[service_name](self, timeout)
+
+    def add_instance(self, instance_id, tags=None):
+        """
+        Add an instance with immediately visible tags.
+        """
+        with self.lock:
+            self.instances[instance_id] = dict(tags or {})
+
+    def add_autoscaling_group(self, name, size, tags=None):
+        """
+        Add an autoscaling group of :attr:`size` healthy instances.
+
+        :return: The instance ids.
+        :rtype: list[string]
+        """
+        ids = list()
+        for n in range(size):
+            instance_id = "i-{0}{1:08x}".format(
+                "".join("{0:02x}".format(ord(c) % 256) for c in name[:4]), n)
+            instance_tags = dict(tags or {})
+            instance_tags["aws:autoscaling:groupName"] = name
+            self.add_instance(instance_id, instance_tags)
+            with self.lock:
+                self.asg_instances[instance_id] = {
+                    "AutoScalingGroupName": name,
+                    "AvailabilityZone": "eu-central-1a",
+                    "HealthStatus": "HEALTHY",
+                    "InstanceId": instance_id,
+                    "LaunchConfigurationName": name + "-lc",
+                    "LifecycleState": "InService",
+                    "ProtectedFromScaleIn": False
+                }
+            ids.append(instance_id)
+        return ids
+
+    def add_volume(self, instance_id, device, tags=None):
+        """
+        Attach a new volume to an instance.
+
+        :return: The volume id.
+        :rtype: string
+        """
+        volume_id = "vol-{0:017x}".format(next(self._ids))
+        with self.lock:
+            self.volumes[volume_id] = {
+                "VolumeId": volume_id,
+                "Size": 8,
+                "State": "in-use",
+                "VolumeType": "gp2",
+                "AvailabilityZone": "eu-central-1a",
+                "Attachments": [{
+                    "Device": device,
+                    "InstanceId": instance_id,
+                    "State": "attached",
+                    "VolumeId": volume_id,
+                    "DeleteOnTermination": True
+                }],
+                "Tags": [{"Key": k, "Value": v} for k, v in
+                         sorted((tags or {}).items())]
+            }
+        return volume_id
+
+    def add_snapshot(self, volume_id, tags=None, state="pending"):
+        """
+        Add a snapshot, AWS style :attr:`tags`.
+
+        :return: The snapshot id.
+        :rtype: string
+        """
+        snapshot_id = "snap-{0:017x}".format(next(self._ids))
+        with self.lock:
+            self.snapshots[snapshot_id] = {
+                "SnapshotId": snapshot_id,
+                "VolumeId": volume_id,
+                "State": state,
+                "Progress": "100%" if state == "completed" else "0%",
+                "OwnerId": "123456789012",
+                "Tags": list(tags or [])
+            }
+        return snapshot_id
+
+    def count(self, service_name, operation_name):
+        """
+        Count an API call.
+        """
+        with self.lock:
+            self.calls[(service_name, operation_name)] += 1
+
+    def count_bytes(self, direction, size):
+        """
+        Count the bytes of a request ("sent") or response ("received").
+        """
+        with self.lock:
+            self.bytes[direction] += size
+
+    def total_calls(self):
+        """
+        :return: The number of API calls made so far.
+        :rtype: int
+        """
+        with self.lock:
+            return sum(self.calls.values())
+
+    def delay(self, timeout=None):
+        """
+        Sleep for half a round trip, for the :code:`timeout` and raise
+        :py:class:`botocore.exceptions.ReadTimeoutError` if the round trip
+        takes longer.
+        """
+        latency = self.latency
+        if self.jitter:
+            latency += random.uniform(-self.jitter, self.jitter)
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise ReadTimeoutError(endpoint_url="https://fake.amazonaws.com")
+        if latency > 0:
+            time.sleep(latency / 2)
+
+    def write_tag(self, instance_id, key, value):
+        """
+        Queue a tag write (:code:`None` deletes), it becomes visible after
+        :attr:`consistency_delay`.
+        """
+        with self.lock:
+            self._pending.append((time.time() + self.consistency_delay,
+                                  instance_id, key, value))
+            self.__apply_pending()
+
+    def visible_tags(self, instance_id):
+        """
+        :return: The tags of an instance as currently seen by readers.
+        :rtype: dict[string, string]
+        """
+        with self.lock:
+            self.__apply_pending()
+            return dict(self.instances.get(instance_id, {}))
+
+    def __apply_pending(self):
+        """
+        Commit all queued tag writes whose delay has passed. The delay is
+        constant, so the queue is ordered by visibility time.
+        """
+        now = time.time()
+        while self._pending and self._pending[0][0] <= now:
+            _, instance_id, key, value = self._pending.popleft()
+            tags = self.instances.setdefault(instance_id, {})
+            if value is None:
+                tags.pop(key, None)
+            else:
+                tags[key] = value
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Import time benchmark
+=====================
+
+Measures the time and the number of modules loaded by typical imports of
+:mod:`ec2helper`, each in a fresh interpreter. The "eager" scenario imports
+all submodules and their dependencies and probes the metadata API the way
+:code:`import ec2helper` used to, as the reference for the lazy imports.
+
+Reported are the median and minimum milliseconds over all runs and the
+modules loaded in addition to a bare interpreter.
+
+.. code-block:: none
+
+    python -m benchmarks.import_time --runs 20
+"""
+from __future__ import unicode_literals, absolute_import, division, \
+    print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SCENARIOS = (
+    ("import ec2helper", "import ec2helper"),
+    ("utils only", "from ec2helper import tags_to_dict, json_dump"),
+    ("cli client", "import ec2helper.cli, ec2helper.daemon"),
+    ("Instance", "from ec2helper import Instance"),
+    ("Instance + client", "from ec2helper import Instance; "
+                          "from ec2helper.clients import get_client; "
+                          "get_client('ec2', 'eu-central-1')"),
+    ("eager", "import ec2helper, pkgutil, importlib, boto3, requests, "
+              "ec2_metadata; [importlib.import_module('ec2helper.' + m.name) "
+              "for m in pkgutil.iter_modules(ec2helper.__path__) "
+              "if m.name != '__main__']; ec2helper.utils.is_ec2()"),
+)
+
+_PROBE = """
+import sys, time
+before = len(sys.modules)
+start = time.time()
+{0}
+print(time.time() - start, len(sys.modules) - before)
+"""
+
+
+def measure(statement, runs):
+    """
+    Run the statement in :attr:`runs` fresh interpreters.
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [x for x in [env.get("PYTHONPATH")] if x])
+    times = list()
+    modules = None
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _PROBE.format(statement)], env=env)
+        seconds, modules = output.decode("utf-8").split()[-2:]
+        times.append(float(seconds))
+    times.sort()
+    return {
+        "median_ms": round(times[len(times) // 2] * 1000, 1),
+        "min_ms": round(times[0] * 1000, 1),
+        "modules": int(modules)
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[4])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+    report = dict((name, measure(statement, args.runs)) for name, statement
+                  in SCENARIOS)
+    if args.json:
+        print(json.dumps(report, indent=4, sort_keys=True))
+    else:
+        for name, _ in SCENARIOS:
+            print("{0:20} {1}".format(name, report[name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Lock contention benchmark
+=========================
+
+Simulates N :class:`~ec2helper.instance.Instance` objects contending for the
+same lock of one lock group against :mod:`benchmarks.fake_aws`. Every instance
+runs in its own thread and repeatedly tries to get the lock, holds it for a
+while and releases it.
+
+Reported are the :code:`__enter__` latency percentiles of successful and
+failed attempts, API calls per successful acquisition, double grants (two
+instances inside the with-block at the same time) and the throughput of
+successful acquisitions.
+
+.. code-block:: none
+
+    python -m benchmarks.lock_contention --instances 200 --latency 0.05 \\
+        --consistency-delay 1 --duration 30 --backend tag
+"""
+from __future__ import unicode_literals, absolute_import, division, \
+    print_function
+import argparse
+import functools
+import json
+import random
+import threading
+import time
+from ec2helper.instance import Instance
+from ec2helper.errors import ResourceLockingError
+from ec2helper.dynamodb_lock import DynamoDBLock
+from benchmarks.fake_aws import FakeAWS
+
+LOCK_NAME = "BenchmarkLock"
+GROUP_NAME = "benchmark-asg"
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    rank = int(round(percent / 100 * (len(values) - 1)))
+    return values[rank]
+
+
+def summarize(values):
+    """
+    Latency percentiles in milliseconds.
+    """
+    values = sorted(values)
+    return dict((name, None if percentile(values, p) is None else round(
+        percentile(values, p) * 1000, 2)) for name, p in (
+        ("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)))
+
+
+class Contention(object):
+    """
+    One benchmark run.
+
+    :param int instances: Number of contending instances.
+    :param float duration: Seconds to run.
+    :param float hold: Seconds to hold the lock.
+    :param float think: Maximum random pause between two attempts in seconds.
+    :param string backend: "tag" or "dynamodb".
+    :param string group: "asg" to use the autoscaling group as lock group or
+        "tag" to use a tag key-value combination.
+    :param bool check_health: Passed to :func:`Instance.lock`.
+    :param aws: The :class:`~benchmarks.fake_aws.FakeAWS` backend.
+    """
+
+    def __init__(self, instances, duration, hold, think, backend, group,
+                 check_health, aws):
+        """Constructor - see class docu."""
+        self.duration = duration
+        self.hold = hold
+        self.think = think
+        self.group = group
+        self.check_health = check_health
+        self.aws = aws
+        self.backend = None if backend == "tag" else functools.partial(
+            DynamoDBLock, table_name="benchmark-locks")
+        self.instance_ids = aws.add_autoscaling_group(
+            GROUP_NAME, instances, tags={"LockGroup": "benchmark"})
+        self.acquired = list()
+        self.rejected = list()
+        self.errors = list()
+        self.double_grants = 0
+        self._holders = set()
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Run the benchmark and return the report.
+
+        :rtype: dict
+        """
+        self.aws.install()
+        stop = time.time() + self.duration
+        threads = [threading.Thread(target=self.worker, args=(x, stop))
+                   for x in self.instance_ids]
+        calls_before = self.aws.total_calls()
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        calls = self.aws.total_calls() - calls_before
+        attempts = len(self.acquired) + len(self.rejected) + len(self.errors)
+        return {
+            "instances": len(self.instance_ids),
+            "elapsed_s": round(elapsed, 2),
+            "attempts": attempts,
+            "acquisitions": len(self.acquired),
+            "rejections": len(self.rejected),
+            "errors": len(self.errors),
+            "double_grants": self.double_grants,
+            "throughput_per_s": round(len(self.acquired) / elapsed, 2),
+            "api_calls": calls,
+            "api_calls_per_acquisition": round(
+                calls / len(self.acquired), 1) if self.acquired else None,
+            "api_calls_per_attempt": round(
+                calls / attempts, 1) if attempts else None,
+            "acquire_latency_ms": summarize(self.acquired),
+            "reject_latency_ms": summarize(self.rejected),
+            "calls": dict(("{0}:{1}".format(*k), v) for k, v in
+                          sorted(self.aws.calls.items())),
+        }
+
+    def worker(self, instance_id, stop):
+        """
+        Try to get the lock until :attr:`stop`.
+        """
+        instance = Instance(instance_id, "fake-region")
+        if self.group == "tag":
+            group_tag, group_value = "LockGroup", "benchmark"
+        else:
+            group_tag, group_value = None, None
+        time.sleep(random.uniform(0, self.think))
+        while time.time() < stop:
+            start = time.time()
+            guard = instance.lock(LOCK_NAME, group_tag, group_value, ttl=10,
+                                  check_health=self.check_health,
+                                  backend=self.backend)
+            try:
+                guard.__enter__()
+            except ResourceLockingError:
+                self.__record(self.rejected, time.time() - start)
+            except Exception as e:
+                self.__record(self.errors, e)
+            else:
+                self.__record(self.acquired, time.time() - start)
+                self.__critical_section(instance_id)
+                guard.__exit__(None, None, None)
+            time.sleep(random.uniform(0, self.think))
+
+    def __critical_section(self, instance_id):
+        """
+        Hold the lock and detect other holders.
+        """
+        with self._lock:
+            if self._holders:
+                self.double_grants += 1
+            self._holders.add(instance_id)
+        time.sleep(self.hold)
+        with self._lock:
+            self._holders.discard(instance_id)
+
+    def __record(self, target, value):
+        """
+        Thread safe append.
+        """
+        with self._lock:
+            target.append(value)
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[4])
+    parser.add_argument("--instances", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--hold", type=float, default=0.1,
+                        help="seconds to hold the lock")
+    parser.add_argument("--think", type=float, default=0.5,
+                        help="max. random pause between attempts")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="API round trip time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--consistency-delay", type=float, default=1.0,
+                        help="seconds until tag writes become visible")
+    parser.add_argument("--backend", choices=("tag", "dynamodb"),
+                        default="tag")
+    parser.add_argument("--group", choices=("asg", "tag"), default="asg")
+    parser.add_argument("--no-health-check", action="store_true")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+    aws = FakeAWS(latency=args.latency, jitter=args.jitter,
+                  consistency_delay=args.consistency_delay)
+    report = Contention(args.instances, args.duration, args.hold, args.think,
+                        args.backend, args.group, not args.no_health_check,
+                        aws).run()
+    if args.json:
+        print(json.dumps(report, indent=4, sort_keys=True))
+    else:
+        for key in sorted(report):
+            print("{0:28} {1}".format(key, report[key]))
+
+
+if __name__ == "__main__":
+    main()
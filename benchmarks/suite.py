@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite
+===============
+
+Runs every public operation of :mod:`ec2helper` against
+:mod:`benchmarks.fake_aws` for several fleet sizes (the number of instances
+in the account and autoscaling group the operations run in). Every operation
+runs on a fresh :class:`~ec2helper.instance.Instance`, so caches start cold.
+
+Reported per operation and fleet size are the median wall time, the API calls
+and the (JSON encoded) bytes sent and received per run and the peak memory
+allocated during a run (measured with :py:mod:`tracemalloc` in a separate run,
+so tracing doesn't distort the times).
+
+Results can be saved and compared with a former run, API calls or bytes above
+and times more than :code:`--time-tolerance` above the baseline are reported
+as regressions (exit status 1).
+
+.. code-block:: none
+
+    python -m benchmarks.suite --sizes 10,100,1000,10000 --output base.json
+    python -m benchmarks.suite --sizes 10,100,1000,10000 --baseline base.json
+"""
+from __future__ import unicode_literals, absolute_import, division, \
+    print_function
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from ec2helper import Instance, get_instances_by_tag, \
+    get_instance_tags_by_tag, get_instance_status_by_autoscaling_group, \
+    get_instances_by_autoscaling_group, \
+    get_instance_tags_by_autoscaling_group, get_fleet_autoscaling, \
+    set_fleet_protection, set_fleet_health, sweep_expired_snapshots, \
+    wait_for_snapshots
+from ec2helper.emf import MAX_EMF_VALUES, emf_records
+from ec2helper.errors import SnapshotTimeout
+from benchmarks.fake_aws import FakeAWS
+
+REGION = "eu-central-1"
+GROUP_NAME = "bench-asg"
+EXPIRED = "2000-01-01T00:00:00+00:00"
+MISSING = "snap-fffffffffffffffff"
+#: Delete tag values that are no times, snapshots tagged with them are kept.
+UNDATED = ("7", "May", "2018", "1.5")
+
+
+class Context(object):
+    """
+    The fake account of one fleet size.
+
+    :param int size: The number of instances.
+    :param aws: The :class:`~benchmarks.fake_aws.FakeAWS` backend.
+    """
+
+    def __init__(self, size, aws):
+        """Constructor - see class docu."""
+        self.aws = aws
+        self.ids = aws.add_autoscaling_group(GROUP_NAME, size, {
+            "Name": "bench", "Stage": "prod"})
+        #: The instance the instance operations run on.
+        self.id = self.ids[0]
+        #: The snapshots added by :meth:`add_undated_backups`.
+        self.undated = list()
+        #: Completed snapshots to wait for, see :meth:`add_snapshots`.
+        self.snapshot_ids = list()
+        for device in ("/dev/xvda", "/dev/xvdf"):
+            aws.add_volume(self.id, device, {"Data": device[-1]})
+
+    def instance(self):
+        """
+        A fresh instance object for the subject instance.
+        """
+        return Instance(self.id, REGION)
+
+    def reset_autoscaling(self):
+        """
+        Restore the autoscaling state of all instances.
+        """
+        with self.aws.lock:
+            for data in self.aws.asg_instances.values():
+                data["ProtectedFromScaleIn"] = False
+                data["HealthStatus"] = "HEALTHY"
+                data["LifecycleState"] = "InService"
+
+    def add_expired_backups(self, instance_ids):
+        """
+        Add an expired backup snapshot for each instance.
+        """
+        for instance_id in instance_ids:
+            self.aws.add_snapshot("vol-0", [
+                {"Key": "InstanceId", "Value": instance_id},
+                {"Key": "DeleteAfter", "Value": EXPIRED}], "completed")
+
+    def add_undated_backups(self):
+        """
+        Add a backup snapshot for each of :data:`UNDATED` and an expired one.
+
+        :return: The ids of the snapshots that must not be deleted.
+        :rtype: list[string]
+        """
+        self.add_expired_backups([self.id])
+        self.undated = [self.aws.add_snapshot("vol-0", [
+            {"Key": "InstanceId", "Value": self.id},
+            {"Key": "DeleteAfter", "Value": x}], "completed") for x in UNDATED]
+        return self.undated
+
+    def add_snapshots(self):
+        """
+        Add a completed snapshot for each instance (once).
+        """
+        if not self.snapshot_ids:
+            self.snapshot_ids = [self.aws.add_snapshot(
+                "vol-0", state="completed") for _ in self.ids]
+
+    def add_temp_tag(self):
+        """
+        Add a tag to delete.
+        """
+        self.aws.write_tag(self.id, "Temp", "1")
+
+
+def _lock(ctx):
+    i = ctx.instance()
+    with i.lock("BenchLock"):
+        pass
+
+
+def _protection(ctx):
+    i = ctx.instance()
+    with i.autoscaling_protection():
+        pass
+
+
+def _metric_buffer(ctx):
+    i = ctx.instance()
+    with i.metric_buffer():
+        for n in range(1000):
+            i.put_metric_data("Bench", n)
+
+
+def _embedded_aggregation(ctx):
+    i = ctx.instance()
+    with i.embedded_metrics(io.StringIO()), i.metric_aggregation():
+        for n in range(1000):
+            i.put_metric_data("Bench", n % 10)
+
+
+def _emf_large_sample_count(ctx):
+    for datum in ({"StatisticValues": {
+            "SampleCount": 1e6, "Sum": 5e6, "Minimum": 1, "Maximum": 10}},
+            {"Values": [1, 5, 10], "Counts": [1e6, 1e6, 1]}):
+        records = emf_records("Bench", dict(datum, MetricName="Bench"))
+        if len(records) != 1 or len(records[0]["Bench"]) > MAX_EMF_VALUES:
+            raise AssertionError("{0} EMF records of {1} values.".format(
+                len(records), sum(len(x["Bench"]) for x in records)))
+
+
+def _sweep_undated(ctx):
+    sweep_expired_snapshots(region=REGION, rate=None)
+    deleted = [value for value, snapshot_id in zip(UNDATED, ctx.undated) if
+               ctx.aws.snapshots.pop(snapshot_id, None) is None]
+    if deleted:
+        raise AssertionError("Snapshots with delete tags {0} deleted.".format(
+            ", ".join(deleted)))
+
+
+def _wait_missing(ctx):
+    try:
+        wait_for_snapshots(ctx.snapshot_ids + [MISSING], REGION, timeout=0)
+    except SnapshotTimeout as e:
+        if str(e) != "Snapshots not completed: " + MISSING or \
+                sorted(e.snapshots) != sorted(ctx.snapshot_ids):
+            raise
+    else:
+        raise AssertionError("Missing snapshot not reported.")
+
+
+def _set(attribute, value):
+    def run(ctx):
+        setattr(ctx.instance(), attribute, value)
+    return run
+
+
+#: (name, operation, setup before each run) - all operations.
+OPERATIONS = (
+    ("tags", lambda ctx: ctx.instance().tags, None),
+    ("update_tags", lambda ctx: ctx.instance().update_tags(Stage="prod"),
+     None),
+    ("tags_setter", _set("tags", {"Stage": "prod"}), None),
+    ("delete_tags", lambda ctx: ctx.instance().delete_tags("Temp"),
+     Context.add_temp_tag),
+    ("autoscaling", lambda ctx: ctx.instance().autoscaling, None),
+    ("autoscaling_protected", _set("autoscaling_protected", True),
+     Context.reset_autoscaling),
+    ("autoscaling_healthy", _set("autoscaling_healthy", True),
+     Context.reset_autoscaling),
+    ("autoscaling_standby", lambda ctx: ctx.instance().autoscaling_standby,
+     None),
+    ("autoscaling_protection", _protection, Context.reset_autoscaling),
+    ("lock", _lock, Context.reset_autoscaling),
+    ("put_metric_data", lambda ctx: ctx.instance().put_metric_data(
+        "Bench", 1), None),
+    ("put_metric_data_ec2_group",
+     lambda ctx: ctx.instance().put_metric_data_ec2_group(
+         "aws:autoscaling:groupName", "Bench", 1), None),
+    ("metric_buffer_1000", _metric_buffer, None),
+    ("embedded_metric_aggregation_1000", _embedded_aggregation, None),
+    ("emf_large_sample_count", _emf_large_sample_count, None),
+    ("volumes", lambda ctx: ctx.instance().volumes, None),
+    ("create_backup", lambda ctx: ctx.instance().create_backup(), None),
+    ("create_backup_multi_volume",
+     lambda ctx: ctx.instance().create_backup(multi_volume=True), None),
+    ("delete_old_backups", lambda ctx: ctx.instance().delete_old_backups(
+        rate=None), lambda ctx: ctx.add_expired_backups([ctx.id] * 20)),
+    ("get_instances_by_tag", lambda ctx: get_instances_by_tag(
+        "Stage", "prod", REGION), None),
+    ("get_instance_tags_by_tag", lambda ctx: get_instance_tags_by_tag(
+        "Stage", "prod", REGION), None),
+    ("get_instance_status_by_autoscaling_group",
+     lambda ctx: get_instance_status_by_autoscaling_group(GROUP_NAME, REGION),
+     None),
+    ("get_instances_by_autoscaling_group",
+     lambda ctx: get_instances_by_autoscaling_group(GROUP_NAME, REGION),
+     None),
+    ("get_instance_tags_by_autoscaling_group",
+     lambda ctx: get_instance_tags_by_autoscaling_group(GROUP_NAME, REGION),
+     None),
+    ("get_fleet_autoscaling", lambda ctx: get_fleet_autoscaling(
+        ctx.ids, REGION), None),
+    ("set_fleet_protection", lambda ctx: set_fleet_protection(
+        ctx.ids, True, REGION), Context.reset_autoscaling),
+    ("set_fleet_health", lambda ctx: set_fleet_health(
+        ctx.ids, False, REGION), Context.reset_autoscaling),
+    ("sweep_expired_snapshots", lambda ctx: sweep_expired_snapshots(
+        region=REGION, rate=None), lambda ctx: ctx.add_expired_backups(
+        ctx.ids)),
+    ("wait_for_snapshots", lambda ctx: wait_for_snapshots(
+        ctx.snapshot_ids, REGION), Context.add_snapshots),
+    ("wait_for_snapshots_missing", _wait_missing, Context.add_snapshots),
+    ("sweep_expired_snapshots_undated", _sweep_undated,
+     Context.add_undated_backups),
+)
+
+
+def _reset_peak():
+    """
+    Start a new peak memory measurement.
+    """
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:  # pragma: no cover - Python < 3.9
+        tracemalloc.clear_traces()
+
+
+def measure(ctx, operation, setup, runs):
+    """
+    Measure one operation.
+
+    :return: The metrics of the operation.
+    :rtype: dict[string, float]
+    """
+    aws = ctx.aws
+    times = list()
+    for _ in range(runs):
+        if setup is not None:
+            setup(ctx)
+        calls = aws.total_calls()
+        sent, received = aws.bytes["sent"], aws.bytes["received"]
+        start = time.time()
+        operation(ctx)
+        times.append(time.time() - start)
+        calls = aws.total_calls() - calls
+        sent = aws.bytes["sent"] - sent
+        received = aws.bytes["received"] - received
+    if setup is not None:
+        setup(ctx)
+    tracemalloc.start()
+    try:
+        _reset_peak()
+        operation(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    times.sort()
+    return {
+        "time_ms": round(times[len(times) // 2] * 1000, 2),
+        "api_calls": calls,
+        "bytes_sent": sent,
+        "bytes_received": received,
+        "peak_memory_kib": round(peak / 1024, 1)
+    }
+
+
+def run_suite(sizes, runs, latency, jitter, names=None):
+    """
+    Run the operations for all fleet sizes.
+
+    :return: The metrics by fleet size (as string) and operation.
+    :rtype: dict[string, dict[string, dict[string, float]]]
+    """
+    results = dict()
+    for size in sizes:
+        aws = FakeAWS(latency=latency, jitter=jitter)
+        aws.install()
+        try:
+            ctx = Context(size, aws)
+            results[str(size)] = dict(
+                (name, measure(ctx, operation, setup, runs)) for
+                name, operation, setup in OPERATIONS if
+                names is None or name in names)
+        finally:
+            aws.uninstall()
+    return results
+
+
+def compare(results, baseline, time_tolerance):
+    """
+    Find regressions compared to a baseline.
+
+    :return: Descriptions of the regressions.
+    :rtype: list[string]
+    """
+    regressions = list()
+    for size in sorted(results, key=int):
+        for name in sorted(results[size]):
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            now = results[size][name]
+            for key in ("api_calls", "bytes_sent", "bytes_received"):
+                if now[key] > before[key]:
+                    regressions.append("{0} @ {1}: {2} {3} -> {4}".format(
+                        name, size, key, before[key], now[key]))
+            if now["time_ms"] > before["time_ms"] * (1 + time_tolerance) \
+                    and now["time_ms"] - before["time_ms"] > 1:
+                regressions.append("{0} @ {1}: time_ms {2} -> {3}".format(
+                    name, size, before["time_ms"], now["time_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[4])
+    parser.add_argument("--sizes", default="10,100,1000,10000",
+                        help="comma separated fleet sizes")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="timed runs per operation")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="API round trip time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--operations", help="comma separated operations "
+                        "to run (default: all)")
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare with saved results")
+    parser.add_argument("--time-tolerance", type=float, default=0.25,
+                        help="relative time increase reported as regression")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args(argv)
+    sizes = [int(x) for x in args.sizes.split(",")]
+    names = set(args.operations.split(",")) if args.operations else None
+    results = run_suite(sizes, args.runs, args.latency, args.jitter, names)
+    if args.output:
+        with io.open(args.output, "w", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "meta": {
+                    "python": platform.python_version(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                          time.gmtime()),
+                    "latency": args.latency,
+                    "runs": args.runs
+                },
+                "results": results
+            }, indent=4, sort_keys=True))
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+    else:
+        columns = ("time_ms", "api_calls", "bytes_sent", "bytes_received",
+                   "peak_memory_kib")
+        print("{0:42} {1:>6} ".format("operation", "size") +
+              " ".join("{0:>15}".format(x) for x in columns))
+        for size in sorted(results, key=int):
+            for name in sorted(results[size]):
+                print("{0:42} {1:>6} ".format(name, size) + " ".join(
+                    "{0:>15}".format(results[size][name][x]) for x in
+                    columns))
+    if args.baseline:
+        with io.open(args.baseline, encoding="utf-8") as f:
+            baseline = json.loads(f.read())["results"]
+        regressions = compare(results, baseline, args.time_tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,65 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import importlib
+import sys
 
-from ec2helper.instance import Instance
-from ec2helper.utils import *
-from ec2helper.get_instances import *
+# The public names and the modules they are imported from on first access,
+# so scripts only pay for the modules (boto3, psutil, ...) they actually use.
+_LAZY = {
+    "Instance": "ec2helper.instance",
+    "ApiCallBudget": "ec2helper.api_budget",
+    "Deadline": "ec2helper.deadline",
+    "IS_EC2": "ec2helper.utils",
+    "is_ec2": "ec2helper.utils",
+    "metadata": "ec2helper.utils",
+    "json_dump": "ec2helper.utils",
+    "tags_to_dict": "ec2helper.utils",
+    "dict_to_tags": "ec2helper.utils",
+    "INTEGER": "ec2helper.utils",
+    "FLOAT": "ec2helper.utils",
+    "ISOTIME": "ec2helper.utils",
+    "get_instances_by_tag": "ec2helper.get_instances",
+    "get_instance_tags_by_tag": "ec2helper.get_instances",
+    "get_instance_status_by_autoscaling_group": "ec2helper.get_instances",
+    "get_instances_by_autoscaling_group": "ec2helper.get_instances",
+    "get_instance_tags_by_autoscaling_group": "ec2helper.get_instances",
+    "get_fleet_autoscaling": "ec2helper.fleet",
+    "set_fleet_protection": "ec2helper.fleet",
+    "set_fleet_health": "ec2helper.fleet",
+    "delete_snapshots": "ec2helper.snapshots",
+    "sweep_expired_snapshots": "ec2helper.snapshots",
+    "wait_for_snapshots": "ec2helper.snapshots",
+}
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    """
+    Import public names and submodules on first access.
+    """
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        if name != "IS_EC2":
+            globals()[name] = value
+        return value
+    module = "{0}.{1}".format(__name__, name)
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        if getattr(e, "name", module) != module:
+            raise
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(
+            __name__, name))
+
+
+def __dir__():
+    """
+    List the lazy names too.
+    """
+    return sorted(set(globals()) | set(_LAZY))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover - no module __getattr__
+    for _name in __all__:
+        globals()[_name] = __getattr__(_name)
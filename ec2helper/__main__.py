@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import sys
+from ec2helper.cli import main
+
+sys.exit(main())
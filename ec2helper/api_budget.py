@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+API call budgets
+================
+
+Every AWS API call counts against the account's (per region and operation)
+request limits, so the number of calls an operation makes decides when it
+gets throttled. An :class:`~ec2helper.api_budget.ApiCallBudget` counts the
+calls made inside its scope by service and operation and optionally raises
+:class:`~ec2helper.errors.ApiCallBudgetExceeded` as soon as a maximum is
+exceeded, e.g. to catch changes adding calls to an operation in tests.
+
+.. code-block:: python
+
+    from ec2helper import Instance
+    from ec2helper.api_budget import ApiCallBudget
+
+    i = Instance()
+    with ApiCallBudget(max_calls=20, limits={"DescribeTags": 10}) as budget:
+        with i.lock("MyLock"):
+            pass
+    print(budget.total, budget.calls)
+
+Calls are counted in all threads (e.g. the thread pools of
+:func:`~ec2helper.instance.Instance.create_backup`), so calls made by other
+threads at the same time are counted too. Budgets can be nested, every call is
+counted by all active budgets. Each page of a paginated call counts as one
+call, retries don't.
+"""
+from __future__ import unicode_literals, absolute_import
+import threading
+from collections import Counter
+from ec2helper.clients import add_call_hook, remove_call_hook
+from ec2helper.errors import ApiCallBudgetExceeded
+
+
+class ApiCallBudget(object):
+    """
+    Context guard counting (and limiting) the AWS API calls made with the
+    clients of :mod:`ec2helper.clients` inside its scope.
+
+    :param int max_calls: The maximum number of calls in total, the call
+        exceeding it raises :class:`~ec2helper.errors.ApiCallBudgetExceeded`
+        instead of being made. :code:`None` for no limit.
+    :param dict limits: The maximum number of calls by operation, keys are
+        operation names (e.g. "DescribeTags") or service and operation name
+        separated by a colon (e.g. "ec2:DescribeTags").
+    """
+
+    def __init__(self, max_calls=None, limits=None):
+        """Constructor - see class docu."""
+        #: The :code:`max_calls` parameter.
+        self.max_calls = max_calls
+        #: The :code:`limits` parameter.
+        self.limits = dict(limits or dict())
+        #: :py:class:`~collections.Counter` of the calls by (service name,
+        #: operation name), e.g. :code:`("ec2", "DescribeTags")`.
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        """
+        Start counting.
+        """
+        add_call_hook(self.__count)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Stop counting.
+        """
+        remove_call_hook(self.__count)
+
+    @property
+    def total(self):
+        """
+        The number of calls in total.
+
+        :rtype: int
+        """
+        with self._lock:
+            return sum(self.calls.values())
+
+    @property
+    def by_operation(self):
+        """
+        The number of calls by operation name (summed over all services).
+
+        :rtype: collections.Counter
+        """
+        result = Counter()
+        with self._lock:
+            for (service_name, operation_name), n in self.calls.items():
+                result[operation_name] += n
+        return result
+
+    def __count(self, service_name, operation_name):
+        """
+        Count a call, raise if it exceeds the budget.
+        """
+        with self._lock:
+            self.calls[(service_name, operation_name)] += 1
+            total = sum(self.calls.values())
+            operation = sum(n for (_, name), n in self.calls.items() if
+                            name == operation_name)
+            service_operation = self.calls[(service_name, operation_name)]
+            calls = Counter(self.calls)
+        if self.max_calls is not None and total > self.max_calls:
+            raise ApiCallBudgetExceeded(
+                "API call budget of {0} calls exceeded by {1}:{2}.".format(
+                    self.max_calls, service_name, operation_name), calls)
+        for key, n in ((operation_name, operation), ("{0}:{1}".format(
+                service_name, operation_name), service_operation)):
+            limit = self.limits.get(key)
+            if limit is not None and n > limit:
+                raise ApiCallBudgetExceeded(
+                    "API call budget of {0} {1} calls exceeded.".format(
+                        limit, key), calls)
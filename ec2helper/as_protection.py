@@ -5,16 +5,307 @@ The AutoscalingProtection context guard
 
 This class is not meant to be used directly, use
 :func:`ec2helper.instance.Instance.autoscaling_protection` instead.
-The properties of this context guard are readonly and can be accessed inside 
+The properties of this context guard are readonly and can be accessed inside
 the with-block.
+
+Scale in protection is reference counted per instance for the whole process,
+so nested and concurrent (threads) context guards as well as
+:func:`~ec2helper.instance.Instance.lock` share it: only the first guard
+entered reads the autoscaling state and sets the protection, only the last
+guard left restores the former state. Guards entered while the instance is
+already protected make no API calls at all.
+
+Several processes on the same host coordinate through a state file per
+instance in a host local directory: "/run/ec2helper" or
+"<tempdir>/ec2helper-<uid>", created with mode 0700 and only used if it is
+a directory (no symlink) owned by the effective user, so only processes of
+the same user share it. State files are created with mode 0600 and opened
+without following symlinks. To coordinate processes of several users set
+:code:`$EC2HELPER_RUN_DIR` to a directory they all may write (e.g. owned by
+a shared group), its state files are created with mode 0660 and everybody
+able to write them is trusted. The file is locked with
+:py:func:`fcntl.flock` and lists the processes currently holding the
+protection, so it is set when the first process enters and restored when the
+last one exits. Entries of processes that died are ignored. On systems without
+:py:mod:`fcntl` protection is only coordinated within the process.
 """
 from __future__ import unicode_literals, absolute_import
+import errno
+import json
+import os
+import stat
+import tempfile
+import threading
+import psutil
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+_UNKNOWN = object()
+_protections = dict()
+_protections_lock = threading.Lock()
+_run_dir = _UNKNOWN
+_run_dir_shared = False
+
+
+class _Protection(object):
+    """
+    Process wide scale in protection state of one instance.
+    """
+
+    def __init__(self):
+        """Constructor - see class docu."""
+        self.lock = threading.Lock()
+        self.count = 0
+        self.autoscaling = None
+
+
+def _get_protection(instance):
+    """
+    Get the protection state for the given instance.
+    """
+    key = (instance.region, instance.id)
+    with _protections_lock:
+        if key not in _protections:
+            _protections[key] = _Protection()
+        return _protections[key]
+
+
+def _run_dir_candidates():
+    """
+    The default host local directories, most preferred first.
+    """
+    return ["/run/ec2helper", os.path.join(
+        tempfile.gettempdir(), "ec2helper-{0}".format(os.geteuid()))]
+
+
+def _is_private_dir(path):
+    """
+    Create the directory with mode 0700 or check that the existing one is a
+    directory (no symlink) owned by the effective user and not writable by
+    others.
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and \
+        not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _get_run_dir():
+    """
+    Find (and create) the host local directory for the protection state
+    files, :code:`None` if there is no usable one.
+    """
+    global _run_dir, _run_dir_shared
+    if _run_dir is not _UNKNOWN:
+        return _run_dir
+    _run_dir = None
+    if fcntl is None:
+        return None
+    shared = os.environ.get("EC2HELPER_RUN_DIR")
+    if shared:
+        if os.path.isdir(shared) and os.access(shared, os.W_OK | os.X_OK):
+            _run_dir = shared
+            _run_dir_shared = True
+        return _run_dir
+    for candidate in _run_dir_candidates():
+        if _is_private_dir(candidate):
+            _run_dir = candidate
+            break
+    return _run_dir
+
+
+def _open_state_file(path):
+    """
+    Open (or create) a state file in the run directory for reading and
+    writing without following symlinks, :code:`None` if it can't be opened
+    or is no regular file (of the effective user, unless the run directory
+    is shared).
+    """
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+    try:
+        fd = os.open(path, flags, 0o660 if _run_dir_shared else 0o600)
+    except OSError:
+        return None
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or (
+            not _run_dir_shared and st.st_uid != os.geteuid()):
+        os.close(fd)
+        return None
+    return os.fdopen(fd, "r+")
+
+
+def _process_id():
+    """
+    Identify this process, the creation time guards against reused pids.
+    """
+    return [os.getpid(), psutil.Process().create_time()]
+
+
+def _is_alive(process_id):
+    """
+    Check if a process listed in a state file still exists.
+    """
+    pid, created = process_id
+    try:
+        return psutil.Process(pid).create_time() == created
+    except psutil.Error:
+        return False
+
+
+class _HostState(object):
+    """
+    Context guard giving exclusive access to the host wide protection state
+    of one instance. Yields :code:`None` if host coordination is unavailable.
+    """
+
+    def __init__(self, instance):
+        """Constructor - see class docu."""
+        self._path = None
+        self._file = None
+        run_dir = _get_run_dir()
+        if run_dir is not None:
+            self._path = os.path.join(
+                run_dir, "protection-{0}-{1}.json".format(instance.region,
+                                                          instance.id))
+
+    def __enter__(self):
+        """
+        Lock and read the state file.
+        """
+        if self._path is None:
+            return None
+        self._file = _open_state_file(self._path)
+        if self._file is None:
+            return None
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            state = json.loads(self._file.read() or "{}")
+        except ValueError:
+            state = dict()
+        me = _process_id()
+        state["processes"] = [x for x in state.get("processes", [])
+                              if x != me and _is_alive(x)]
+        state.setdefault("autoscaling", None)
+        return state
+
+    def write(self, state):
+        """
+        Replace the content of the state file.
+        """
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(json.dumps(state))
+        self._file.flush()
+
+    def __exit__(self, type, value, traceback):
+        """
+        Unlock and close the state file.
+        """
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def _set_protection(instance, autoscaling, value):
+    """
+    Set scale in protection unless the instance was protected before the
+    first guard anyway.
+    """
+    if autoscaling is not None and not autoscaling["ProtectedFromScaleIn"]:
+        instance._set_autoscaling_protected(
+            autoscaling["AutoScalingGroupName"], value)
+
+
+def _host_protect(instance, autoscaling):
+    """
+    Register this process as holder of the protection and protect the
+    instance if no other process on the host does.
+    """
+    host = _HostState(instance)
+    with host as state:
+        if state is not None and state["processes"]:
+            autoscaling = state["autoscaling"]
+        else:
+            if state is not None and state["autoscaling"] is not None:
+                # all holders died, keep their record of the original state
+                autoscaling = state["autoscaling"]
+            elif autoscaling is _UNKNOWN:
+                autoscaling = instance.autoscaling
+            _set_protection(instance, autoscaling, True)
+        if state is not None:
+            state["processes"].append(_process_id())
+            state["autoscaling"] = autoscaling
+            host.write(state)
+    return autoscaling
+
+
+def _host_release(instance, autoscaling):
+    """
+    Unregister this process as holder of the protection and restore the
+    original state if it was the last one on the host.
+    """
+    host = _HostState(instance)
+    with host as state:
+        if state is not None and state["processes"]:
+            host.write(state)
+            return
+        _set_protection(instance, autoscaling, False)
+        if state is not None:
+            host.write({"processes": [], "autoscaling": None})
+
+
+def _protect(instance, autoscaling=_UNKNOWN):
+    """
+    Increment the protection count of the instance and protect it from scale
+    in if this is the first reference on the host.
+
+    :param instance: The instance to protect.
+    :param autoscaling: The autoscaling status data if the caller already
+        knows it, to save an API call.
+    :return: The autoscaling status data at the time the protection was set,
+        :code:`None` if the instance is no autoscaling instance.
+    """
+    protection = _get_protection(instance)
+    with protection.lock:
+        if protection.count == 0:
+            protection.autoscaling = _host_protect(instance, autoscaling)
+        protection.count += 1
+        return protection.autoscaling
+
+
+def _release(instance):
+    """
+    Decrement the protection count of the instance and restore the former
+    protection state if this was the last reference on the host.
+
+    :param instance: The instance to release.
+    """
+    protection = _get_protection(instance)
+    with protection.lock:
+        if protection.count == 0:
+            return
+        protection.count -= 1
+        if protection.count == 0:
+            autoscaling = protection.autoscaling
+            protection.autoscaling = None
+            _host_release(instance, autoscaling)
 
 
 class AutoscalingProtection(object):
     """
     Context guard for scale in protection.
-        
+
     :param instance: The instance to protect.
     """
     _locked = False
@@ -23,17 +314,15 @@ class AutoscalingProtection(object):
         """Constructor - see class docu."""
         self._instance = instance
         #: The autoscaling status data as returned by
-        #: :attr:`ec2helper.instance.Instance.autoscaling` at the time the 
-        #: protection was set.
+        #: :attr:`ec2helper.instance.Instance.autoscaling` at the time the
+        #: protection was set (by the outermost guard).
         self.autoscaling = None
 
     def __enter__(self):
         """
         Protect this instance.
         """
-        self.autoscaling = self._instance.autoscaling
-        if self.autoscaling is not None:
-            self._instance.autoscaling_protected = True
+        self.autoscaling = _protect(self._instance)
         self._locked = True
         return self
 
@@ -41,9 +330,7 @@ class AutoscalingProtection(object):
         """
         Reset protection for this instance.
         """
-        if self.autoscaling is not None:
-            self._instance.autoscaling_protected = self.autoscaling[
-                "ProtectedFromScaleIn"]
+        _release(self._instance)
 
     def __setattr__(self, name, value):
         """
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+.. _psutil: https://psutil.readthedocs.io/en/latest/
+
+The BackupState context guard
+=============================
+
+This class is not meant to be used directly, use
+:func:`ec2helper.instance.Instance.create_backup` with
+:code:`incremental=True` instead.
+
+Incremental backups skip volumes nothing was written to since their last
+snapshot. At each backup the write counters of the local block devices (from
+psutil_'s :func:`disk_io_counters`, found with :mod:`ec2helper.devices`) are
+recorded per volume in a state file per instance in the host local directory
+also used for scale in protection (see :mod:`ec2helper.as_protection`). A
+volume is snapshotted again as soon as its write counter changed. Since the
+counters start over at boot, records of an earlier boot are ignored, as are
+volumes whose local device is unknown (e.g. when backing up another instance),
+so in doubt a volume is always snapshotted.
+"""
+from __future__ import unicode_literals, absolute_import
+import json
+import os
+import psutil
+from ec2helper.as_protection import _get_run_dir, _open_state_file, fcntl
+from ec2helper.devices import get_device_index
+
+
+class BackupState(object):
+    """
+    Context guard giving exclusive access to the incremental backup state of
+    an instance. The state is read on enter and written on a clean exit.
+
+    :param instance: The instance to backup.
+    """
+
+    def __init__(self, instance):
+        """Constructor - see class docu."""
+        self._path = None
+        self._file = None
+        self._state = None
+        self._counters = dict()
+        self._local = instance._is_local()
+        run_dir = _get_run_dir()
+        if run_dir is not None:
+            self._path = os.path.join(run_dir, "backup-{0}-{1}.json".format(
+                instance.region, instance.id))
+
+    def __enter__(self):
+        """
+        Lock and read the state file and sample the write counters.
+        """
+        boot_time = psutil.boot_time()
+        self._state = {"boot_time": boot_time, "volumes": dict()}
+        self._counters = psutil.disk_io_counters(perdisk=True) or dict()
+        if self._path is None:
+            return self
+        self._file = _open_state_file(self._path)
+        if self._file is None:
+            return self
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            state = json.loads(self._file.read() or "{}")
+        except ValueError:
+            state = dict()
+        if state.get("boot_time") == boot_time:
+            self._state["volumes"] = state.get("volumes", dict())
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Write (unless an exception occurred), unlock and close the state file.
+        """
+        if self._file is None:
+            return
+        try:
+            if type is None:
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.write(json.dumps(self._state))
+                self._file.flush()
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __write_count(self, volume):
+        """
+        The current write counter of the volume's local device, :code:`None`
+        if unknown.
+        """
+        if not self._local:
+            return None
+        name = get_device_index().volume_disk(volume["VolumeId"],
+                                              volume["Attachment"]["Device"])
+        if name not in self._counters:
+            return None
+        return self._counters[name].write_count
+
+    def changed(self, volumes):
+        """
+        Select the volumes written to since their last recorded backup.
+
+        :param dict volumes: Volumes by volume id as returned by
+            :attr:`ec2helper.instance.Instance.volumes`.
+        :return: The changed volumes by volume id.
+        :rtype: dict[string, dict]
+        """
+        changed = dict()
+        for volume_id, volume in volumes.items():
+            write_count = self.__write_count(volume)
+            if write_count is None or write_count != self._state[
+                    "volumes"].get(volume_id):
+                changed[volume_id] = volume
+        return changed
+
+    def record(self, volumes):
+        """
+        Record the write counters sampled on enter for the volumes backed up.
+
+        :param dict volumes: Volumes by volume id as returned by
+            :attr:`ec2helper.instance.Instance.volumes`.
+        """
+        for volume_id, volume in volumes.items():
+            write_count = self.__write_count(volume)
+            if write_count is None:
+                self._state["volumes"].pop(volume_id, None)
+            else:
+                self._state["volumes"][volume_id] = write_count
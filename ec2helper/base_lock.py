@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+The lock backend interface
+==========================
+
+:func:`ec2helper.instance.Instance.lock` does not implement a locking mechanism
+itself, it delegates to a lock backend. A lock backend is a context guard
+class derived from :class:`~ec2helper.base_lock.BaseLock` (or any callable
+returning such a context guard) that is constructed with the parameters of
+:func:`~ec2helper.instance.Instance.lock`.
+
+Available backends:
+
+* :class:`ec2helper.tag_lock.TagLock` (default) - EC2 instance tags.
+* :class:`ec2helper.dynamodb_lock.DynamoDBLock` - conditional writes to a
+  DynamoDB table.
+
+The properties of the context guards are readonly and can be accessed inside
+the with-block.
+"""
+from __future__ import unicode_literals, absolute_import
+from datetime import datetime, timedelta
+from dateutil import tz
+from ec2helper.errors import InstanceUnhealthy
+from ec2helper.as_protection import _protect, _release
+
+
+class BaseLock(object):
+    """
+    Common base class for lock backends. It holds the lock parameters and
+    implements health checks and scale in protection, a backend implements
+    :func:`__enter__` and :func:`__exit__` using these helpers.
+
+    For more details about the locking mechanism and the parameters see
+    :func:`ec2helper.instance.Instance.lock`.
+
+    :param instance: The instance for this lock.
+    :param lock_name: The name of the lock.
+    :param group_tag: The tag key of the lock group.
+    :param group_value: The tag value of the lock group.
+    :param ttl: The time in minutes the lock should be valid.
+    :param check_health: If true check health before locking.
+    """
+    _locked = False
+
+    def __init__(self, instance, lock_name, group_tag, group_value, ttl,
+                 check_health):
+        """Constructor - see class docu."""
+        self._instance = instance
+        #: The :code:`lock_name` parameter.
+        self.name = lock_name
+        #: The :code:`group_tag` parameter.
+        self.group_tag = group_tag
+        #: The :code:`group_value` parameter.
+        self.group_value = group_value
+        #: The :code:`ttl` parameter.
+        self.ttl = ttl
+        #: The :code:`check_health` parameter.
+        self.check_health = check_health
+        #: The autoscaling status data as returned by
+        #: :attr:`ec2helper.instance.Instance.autoscaling` at the time the
+        #: lock was set.
+        self.autoscaling = None
+        #: :py:mod:`datetime` when the lock was set.
+        self.time = None
+        #: :py:mod:`datetime` when the lock expires (after :code:`ttl` minutes).
+        self.end_time = None
+
+    def __enter__(self):
+        """
+        Lock this instance.
+        """
+        raise NotImplementedError()
+
+    def __exit__(self, type, value, traceback):
+        """
+        Unlock this instance.
+        """
+        raise NotImplementedError()
+
+    def __setattr__(self, name, value):
+        """
+        Make all attributes readonly after lock was set.
+        """
+        if self._locked:
+            raise AttributeError(
+                "Attributes of class '{0}' are readonly.".format(
+                    self.__class__.__name__))
+        else:
+            super(BaseLock, self).__setattr__(name, value)
+
+    def _set_lock_time(self):
+        """
+        Save internal datetime representations of "now" and "now+ttl" in UTC
+        time zone for ttl calculation.
+        """
+        self.time = datetime.now(tz=tz.tzutc()).replace(microsecond=0)
+        self.end_time = self.time + timedelta(seconds=self.ttl * 60)
+
+    def _backup_autoscaling_data(self):
+        """
+        Create a backup of the current autoscaling state of the instance.
+        """
+        self.autoscaling = self._instance.autoscaling
+
+    def _report_unhealthy(self):
+        """
+        Do not allow unhealty instances to get the lock if check_health = True
+        (default).
+        """
+        if self.check_health:
+            if self.autoscaling is not None:
+                if "HEALTHY" != self.autoscaling["HealthStatus"
+                ] or self.autoscaling["LifecycleState"] != "InService":
+                    raise InstanceUnhealthy()
+
+    def _autoscaling_protect(self):
+        """
+        If autoscaling, protect instance from scale in for lock duration.
+        The protection is shared with other locks and
+        :class:`~ec2helper.as_protection.AutoscalingProtection` guards of this
+        process.
+        """
+        _protect(self._instance, self.autoscaling)
+
+    def _autoscaling_reset_protection(self):
+        """
+        If autoscaling, set the original scale in protection state of the
+        instance on unlock (when no other guard of this process still needs
+        the protection).
+        """
+        _release(self._instance)
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface
+======================
+
+Module :mod:`ec2helper.cli` provides the :code:`ec2helper` command for shell
+scripts (run it as :code:`python -m ec2helper` or install
+:func:`ec2helper.cli.main` as console script). If an :mod:`ec2helper.daemon`
+is running, commands are sent to it and return in milliseconds, otherwise
+they run in the calling process. Only sockets owned by the calling user or
+root are used.
+
+.. code-block:: bash
+
+    ec2helper tags get Name
+    ec2helper tags set Stage=prod Backup=True
+    ec2helper autoscaling protect on
+    ec2helper metric put JobsDone 1 --dimension-from-tag Stage
+    ec2helper metadata availability_zone
+
+Values are printed as stored in tags (e.g. times in ISO format), structures
+as JSON. The exit status is 0 on success, 1 on errors (e.g. a tag that
+doesn't exist) and 2 on usage errors.
+"""
+from __future__ import unicode_literals, absolute_import, print_function
+import argparse
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from datetime import date, datetime
+
+
+class _UsageError(Exception):
+    """
+    Raised instead of exiting on invalid arguments.
+    """
+    pass
+
+
+class _Parser(argparse.ArgumentParser):
+    """
+    Argument parser raising :class:`_UsageError` instead of exiting.
+    """
+
+    def error(self, message):
+        """
+        Raise instead of exit.
+        """
+        raise _UsageError("{0}\n{1}: error: {2}\n".format(
+            self.format_usage().rstrip(), self.prog, message))
+
+
+def _key_value(value):
+    """
+    Parse a "KEY=VALUE" argument.
+    """
+    if "=" not in value:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is no KEY=VALUE pair".format(value))
+    return tuple(value.split("=", 1))
+
+
+def _on_off(value):
+    """
+    Parse an "on" / "off" argument.
+    """
+    if value not in ("on", "off"):
+        raise argparse.ArgumentTypeError("expected 'on' or 'off'")
+    return value == "on"
+
+
+def build_parser():
+    """
+    Build the argument parser of the :code:`ec2helper` command.
+
+    :rtype: argparse.ArgumentParser
+    """
+    parser = _Parser(prog="ec2helper",
+                     description="Common EC2 tasks for shell scripts.")
+    parser.add_argument("--instance-id", help="the instance (default: this "
+                        "EC2 instance)")
+    parser.add_argument("--region", help="the region (default: this EC2 "
+                        "instance's region)")
+    parser.add_argument("--socket", help="the daemon socket")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="don't use a running daemon")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    tags = commands.add_parser("tags", help="read and modify tags")
+    tags_commands = tags.add_subparsers(dest="action", metavar="ACTION")
+    tags_get = tags_commands.add_parser("get", help="print a tag value")
+    tags_get.add_argument("key")
+    tags_commands.add_parser("list", help="print all tags as JSON")
+    tags_set = tags_commands.add_parser("set", help="create or update tags")
+    tags_set.add_argument("tags", nargs="+", type=_key_value,
+                          metavar="KEY=VALUE")
+    tags_delete = tags_commands.add_parser("delete", help="delete tags")
+    tags_delete.add_argument("keys", nargs="+", metavar="KEY")
+
+    autoscaling = commands.add_parser("autoscaling",
+                                      help="read and modify autoscaling state")
+    as_commands = autoscaling.add_subparsers(dest="action", metavar="ACTION")
+    as_get = as_commands.add_parser("get", help="print the autoscaling state "
+                                    "as JSON or one of its attributes")
+    as_get.add_argument("attribute", nargs="?")
+    as_protect = as_commands.add_parser("protect",
+                                        help="set scale in protection")
+    as_protect.add_argument("state", type=_on_off, metavar="on|off")
+    as_healthy = as_commands.add_parser("healthy",
+                                        help="set the health status")
+    as_healthy.add_argument("state", type=_on_off, metavar="on|off")
+
+    metric = commands.add_parser("metric", help="upload cloudwatch metrics")
+    metric_commands = metric.add_subparsers(dest="action", metavar="ACTION")
+    metric_put = metric_commands.add_parser("put", help="put a metric value")
+    metric_put.add_argument("name")
+    metric_put.add_argument("value", type=float)
+    metric_put.add_argument("--unit", default="Count")
+    metric_put.add_argument("--namespace", default="AWS/EC2")
+    metric_put.add_argument("--dimension", action="append", type=_key_value,
+                            metavar="KEY=VALUE", dest="dimensions")
+    metric_put.add_argument("--dimension-from-tag")
+    metric_put.add_argument("--add-instance-dimension", action="store_true")
+
+    metadata = commands.add_parser("metadata", help="print EC2 metadata")
+    metadata.add_argument("attribute", help="an ec2_metadata attribute, "
+                          "e.g. availability_zone")
+
+    commands.add_parser("volumes", help="print the volumes as JSON")
+
+    daemon = commands.add_parser("daemon", help="run the daemon")
+    daemon.add_argument("--tag-ttl", type=float, default=30)
+    daemon.add_argument("--autoscaling-ttl", type=float, default=10)
+    daemon.add_argument("--metric-flush-interval", type=float, default=10)
+    return parser
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments.
+
+    :param list argv: The arguments (without program name).
+    :rtype: argparse.Namespace
+    :raises _UsageError: On invalid arguments.
+    """
+    args = build_parser().parse_args(argv)
+    if args.command is None or (args.command in (
+            "tags", "autoscaling", "metric") and args.action is None):
+        build_parser().error("missing command")
+    return args
+
+
+def _json_default(obj):
+    """
+    Serialize times in responses.
+    """
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _dumps(data):
+    """
+    Format structures for output.
+    """
+    return json.dumps(data, indent=4, sort_keys=True,
+                      default=_json_default) + "\n"
+
+
+def _value(value):
+    """
+    Format single values for output, like tag values are stored.
+    """
+    from ec2helper.utils import _string_value
+    return _string_value(value) + "\n"
+
+
+def run(args, session):
+    """
+    Run a command.
+
+    :param args: The parsed arguments, see :func:`parse_args`.
+    :param session: The :class:`~ec2helper.daemon.Session` to work on.
+    :return: The exit status and the output for stdout and stderr.
+    :rtype: tuple(int, string, string)
+    """
+    try:
+        return 0, _run(args, session), ""
+    except KeyError as e:
+        return 1, "", "Not found: {0}\n".format(e.args[0])
+    except Exception as e:
+        return 1, "", "{0}: {1}\n".format(type(e).__name__, e)
+
+
+def _run(args, session):
+    """
+    Run a command, see :func:`run`.
+    """
+    if args.command == "tags":
+        if args.action == "get":
+            return _value(session.tags[args.key])
+        if args.action == "list":
+            return _dumps(session.tags)
+        if args.action == "set":
+            session.update_tags(**dict(args.tags))
+        elif args.action == "delete":
+            session.delete_tags(*args.keys)
+        return ""
+    if args.command == "autoscaling":
+        if args.action == "get":
+            autoscaling = session.autoscaling
+            if args.attribute is None:
+                return _dumps(autoscaling)
+            if autoscaling is None:
+                raise KeyError("autoscaling instance")
+            return _value(autoscaling[args.attribute])
+        if args.action == "protect":
+            session.set_autoscaling("autoscaling_protected", args.state)
+        elif args.action == "healthy":
+            session.set_autoscaling("autoscaling_healthy", args.state)
+        return ""
+    if args.command == "metric":
+        session.put_metric_data(
+            args.name, args.value, args.unit, args.namespace,
+            dict(args.dimensions) if args.dimensions else None,
+            args.dimension_from_tag, args.add_instance_dimension)
+        return ""
+    if args.command == "metadata":
+        return _value(session.metadata(args.attribute))
+    if args.command == "volumes":
+        return _dumps(session.instance.volumes)
+    raise ValueError("Unknown command '{0}'.".format(args.command))
+
+
+def _trusted_socket(path):
+    """
+    Check that the path is a socket owned by this user or root, so commands
+    aren't sent to (and answers not taken from) another user's process.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid in (os.getuid(), 0)
+
+
+def _client_socket_path(args):
+    """
+    Find the socket of a running daemon without importing anything heavy,
+    :code:`None` if there is no trusted one.
+    """
+    if args.socket or os.environ.get("EC2HELPER_SOCKET"):
+        path = args.socket or os.environ["EC2HELPER_SOCKET"]
+        return path if _trusted_socket(path) else None
+    # the run directories of ec2helper.as_protection, without importing it
+    if os.environ.get("EC2HELPER_RUN_DIR"):
+        directories = [os.environ["EC2HELPER_RUN_DIR"]]
+    else:
+        directories = ["/run/ec2helper", os.path.join(
+            tempfile.gettempdir(), "ec2helper-{0}".format(os.geteuid()))]
+    for directory in directories:
+        path = os.path.join(directory, "ec2helper.sock")
+        if _trusted_socket(path):
+            return path
+    return None
+
+
+def _output(status, stdout, stderr):
+    """
+    Print the output and return the exit status.
+    """
+    if stdout:
+        sys.stdout.write(stdout)
+    if stderr:
+        sys.stderr.write(stderr)
+    return status
+
+
+def main(argv=None):
+    """
+    The entry point of the :code:`ec2helper` command.
+
+    :param list argv: The arguments (default: :code:`sys.argv[1:]`).
+    :return: The exit status.
+    :rtype: int
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    try:
+        args = parse_args(argv)
+    except _UsageError as e:
+        return _output(2, "", "{0}".format(e))
+    if args.command == "daemon":
+        from ec2helper.daemon import Daemon
+        Daemon(args.socket, args.tag_ttl, args.autoscaling_ttl,
+               args.metric_flush_interval).serve_forever()
+        return 0
+    socket_path = None if args.no_daemon else _client_socket_path(args)
+    if socket_path is not None:
+        from ec2helper.daemon import call
+        try:
+            response = call(socket_path, argv)
+            return _output(response["status"], response["stdout"],
+                           response["stderr"])
+        except socket.error as e:
+            # socket.timeout is a socket.error too
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED,
+                               errno.EACCES, errno.EPERM):
+                # the daemon may have run the command already
+                return _output(1, "", "Daemon failed: {0}\n".format(
+                    "{0}".format(e) or type(e).__name__))
+        except (ValueError, KeyError, TypeError) as e:
+            return _output(1, "", "Invalid daemon response: {0}\n".format(e))
+    from ec2helper.daemon import Session
+    session = Session(args.instance_id, args.region)
+    try:
+        return _output(*run(args, session))
+    finally:
+        session.close()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+.. _boto3: https://boto3.readthedocs.io/en/latest/
+
+AWS API clients
+===============
+
+Module :mod:`ec2helper.clients` creates all AWS API clients used by
+:mod:`ec2helper`. Creating a boto3_ client is expensive compared to a single
+API call, so clients are created once per service, region and endpoint and are
+shared afterwards (boto3_ clients are thread safe).
+
+The factory used to create new clients can be replaced, e.g. to run
+:mod:`ec2helper` against an in-process stand-in of the AWS APIs.
+
+.. code-block:: python
+
+    from ec2helper.clients import set_client_factory
+
+    def factory(service_name, region, endpoint_url):
+        return MyFakeClient(service_name)
+
+    set_client_factory(factory)
+
+Inside a :class:`~ec2helper.deadline.Deadline` the factory is also passed the
+keyword argument :code:`timeout`, the connect and read timeout in seconds the
+client should use (clients are cached per timeout too).
+
+Call hooks (see :func:`add_call_hook`) see every API call made with these
+clients, e.g. to count them (see :mod:`ec2helper.api_budget`). They are
+registered for botocore's "before-call" event, so they run once per API call
+(every page of a paginated call is an API call of its own, retries are not)
+and clients returned by a custom factory need :code:`meta.events` to support
+them.
+"""
+from __future__ import unicode_literals, absolute_import
+import threading
+import six
+from ec2helper.deadline import check_deadline, client_timeout, \
+    current_deadline
+from ec2helper.errors import DeadlineExceeded
+from ec2helper.utils import metadata
+
+_factory = None
+_clients = dict()
+_clients_lock = threading.Lock()
+_call_hooks = list()
+
+
+def _boto3_factory(service_name, region, endpoint_url, timeout=None):
+    """
+    The default client factory.
+    """
+    import boto3
+    config = None
+    if timeout is not None:
+        from botocore.config import Config
+        config = Config(connect_timeout=timeout, read_timeout=timeout)
+    return boto3.client(service_name, region_name=region,
+                        endpoint_url=endpoint_url, config=config)
+
+
+def _before_call(model, **kwargs):
+    """
+    Run the call hooks, registered for botocore's "before-call" event ahead
+    of other handlers (e.g. :py:class:`botocore.stub.Stubber` returning a
+    response and skipping later handlers). Calls after the deadline of the
+    current thread aren't made.
+    """
+    check_deadline()
+    for hook in tuple(_call_hooks):
+        hook(model.service_model.service_name, model.name)
+
+
+def _before_send(**kwargs):
+    """
+    Don't send requests (including retries) after the deadline of the
+    current thread.
+    """
+    check_deadline()
+
+
+def _after_call_error(exception, **kwargs):
+    """
+    Raise errors of calls that ran out of time (the deadline of the current
+    thread passed or the timeouts derived from it expired) as
+    :class:`~ec2helper.errors.DeadlineExceeded`.
+    """
+    deadline = current_deadline()
+    if deadline is None or isinstance(exception, DeadlineExceeded):
+        return
+    from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+    if deadline.remaining() <= 0 or isinstance(exception, (
+            ConnectTimeoutError, ReadTimeoutError)):
+        six.raise_from(DeadlineExceeded(
+            "Deadline of {0} seconds exceeded: {1}".format(
+                deadline.seconds, exception)), exception)
+
+
+def _register_hooks(client):
+    """
+    Make a new client run the call hooks and respect deadlines.
+    """
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is not None:
+        events.register_first("before-call.*.*", _before_call)
+        events.register_first("before-send.*.*", _before_send)
+        events.register_first("after-call-error.*.*", _after_call_error)
+    return client
+
+
+def get_client(service_name, region=None, endpoint_url=None):
+    """
+    Get a cached client for the given AWS service.
+
+    :param string service_name: The name of the service, e.g. "ec2".
+    :param string region: The region to make the API calls to, on an EC2
+        instance it defaults to its region, otherwise to boto3_'s default.
+    :param string endpoint_url: Use another endpoint than the AWS default one.
+    :return: The client as created by the current client factory.
+    :rtype: :py:class:`botocore.client.BaseClient` or the type returned by the
+        factory.
+    :raises DeadlineExceeded: If the deadline of the current thread passed.
+    """
+    if region is None:
+        region = metadata("region")
+    timeout = client_timeout()
+    key = (service_name, region, endpoint_url, timeout)
+    try:
+        return _clients[key]
+    except KeyError:
+        pass
+    kwargs = dict()
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    with _clients_lock:
+        if key not in _clients:
+            factory = _factory if _factory is not None else _boto3_factory
+            _clients[key] = _register_hooks(
+                factory(service_name, region, endpoint_url, **kwargs))
+        return _clients[key]
+
+
+def set_client_factory(factory=None):
+    """
+    Replace the factory creating new clients and drop all cached clients.
+
+    :param factory: A callable taking the service name, region and endpoint
+        url and returning a client. :code:`None` restores the default boto3_
+        factory.
+    """
+    global _factory
+    with _clients_lock:
+        _factory = factory
+        _clients.clear()
+
+
+def add_call_hook(hook):
+    """
+    Call a function before every API call made with the clients of
+    :func:`get_client` (in any thread). Exceptions raised by the hook are
+    raised by the API call, which is not made then.
+
+    :param hook: A callable taking the service name (e.g. "ec2") and the
+        operation name (e.g. "DescribeTags").
+    """
+    with _clients_lock:
+        _call_hooks.append(hook)
+
+
+def remove_call_hook(hook):
+    """
+    Remove a hook added with :func:`add_call_hook`.
+
+    :param hook: The callable passed to :func:`add_call_hook`.
+    """
+    with _clients_lock:
+        _call_hooks.remove(hook)
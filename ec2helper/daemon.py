@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+The ec2helper daemon
+====================
+
+Module :mod:`ec2helper.daemon` provides a long running process serving the
+commands of :mod:`ec2helper.cli` on a Unix socket. Shell scripts calling
+:code:`ec2helper` pay the startup cost (imports, boto3 clients, the metadata
+probe, API calls) only once: the daemon keeps its clients warm and caches
+tags and autoscaling state for a few seconds and metadata for its lifetime.
+Metrics are queued and sent in the background by a
+:class:`~ec2helper.metrics.MetricPublisher`, so :code:`ec2helper metric put`
+returns right away.
+
+Changes made through the daemon update its caches, changes made elsewhere
+become visible when the cached values expire.
+
+.. code-block:: bash
+
+    ec2helper daemon &
+    ec2helper tags get Name
+
+The socket is created with mode 0600, so only the user running the daemon
+(whose AWS credentials are used) can connect. The protocol is one JSON object
+per connection and direction: the client sends :code:`{"argv": [...]}` and
+receives :code:`{"status": 0, "stdout": "...", "stderr": "..."}`.
+"""
+from __future__ import unicode_literals, absolute_import
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:  # pragma: no cover - Python 2
+    import SocketServer as socketserver
+
+#: The name of the daemon's socket in the run directory.
+SOCKET_NAME = "ec2helper.sock"
+
+
+def default_socket_path():
+    """
+    The socket path the daemon listens on by default:
+    :code:`$EC2HELPER_SOCKET` or "ec2helper.sock" in the host local run
+    directory (see :mod:`ec2helper.as_protection`).
+
+    :rtype: string or None
+    """
+    if os.environ.get("EC2HELPER_SOCKET"):
+        return os.environ["EC2HELPER_SOCKET"]
+    from ec2helper.as_protection import _get_run_dir
+    run_dir = _get_run_dir()
+    if run_dir is None:
+        return None
+    return os.path.join(run_dir, SOCKET_NAME)
+
+
+class _Cached(object):
+    """
+    A value loaded on demand and kept for :attr:`ttl` seconds.
+    """
+
+    def __init__(self, load, ttl):
+        """Constructor - see class docu."""
+        self._load = load
+        self._ttl = ttl
+        self._value = None
+        self._time = None
+
+    def get(self):
+        """
+        Get the value, load it if it expired.
+        """
+        if self._time is None or time.time() - self._time >= self._ttl:
+            self._value = self._load()
+            self._time = time.time()
+        return self._value
+
+    def invalidate(self):
+        """
+        Load the value again on next access.
+        """
+        self._time = None
+
+
+class Session(object):
+    """
+    The state the CLI commands work on for one instance. Without TTLs (as
+    used by the CLI without daemon) every access makes its API calls, the
+    daemon keeps one session per instance and region.
+
+    :param string instance_id: The instance id, defaults to the local one.
+    :param string region: The region, defaults to the local one.
+    :param float tag_ttl: The seconds tags are cached.
+    :param float autoscaling_ttl: The seconds the autoscaling state is cached.
+    :param float metric_flush_interval: Queue metrics and send them in the
+        background every that many seconds, :code:`None` sends every metric
+        right away.
+    """
+
+    def __init__(self, instance_id=None, region=None, tag_ttl=0,
+                 autoscaling_ttl=0, metric_flush_interval=None):
+        """Constructor - see class docu."""
+        from ec2helper.instance import Instance
+        from ec2helper.utils import metadata
+        kwargs = dict()
+        if instance_id is not None:
+            kwargs["instance_id"] = instance_id
+        if region is not None:
+            kwargs["region"] = region
+        #: The :class:`~ec2helper.instance.Instance`.
+        self.instance = Instance(**kwargs)
+        #: A lock serializing the commands of this session.
+        self.lock = threading.Lock()
+        self._metadata = dict()
+        self._get_metadata = metadata
+        self._tags = _Cached(lambda: self.instance.tags, tag_ttl)
+        self._autoscaling = _Cached(lambda: self.instance.autoscaling,
+                                    autoscaling_ttl)
+        self._publisher = None
+        if metric_flush_interval is not None:
+            self._publisher = self.instance.metric_publisher(
+                flush_interval=metric_flush_interval).start()
+
+    def close(self):
+        """
+        Send queued metrics.
+        """
+        if self._publisher is not None:
+            self._publisher.stop()
+            self._publisher = None
+
+    def metadata(self, attribute):
+        """
+        Get (and cache) EC2 metadata, see :func:`ec2helper.utils.metadata`.
+        """
+        if attribute not in self._metadata:
+            self._metadata[attribute] = self._get_metadata(attribute)
+        return self._metadata[attribute]
+
+    @property
+    def tags(self):
+        """
+        The (cached) tags of the instance.
+        """
+        return self._tags.get()
+
+    def update_tags(self, **kwargs):
+        """
+        Create or update tags.
+        """
+        self.instance.update_tags(**kwargs)
+        self._tags.invalidate()
+
+    def delete_tags(self, *args):
+        """
+        Delete tags.
+        """
+        self.instance.delete_tags(*args)
+        self._tags.invalidate()
+
+    @property
+    def autoscaling(self):
+        """
+        The (cached) autoscaling status of the instance.
+        """
+        return self._autoscaling.get()
+
+    def set_autoscaling(self, attribute, value):
+        """
+        Set an autoscaling attribute of the instance, e.g.
+        "autoscaling_protected".
+        """
+        setattr(self.instance, attribute, value)
+        self._autoscaling.invalidate()
+
+    def put_metric_data(self, *args, **kwargs):
+        """
+        Put (or queue) a metric.
+        """
+        self.instance.put_metric_data(*args, **kwargs)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Serve one request.
+    """
+
+    def handle(self):
+        """
+        Read the request, run the command and write the response.
+        """
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.daemon.run(request["argv"])
+        except Exception as e:
+            response = {"status": 1, "stdout": "",
+                        "stderr": "{0}: {1}\n".format(type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Threaded Unix socket server.
+    """
+    daemon_threads = True
+
+
+class Daemon(object):
+    """
+    Serve CLI commands on a Unix socket with warm clients and caches.
+
+    :param string socket_path: The socket to listen on, defaults to
+        :func:`default_socket_path`.
+    :param float tag_ttl: The seconds tags are cached.
+    :param float autoscaling_ttl: The seconds the autoscaling state is cached.
+    :param float metric_flush_interval: The seconds between two metric
+        uploads.
+    """
+
+    def __init__(self, socket_path=None, tag_ttl=30, autoscaling_ttl=10,
+                 metric_flush_interval=10):
+        """Constructor - see class docu."""
+        #: The :code:`socket_path` parameter.
+        self.socket_path = socket_path or default_socket_path()
+        if self.socket_path is None:
+            raise ValueError("No usable directory for the daemon socket.")
+        #: The :code:`tag_ttl` parameter.
+        self.tag_ttl = tag_ttl
+        #: The :code:`autoscaling_ttl` parameter.
+        self.autoscaling_ttl = autoscaling_ttl
+        #: The :code:`metric_flush_interval` parameter.
+        self.metric_flush_interval = metric_flush_interval
+        self._sessions = dict()
+        self._sessions_lock = threading.Lock()
+        self._server = None
+
+    def session(self, instance_id=None, region=None):
+        """
+        Get the session of an instance, created on first use.
+
+        :rtype: ~ec2helper.daemon.Session
+        """
+        key = (instance_id, region)
+        with self._sessions_lock:
+            if key not in self._sessions:
+                self._sessions[key] = Session(
+                    instance_id, region, self.tag_ttl, self.autoscaling_ttl,
+                    self.metric_flush_interval)
+            return self._sessions[key]
+
+    def run(self, argv):
+        """
+        Run a CLI command.
+
+        :param list argv: The command line arguments.
+        :return: The response with "status", "stdout" and "stderr".
+        :rtype: dict
+        """
+        from ec2helper import cli
+        args = cli.parse_args(argv)
+        session = self.session(args.instance_id, args.region)
+        with session.lock:
+            status, stdout, stderr = cli.run(args, session)
+        return {"status": status, "stdout": stdout, "stderr": stderr}
+
+    def serve_forever(self):
+        """
+        Listen on the socket until SIGTERM or SIGINT.
+        """
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.daemon = self
+
+        def terminate(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            for session in self._sessions.values():
+                session.close()
+
+
+def call(socket_path, argv, timeout=60):
+    """
+    Run a CLI command in the daemon.
+
+    :param string socket_path: The daemon's socket.
+    :param list argv: The command line arguments.
+    :param float timeout: The seconds to wait for the response.
+    :return: The response with "status", "stdout" and "stderr".
+    :rtype: dict
+    :raises socket.error: If no daemon listens on the socket or the
+        connection fails (e.g. :py:class:`socket.timeout`).
+    :raises ValueError: If the response is incomplete or no JSON.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"argv": list(argv)}).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    if not data.endswith(b"\n"):
+        raise ValueError("Incomplete response from the daemon.")
+    return json.loads(data.decode("utf-8"))
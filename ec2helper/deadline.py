@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+.. _botocore: https://botocore.amazonaws.com/v1/documentation/api/latest/
+
+Deadlines
+=========
+
+With botocore_'s default timeouts (60 seconds to connect and to read, plus
+retries) a single API call to a degraded endpoint can take minutes. A
+:class:`~ec2helper.deadline.Deadline` bounds the total time of the API calls
+made inside its scope, e.g. of a health check:
+
+.. code-block:: python
+
+    from ec2helper import Instance
+    from ec2helper.deadline import Deadline
+    from ec2helper.errors import DeadlineExceeded
+
+    try:
+        with Deadline(5):
+            healthy = Instance().autoscaling_healthy
+    except DeadlineExceeded:
+        healthy = False
+
+Inside a deadline
+
+* :func:`~ec2helper.clients.get_client` returns clients whose connect and read
+  timeouts don't exceed the remaining time (rounded down to one of
+  :data:`TIMEOUTS`, so only a few clients per service are created),
+* every API call, every page of a paginated call and every retry checks the
+  deadline before it is sent,
+* and errors of calls that ran out of time (including connect and read
+  timeouts) are raised as :class:`~ec2helper.errors.DeadlineExceeded`.
+
+A request sent just before the deadline may still take up to the timeout of
+its client, so the total time can exceed the deadline by one timeout at most.
+
+Deadlines apply to the thread entering them, calls made by thread pools (e.g.
+of :func:`~ec2helper.instance.Instance.create_backup`) aren't bounded. Nested
+deadlines can shorten but not extend the outer one. Reading EC2 metadata
+(e.g. by :class:`~ec2helper.instance.Instance` without instance id) has its
+own short timeouts and is not bounded either.
+"""
+from __future__ import unicode_literals, absolute_import, division
+import threading
+import time
+from ec2helper.errors import DeadlineExceeded
+
+#: The connect and read timeouts (in seconds) of the clients used inside
+#: deadlines.
+TIMEOUTS = (0.5, 1, 2, 4, 8, 15, 30, 60)
+
+_local = threading.local()
+
+
+class Deadline(object):
+    """
+    Context guard bounding the time of the AWS API calls made in its scope.
+
+    :param float seconds: The time the API calls in the scope may take (from
+        entering the context guard on).
+    """
+
+    def __init__(self, seconds):
+        """Constructor - see class docu."""
+        #: The :code:`seconds` parameter.
+        self.seconds = seconds
+        #: :py:func:`time.time` when the deadline passes, set on enter.
+        self.end_time = None
+
+    def __enter__(self):
+        """
+        Start the deadline.
+        """
+        self.end_time = time.time() + self.seconds
+        outer = current_deadline()
+        if outer is not None:
+            self.end_time = min(self.end_time, outer.end_time)
+        _stack().append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        End the deadline.
+        """
+        _stack().remove(self)
+
+    def remaining(self):
+        """
+        The seconds until the deadline passes (negative after).
+
+        :rtype: float
+        """
+        return self.end_time - time.time()
+
+    def check(self):
+        """
+        Raise :class:`~ec2helper.errors.DeadlineExceeded` if the deadline
+        passed.
+        """
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("Deadline of {0} seconds exceeded.".format(
+                self.seconds))
+
+
+def _stack():
+    """
+    The deadlines of the current thread.
+    """
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = list()
+        return _local.stack
+
+
+def current_deadline():
+    """
+    The innermost deadline of the current thread.
+
+    :rtype: ~ec2helper.deadline.Deadline or None
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def check_deadline():
+    """
+    Raise :class:`~ec2helper.errors.DeadlineExceeded` if the deadline of the
+    current thread passed.
+    """
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+
+
+def client_timeout():
+    """
+    The connect and read timeout for the clients used by the current thread.
+
+    :return: One of :data:`TIMEOUTS`, :code:`None` outside of deadlines.
+    :rtype: float or None
+    :raises DeadlineExceeded: If the deadline passed.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return None
+    deadline.check()
+    remaining = deadline.remaining()
+    timeouts = [x for x in TIMEOUTS if x <= remaining]
+    return timeouts[-1] if timeouts else TIMEOUTS[0]
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+.. _psutil: https://psutil.readthedocs.io/en/latest/
+
+Local block device index
+========================
+
+Module :mod:`ec2helper.devices` maps the EBS volumes of the local EC2 instance
+to their Linux block devices, partitions and mount points. It is used by
+:attr:`~ec2helper.instance.Instance.volumes` and
+:func:`~ec2helper.instance.Instance.create_backup`.
+
+The index is built once per process from sysfs and psutil_ and answers
+lookups from dicts. On Nitro instances EBS volumes are NVMe devices
+(e.g. "/dev/nvme1n1") whose serial number carries the volume id, on Xen
+instances the attachment device "/dev/sdf" shows up as "/dev/xvdf".
+Partitions, device mapper devices (LVM, RAID, encryption) and mounts via
+links like "/dev/root" are resolved to the disks they reside on.
+
+The index is rebuilt automatically when block devices are added or removed
+or the mount table changes (the kernel signals changes of
+"/proc/self/mounts" to :py:func:`select.poll`). Lookups check for changes at
+most once per :code:`check_interval` seconds, in between they are plain dict
+lookups, so changes may take that long to show up (call
+:func:`~ec2helper.devices.DeviceIndex.refresh` after changing devices
+yourself).
+
+.. code-block:: python
+
+    from ec2helper.devices import get_device_index
+
+    index = get_device_index()
+    print(index.mount_points(index.volume_disk("vol-0e3272af46c7d5d1e")))
+"""
+from __future__ import unicode_literals, absolute_import
+import io
+import os
+import select
+import threading
+import time
+import psutil
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _read(path):
+    """
+    Read a sysfs attribute, :code:`None` if it doesn't exist.
+    """
+    try:
+        with io.open(path, encoding="utf-8", errors="replace") as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+class _MountsWatch(object):
+    """
+    Detect changes of the mount table, with :py:func:`select.poll` if
+    available and by comparing the content otherwise.
+    """
+
+    def __init__(self, path):
+        """Constructor - see class docu."""
+        self._path = path
+        self._file = None
+        self._poll = None
+        self._content = None
+        try:
+            self._file = io.open(path, "rb")
+            self._poll = select.poll()
+            self._poll.register(self._file.fileno(),
+                                select.POLLERR | select.POLLPRI)
+        except (AttributeError, IOError, OSError):
+            self._poll = None
+        self.reset()
+
+    def reset(self):
+        """
+        Mark the current mount table as seen.
+        """
+        if self._poll is not None:
+            self._file.seek(0)
+            self._file.read()
+        else:
+            self._content = _read(self._path)
+
+    def changed(self):
+        """
+        Check if the mount table changed since the last :func:`reset`.
+        """
+        if self._poll is not None:
+            return bool(self._poll.poll(0))
+        return _read(self._path) != self._content
+
+
+class DeviceIndex(object):
+    """
+    Index of the local block devices. Use :func:`get_device_index` to get the
+    process wide instance. Disks are identified by their kernel name, e.g.
+    "nvme1n1" or "xvdf".
+
+    :param string sys_class_block: The sysfs block device class directory.
+    :param string mounts: The mount table to watch for changes.
+    :param float check_interval: Check for changed devices or mounts at most
+        this often (seconds).
+    """
+
+    def __init__(self, sys_class_block="/sys/class/block",
+                 mounts="/proc/self/mounts", check_interval=1):
+        """Constructor - see class docu."""
+        #: The :code:`check_interval` parameter.
+        self.check_interval = check_interval
+        self._sys = sys_class_block
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._watch = _MountsWatch(mounts)
+        self._names = None
+        self._volumes = dict()
+        self._disks = dict()
+        self._mounts = dict()
+        self._root = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild the index.
+        """
+        with self._lock:
+            self._watch.reset()
+            self.__build()
+            self._next_check = time.time() + self.check_interval
+
+    def __check(self):
+        """
+        Rebuild the index if block devices or mounts changed, checked at most
+        every :attr:`check_interval` seconds.
+        """
+        now = time.time()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            names = sorted(os.listdir(self._sys))
+        except OSError:
+            names = []
+        if names != self._names or self._watch.changed():
+            self.refresh()
+
+    def __build(self):
+        """
+        Read sysfs and the mount table.
+        """
+        try:
+            names = sorted(os.listdir(self._sys))
+        except OSError:
+            names = []
+        parents = dict()
+        slaves = dict()
+        numbers = dict()
+        volumes = dict()
+        for name in names:
+            path = os.path.join(self._sys, name)
+            number = _read(os.path.join(path, "dev"))
+            if number:
+                numbers[number] = name
+            if os.path.exists(os.path.join(path, "partition")):
+                parents[name] = os.path.basename(os.path.dirname(
+                    os.path.realpath(path)))
+            try:
+                slaves[name] = os.listdir(os.path.join(path, "slaves"))
+            except OSError:
+                pass
+            serial = _read(os.path.join(path, "device", "serial"))
+            if name.startswith("nvme") and serial and \
+                    serial.startswith("vol") and name not in parents:
+                volume_id = serial.split()[0]
+                if not volume_id.startswith("vol-"):
+                    volume_id = "vol-" + volume_id[3:]
+                volumes[volume_id] = name
+
+        def disks_of(name, seen=()):
+            if name in parents:
+                return disks_of(parents[name], seen)
+            if slaves.get(name) and name not in seen:
+                return set().union(*[disks_of(x, seen + (name,)) for x in
+                                     slaves[name]])
+            return {name}
+
+        mounts = dict()
+        root = None
+        for partition in psutil.disk_partitions():
+            try:
+                device = os.stat(partition.device).st_rdev
+            except OSError:
+                continue
+            name = numbers.get("{0}:{1}".format(os.major(device),
+                                                os.minor(device)))
+            if name is None:
+                continue
+            for disk in disks_of(name):
+                mounts.setdefault(disk, []).append(partition.mountpoint)
+                if partition.mountpoint == "/":
+                    root = disk
+        self._names = names
+        self._volumes = volumes
+        self._disks = set(x for x in names if x not in parents)
+        self._mounts = mounts
+        self._root = root
+
+    def volume_disk(self, volume_id, device=None):
+        """
+        Find the local disk of an EBS volume.
+
+        :param string volume_id: The volume id (matched for NVMe devices).
+        :param string device: The attachment device of the volume, e.g.
+            "/dev/sdf" (matched for Xen devices).
+        :return: The disk name, :code:`None` if the volume is not attached
+            locally.
+        :rtype: string or None
+        """
+        self.__check()
+        if volume_id in self._volumes:
+            return self._volumes[volume_id]
+        if device is None:
+            return None
+        name = os.path.basename(device)
+        candidates = [name]
+        if name.startswith("sd"):
+            candidates.append("xvd" + name[2:])
+        elif name.startswith("xvd"):
+            candidates.append("sd" + name[3:])
+        for candidate in candidates:
+            # strip partition numbers of e.g. "/dev/sda1"
+            for disk in (candidate, candidate.rstrip("0123456789")):
+                if disk in self._disks and not disk.startswith("nvme"):
+                    return disk
+        return None
+
+    def mount_points(self, disk):
+        """
+        Get the mount points of all filesystems on a disk (including its
+        partitions and device mapper devices).
+
+        :param string disk: The disk name, :code:`None` gives no mount points.
+        :return: The mount points.
+        :rtype: list[string]
+        """
+        self.__check()
+        return list(self._mounts.get(disk, []))
+
+    @property
+    def root_disk(self):
+        """
+        The disk the root filesystem resides on, :code:`None` if unknown.
+        """
+        self.__check()
+        return self._root
+
+
+def get_device_index():
+    """
+    Get the process wide :class:`DeviceIndex`, it is built on first use.
+
+    :rtype: ~ec2helper.devices.DeviceIndex
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DeviceIndex()
+        return _index
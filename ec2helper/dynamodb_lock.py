@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+.. _DynamoDB Local: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/DynamoDBLocal.html
+
+The DynamoDBLock context guard
+==============================
+
+A lock backend for :func:`ec2helper.instance.Instance.lock` that holds the
+lock as an item of a DynamoDB table. The lock is acquired with a single
+conditional :func:`put_item` call, which either succeeds or fails atomically,
+so unlike :class:`~ec2helper.tag_lock.TagLock` there is no eventual
+consistency window and no re-check of the lock group.
+
+The table needs a string hash key named "LockName" (or the
+:code:`key_attribute` given). Expired locks are overwritten, so an optional
+DynamoDB TTL on the "ExpiresAt" attribute only serves for cleaning up.
+
+.. code-block:: none
+    :caption: Create the table with the AWS CLI
+
+    aws dynamodb create-table --table-name ec2helper-locks \\
+        --attribute-definitions AttributeName=LockName,AttributeType=S \\
+        --key-schema AttributeName=LockName,KeyType=HASH \\
+        --billing-mode PAY_PER_REQUEST
+
+Since backends are constructed with the parameters of
+:func:`~ec2helper.instance.Instance.lock`, use :py:func:`functools.partial` to
+pass table settings. :code:`endpoint_url` allows to use any DynamoDB
+compatible store, like `DynamoDB Local`_ for testing.
+
+.. code-block:: python
+
+    from functools import partial
+    from ec2helper import Instance
+    from ec2helper.dynamodb_lock import DynamoDBLock
+
+    i = Instance()
+    backend = partial(DynamoDBLock, table_name="ec2helper-locks")
+    with i.lock("MyLock", backend=backend) as lock:
+        print("Holding lock " + lock.key)
+
+.. code-block:: none
+    :caption: AWS API permissions
+
+    autoscaling:DescribeAutoScalingInstances
+    autoscaling:SetInstanceProtection
+    dynamodb:PutItem
+    dynamodb:DeleteItem
+"""
+from __future__ import unicode_literals, absolute_import
+import calendar
+import six
+from botocore.exceptions import ClientError
+from ec2helper.clients import get_client
+from ec2helper.errors import ResourceAlreadyLocked
+from ec2helper.base_lock import BaseLock
+
+
+def _epoch(time):
+    """
+    Convert an aware :py:mod:`datetime` to a unix timestamp.
+    """
+    return calendar.timegm(time.utctimetuple())
+
+
+class DynamoDBLock(BaseLock):
+    """
+    Lock backend using conditional writes on a DynamoDB table.
+
+    For more details about the locking mechanism and the common parameters see
+    :func:`ec2helper.instance.Instance.lock`.
+
+    :param instance: The instance for this lock.
+    :param lock_name: The name of the lock.
+    :param group_tag: The tag key of the lock group.
+    :param group_value: The tag value of the lock group.
+    :param ttl: The time in minutes the lock should be valid.
+    :param check_health: If true check health before locking.
+    :param string table_name: The DynamoDB table holding the locks (default is
+        "ec2helper-locks").
+    :param string key_attribute: The name of the table's string hash key
+        (default is "LockName").
+    :param string endpoint_url: Use another endpoint than the AWS default one,
+        e.g. for DynamoDB Local.
+    """
+
+    def __init__(self, instance, lock_name, group_tag, group_value, ttl,
+                 check_health, table_name="ec2helper-locks",
+                 key_attribute="LockName", endpoint_url=None):
+        """Constructor - see class docu."""
+        super(DynamoDBLock, self).__init__(instance, lock_name, group_tag,
+                                           group_value, ttl, check_health)
+        #: The :code:`table_name` parameter.
+        self.table_name = table_name
+        #: The :code:`key_attribute` parameter.
+        self.key_attribute = key_attribute
+        #: The :code:`endpoint_url` parameter.
+        self.endpoint_url = endpoint_url
+        #: The hash key of the lock item, built from the lock group and
+        #: :code:`lock_name`, e.g. "asg:my-asg/MyLock" or
+        #: "tag:Stage=prod/MyLock".
+        self.key = None
+
+    def __enter__(self):
+        """
+        Lock this instance.
+        """
+        self._set_lock_time()
+        self._backup_autoscaling_data()
+        self._report_unhealthy()
+        self.__set_lock_key()
+        self.__put_lock_item()
+        try:
+            self._autoscaling_protect()
+        except Exception:
+            self.__delete_lock_item()
+            raise
+        self._locked = True
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Unlock this instance.
+        """
+        self.__delete_lock_item()
+        self._autoscaling_reset_protection()
+
+    def __client(self):
+        """
+        Get a DynamoDB client for the instance's region.
+        """
+        return get_client("dynamodb", self._instance.region,
+                          self.endpoint_url)
+
+    def __set_lock_key(self):
+        """
+        Build the item key from the lock group and the lock name. Lock group
+        can be autoscaling group, a tag-key or a tag-key-value combination.
+        """
+        if self.group_tag is not None:
+            group = "tag:" + self.group_tag
+            if self.group_value is not None:
+                group += "=" + six.text_type(self.group_value)
+        else:
+            assert self.autoscaling is not None, ("Instance must be in an "
+                                                  "autoscaling group or "
+                                                  "'group_tag' must be given.")
+            group = "asg:" + self.autoscaling["AutoScalingGroupName"]
+        self.key = "{0}/{1}".format(group, self.name)
+
+    def __put_lock_item(self):
+        """
+        Write the lock item if there is none or if it already expired.
+        """
+        try:
+            response = self.__client().put_item(
+                TableName=self.table_name,
+                Item={
+                    self.key_attribute: {"S": self.key},
+                    "Owner": {"S": self._instance.id},
+                    "AcquiredAt": {"N": str(_epoch(self.time))},
+                    "ExpiresAt": {"N": str(_epoch(self.end_time))}
+                },
+                ConditionExpression="attribute_not_exists(#k) OR "
+                                    "ExpiresAt <= :now",
+                ExpressionAttributeNames={"#k": self.key_attribute},
+                ExpressionAttributeValues={
+                    ":now": {"N": str(_epoch(self.time))}
+                }
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise ResourceAlreadyLocked(self.key)
+            raise
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+    def __delete_lock_item(self):
+        """
+        Delete the lock item, but only if it is still the one we wrote (it
+        could have expired and been taken over by another instance).
+        """
+        try:
+            response = self.__client().delete_item(
+                TableName=self.table_name,
+                Key={self.key_attribute: {"S": self.key}},
+                ConditionExpression="#o = :owner AND AcquiredAt = :time",
+                ExpressionAttributeNames={"#o": "Owner"},
+                ExpressionAttributeValues={
+                    ":owner": {"S": self._instance.id},
+                    ":time": {"N": str(_epoch(self.time))}
+                }
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return
+            raise
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
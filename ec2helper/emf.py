@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+.. _Embedded Metric Format: https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+.. _boto3: https://boto3.readthedocs.io/en/latest/
+
+Embedded Metric Format sink
+===========================
+
+Module :mod:`ec2helper.emf` provides a metric sink (see
+:mod:`ec2helper.metrics`) that writes datums as CloudWatch
+`Embedded Metric Format`_ JSON lines instead of calling
+:func:`put_metric_data`. The lines can be written to stdout, appended to a file
+or sent to the CloudWatch agent's TCP or UDP listener, which extracts the
+metrics from the logs, so publishing costs no API calls at all.
+
+Since the sink receives the datums built by
+:func:`~ec2helper.instance.Instance.put_metric_data`, namespaces, dimensions
+and tag dimensions work like for the API.
+
+Embedded Metric Format has no statistic sets, so datums with
+"StatisticValues" (e.g. from
+:func:`~ec2helper.instance.Instance.metric_aggregation`) are written as values
+with the same sample count, sum, minimum and maximum: the minimum, the maximum
+and the average of the other samples repeated for each of them. Averages and
+extremes stay exact, percentiles of such metrics aren't meaningful (use the
+aggregation mode "values" to keep them).
+
+So a datum never becomes more than one line per :data:`MAX_EMF_VALUES`
+distinct values, datums of more samples (statistic sets or "Counts") are
+scaled down to at most :data:`MAX_EMF_VALUES` values. Minimum and maximum stay
+exact, averages and percentiles become approximations and "SampleCount" and
+"Sum" in CloudWatch are smaller than the real ones.
+
+.. code-block:: python
+
+    from ec2helper import Instance
+
+    i = Instance()
+    with i.embedded_metrics("tcp://127.0.0.1:25888"):
+        i.put_metric_data('JobsDone', 138)
+
+.. code-block:: json
+    :caption: Example line
+
+    {
+        "_aws": {
+            "Timestamp": 1518278868000,
+            "CloudWatchMetrics": [{
+                "Namespace": "AWS/EC2",
+                "Dimensions": [["InstanceId"]],
+                "Metrics": [{"Name": "JobsDone", "Unit": "Count"}]
+            }]
+        },
+        "InstanceId": "i-0d2cb773a18dfa487",
+        "JobsDone": 138
+    }
+"""
+from __future__ import unicode_literals, absolute_import
+import calendar
+import io
+import json
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+import six
+from dateutil import tz
+from ec2helper.metrics import MetricSink
+
+#: The maximum number of values of a metric in one EMF record.
+MAX_EMF_VALUES = 100
+
+
+def _statistic_values(statistics):
+    """
+    Expand "StatisticValues" into values with the same sample count, sum,
+    minimum and maximum.
+    """
+    count = int(round(statistics["SampleCount"]))
+    minimum, maximum = statistics["Minimum"], statistics["Maximum"]
+    if count < 1:
+        return []
+    if count == 1:
+        return [statistics["Sum"]]
+    values = [minimum, maximum]
+    if count > 2:
+        size = min(count, MAX_EMF_VALUES)
+        rest = (statistics["Sum"] * size / float(count) - minimum - maximum) \
+            / float(size - 2)
+        values.extend([min(max(rest, minimum), maximum)] * (size - 2))
+    return values
+
+
+def _scaled_counts(counts):
+    """
+    Scale "Counts" down to at most :data:`MAX_EMF_VALUES` in total (unless
+    there are more values), keeping every value at least once.
+    """
+    counts = [int(x) for x in counts]
+    total = sum(counts)
+    if total <= MAX_EMF_VALUES:
+        return counts
+    room = max(MAX_EMF_VALUES - len([x for x in counts if x]), 0)
+    return [x * room // total + 1 if x else 0 for x in counts]
+
+
+def emf_records(namespace, datum):
+    """
+    Convert a datum to Embedded Metric Format records.
+
+    :param string namespace: The namespace of the datum.
+    :param dict datum: The datum as required by boto3_'s
+        :func:`~client.put_metric_data` with "Value", "Values" (and
+        optionally "Counts") or "StatisticValues".
+    :return: The records, more than one if there are more than 100 distinct
+        values.
+    :rtype: list[dict]
+    """
+    timestamp = datum.get("Timestamp") or datetime.now(tz=tz.tzutc())
+    name = datum["MetricName"]
+    dimensions = datum.get("Dimensions", [])
+    metric = {"Name": name}
+    if datum.get("Unit") not in (None, "None"):
+        metric["Unit"] = datum["Unit"]
+    if "StorageResolution" in datum:
+        metric["StorageResolution"] = datum["StorageResolution"]
+    if "StatisticValues" in datum:
+        values = _statistic_values(datum["StatisticValues"])
+    elif "Values" in datum:
+        counts = _scaled_counts(datum.get("Counts") or
+                                [1] * len(datum["Values"]))
+        values = [v for v, c in zip(datum["Values"], counts)
+                  for _ in range(c)]
+    else:
+        values = [datum["Value"]]
+    records = list()
+    for n in range(0, len(values), MAX_EMF_VALUES):
+        chunk = values[n:n + MAX_EMF_VALUES]
+        record = {
+            "_aws": {
+                "Timestamp": calendar.timegm(timestamp.utctimetuple()) * 1000
+                    + timestamp.microsecond // 1000,
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [[x["Name"] for x in dimensions]],
+                    "Metrics": [metric]
+                }]
+            },
+            name: chunk[0] if len(chunk) == 1 else chunk
+        }
+        for dimension in dimensions:
+            record[dimension["Name"]] = six.text_type(dimension["Value"])
+        records.append(record)
+    return records
+
+
+class EmbeddedMetricSink(MetricSink):
+    """
+    Metric sink writing Embedded Metric Format JSON lines. Lines are collected
+    and written when :attr:`max_lines` are collected, when a datum is added
+    and the oldest line is older than :attr:`max_age` seconds and when the
+    context guard is left. The sink is thread safe.
+
+    This class is not meant to be used directly, use
+    :func:`ec2helper.instance.Instance.embedded_metrics` instead.
+
+    :param instance: The instance the sink is used for.
+    :param target: "stdout", a file path to append to,
+        "tcp://<host>:<port>", "udp://<host>:<port>" or a writable text file
+        object.
+    :param int max_lines: Write when this number of lines is collected.
+    :param float max_age: Write when the oldest line is older (seconds).
+    """
+
+    def __init__(self, instance, target="stdout", max_lines=100, max_age=10):
+        """Constructor - see class docu."""
+        super(EmbeddedMetricSink, self).__init__(instance)
+        #: The :code:`target` parameter.
+        self.target = target
+        #: The :code:`max_lines` parameter.
+        self.max_lines = max_lines
+        #: The :code:`max_age` parameter.
+        self.max_age = max_age
+        self._lines = list()
+        self._oldest = None
+        self._socket = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def add(self, namespace, datum):
+        """
+        Convert a datum and collect its lines.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        lines = [json.dumps(x, sort_keys=True) for x in
+                 emf_records(namespace, datum)]
+        now = time.time()
+        with self._lock:
+            self._lines.extend(lines)
+            if self._oldest is None:
+                self._oldest = now
+            full = len(self._lines) >= self.max_lines or \
+                now - self._oldest >= self.max_age
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all collected lines. The EMF sink is always the end of the sink
+        chain, nothing is passed on.
+        """
+        with self._lock:
+            lines, self._lines = self._lines, list()
+            self._oldest = None
+        if lines:
+            with self._write_lock:
+                self.__write("".join(x + "\n" for x in lines))
+
+    def close(self):
+        """
+        Flush and close a TCP connection.
+        """
+        self.flush()
+        with self._write_lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def __exit__(self, type, value, traceback):
+        """
+        Flush, close connections and restore the former sink of the instance.
+        """
+        try:
+            self.close()
+        finally:
+            self._instance.metric_sink = self.downstream
+
+    def __write(self, data):
+        """
+        Write the data to the target.
+        """
+        target = self.target
+        if not isinstance(target, six.string_types):
+            target.write(data)
+            target.flush()
+        elif target == "stdout":
+            sys.stdout.write(data)
+            sys.stdout.flush()
+        elif target.startswith("tcp://"):
+            self.__send_tcp(data.encode("utf-8"))
+        elif target.startswith("udp://"):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                for line in data.splitlines(True):
+                    sock.sendto(line.encode("utf-8"), self.__address())
+            finally:
+                sock.close()
+        else:
+            with io.open(target, "a", encoding="utf-8") as f:
+                f.write(data)
+
+    def __send_tcp(self, data):
+        """
+        Send over a persistent connection, reconnect once if it broke.
+        """
+        for attempt in (1, 2):
+            if self._socket is None:
+                self._socket = socket.create_connection(self.__address(),
+                                                        timeout=5)
+            try:
+                self._socket.sendall(data)
+                return
+            except socket.error:
+                self._socket.close()
+                self._socket = None
+                if attempt == 2:
+                    raise
+
+    def __address(self):
+        """
+        Parse host and port of a tcp:// or udp:// target.
+        """
+        host, port = self.target.split("://", 1)[1].rsplit(":", 1)
+        return host, int(port)
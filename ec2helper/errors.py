@@ -11,6 +11,12 @@ Exception classes
           +-- ResourceLockingError
                +-- ResourceAlreadyLocked
                +-- InstanceUnhealthy
+          +-- TagNotFound
+          +-- SnapshotError
+               +-- SnapshotFailed
+               +-- SnapshotTimeout
+          +-- ApiCallBudgetExceeded
+          +-- DeadlineExceeded
 """
 
 
@@ -54,3 +60,60 @@ class TagNotFound(Ec2HelperError):
     Raised if a requested tag is not found.
     """
     pass
+
+
+class SnapshotError(Ec2HelperError):
+    """
+    Common base class for all exceptions raised by
+    :func:`~ec2helper.snapshots.wait_for_snapshots`.
+
+    :param dict snapshots: The last known snapshot data by snapshot id.
+    """
+
+    def __init__(self, message, snapshots):
+        """Constructor - see class docu."""
+        super(SnapshotError, self).__init__(message)
+        #: The last known snapshot data by snapshot id, as returned by
+        #: :func:`describe_snapshots` (missing for snapshots not found yet).
+        self.snapshots = snapshots
+
+
+class SnapshotFailed(SnapshotError):
+    """
+    Raised by :func:`~ec2helper.snapshots.wait_for_snapshots` if a snapshot
+    went to state "error".
+    """
+    pass
+
+
+class SnapshotTimeout(SnapshotError):
+    """
+    Raised by :func:`~ec2helper.snapshots.wait_for_snapshots` if the snapshots
+    didn't complete within the timeout.
+    """
+    pass
+
+
+class ApiCallBudgetExceeded(Ec2HelperError):
+    """
+    Raised by an API call exceeding the budget of an
+    :class:`~ec2helper.api_budget.ApiCallBudget`, the call is not made.
+
+    :param collections.Counter calls: The calls counted so far.
+    """
+
+    def __init__(self, message, calls):
+        """Constructor - see class docu."""
+        super(ApiCallBudgetExceeded, self).__init__(message)
+        #: :py:class:`~collections.Counter` of the calls counted so far
+        #: (including the one exceeding the budget) by (service name,
+        #: operation name).
+        self.calls = calls
+
+
+class DeadlineExceeded(Ec2HelperError):
+    """
+    Raised by API calls made after the :class:`~ec2helper.deadline.Deadline`
+    of the current thread passed or that ran out of time.
+    """
+    pass
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Autoscaling operations on many instances
+========================================
+
+Module :mod:`ec2helper.fleet` provides functions to change the autoscaling
+state of many EC2 instances at once. Instead of one read and one write per
+:class:`~ec2helper.instance.Instance`, the instances are described in batches
+and grouped by autoscaling group, then changed with as few API calls as
+possible (:func:`set_instance_protection` takes up to 50 instance ids per
+request), concurrently across groups and batches.
+These functions get exposed via :mod:`ec2helper`.
+
+.. code-block:: python
+
+    from ec2helper import set_fleet_protection
+
+    report = set_fleet_protection(["i-0a36bbb38a85877f0",
+                                   "i-0d2cb773a18dfa487"], True)
+    print(report["i-0a36bbb38a85877f0"]["Success"])
+"""
+from __future__ import unicode_literals, absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from ec2helper.clients import get_client
+
+#: The maximum number of instance ids per autoscaling API request.
+MAX_INSTANCE_IDS = 50
+
+
+def _chunks(items, size):
+    """
+    Split a list into lists of at most :attr:`size` items.
+    """
+    return [items[x:x + size] for x in range(0, len(items), size)]
+
+
+def get_fleet_autoscaling(instance_ids, region=None):
+    """
+    Get the autoscaling status data of many instances with one
+    :func:`describe_auto_scaling_instances` call per 50 instances.
+
+    :param list instance_ids: The instance ids.
+    :param string region: The region to search in, on an EC2 instance it
+        defaults to its region.
+    :return: The autoscaling status data as returned by
+        :attr:`ec2helper.instance.Instance.autoscaling` by instance id.
+        Instances that are no autoscaling instances are missing.
+    :rtype: dict[string, dict[string, string or bool]]
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        autoscaling:DescribeAutoScalingInstances
+    """
+    client = get_client("autoscaling", region)
+    paginator = client.get_paginator("describe_auto_scaling_instances")
+    autoscaling = dict()
+    for chunk in _chunks(sorted(set(instance_ids)), MAX_INSTANCE_IDS):
+        for page in paginator.paginate(InstanceIds=chunk):
+            for instance in page["AutoScalingInstances"]:
+                autoscaling[instance["InstanceId"]] = instance
+    return autoscaling
+
+
+def _fleet_report(instance_ids, autoscaling):
+    """
+    Initialize the per instance report.
+    """
+    report = dict()
+    for instance_id in instance_ids:
+        data = autoscaling.get(instance_id)
+        report[instance_id] = {
+            "AutoScalingGroupName": data["AutoScalingGroupName"] if data
+                else None,
+            "Changed": False,
+            "Success": True,
+            "Error": None
+        }
+    return report
+
+
+def _run_tasks(tasks, max_workers, report):
+    """
+    Run :code:`(function, instance_ids)` tasks concurrently and record their
+    outcome for the instance ids in the report.
+    """
+    def run(task):
+        function, instance_ids = task
+        try:
+            function()
+        except Exception as e:
+            error = "{0}: {1}".format(type(e).__name__, e)
+            for instance_id in instance_ids:
+                report[instance_id]["Success"] = False
+                report[instance_id]["Error"] = error
+        else:
+            for instance_id in instance_ids:
+                report[instance_id]["Changed"] = True
+
+    if not tasks:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+        list(pool.map(run, tasks))
+
+
+def set_fleet_protection(instance_ids, protected=True,
+                         region=None, max_workers=8):
+    """
+    Set or remove scale in protection for many instances. Instances are
+    grouped by autoscaling group and protected with one
+    :func:`set_instance_protection` call per 50 instances of a group. Instances
+    already in the requested state are left alone, instances that are no
+    autoscaling instances are ignored (like
+    :attr:`~ec2helper.instance.Instance.autoscaling_protected` does).
+
+    :param list instance_ids: The instance ids.
+    :param bool protected: The requested scale in protection state.
+    :param string region: The region to make the API calls to, on an EC2
+        instance it defaults to its region.
+    :param int max_workers: The maximum number of concurrent API calls.
+    :return: A report by instance id.
+    :rtype: dict[string, dict[string, string or bool or None]]
+
+    .. code-block:: json
+        :caption: Example return value
+
+        {
+            "i-0a36bbb38a85877f0": {
+                "AutoScalingGroupName": "my-asg",
+                "Changed": true,
+                "Success": true,
+                "Error": null
+            },
+            "i-0d2cb773a18dfa487": {
+                "AutoScalingGroupName": null,
+                "Changed": false,
+                "Success": true,
+                "Error": null
+            }
+        }
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        autoscaling:DescribeAutoScalingInstances
+        autoscaling:SetInstanceProtection
+    """
+    autoscaling = get_fleet_autoscaling(instance_ids, region)
+    report = _fleet_report(instance_ids, autoscaling)
+    groups = dict()
+    for instance_id in sorted(autoscaling):
+        data = autoscaling[instance_id]
+        if data["ProtectedFromScaleIn"] != bool(protected):
+            groups.setdefault(data["AutoScalingGroupName"], []).append(
+                instance_id)
+    client = get_client("autoscaling", region)
+
+    def protect(asg, chunk):
+        def call():
+            response = client.set_instance_protection(
+                InstanceIds=chunk,
+                AutoScalingGroupName=asg,
+                ProtectedFromScaleIn=bool(protected)
+            )
+            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        return call, chunk
+
+    tasks = [protect(asg, chunk) for asg in sorted(groups) for chunk in
+             _chunks(groups[asg], MAX_INSTANCE_IDS)]
+    _run_tasks(tasks, max_workers, report)
+    return report
+
+
+def set_fleet_health(instance_ids, healthy=True, region=None,
+                     max_workers=8):
+    """
+    Set the autoscaling health status of many instances. The API only takes
+    one instance per :func:`set_instance_health` call, so the calls are made
+    concurrently. Instances already in the requested state are left alone,
+    instances that are no autoscaling instances are ignored (like
+    :attr:`~ec2helper.instance.Instance.autoscaling_healthy` does).
+
+    :param list instance_ids: The instance ids.
+    :param bool healthy: :code:`False` marks the instances unhealthy and
+        causes their replacement (unless protected from scale in).
+    :param string region: The region to make the API calls to, on an EC2
+        instance it defaults to its region.
+    :param int max_workers: The maximum number of concurrent API calls.
+    :return: A report by instance id, see
+        :func:`~ec2helper.fleet.set_fleet_protection`.
+    :rtype: dict[string, dict[string, string or bool or None]]
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        autoscaling:DescribeAutoScalingInstances
+        autoscaling:SetInstanceHealth
+    """
+    autoscaling = get_fleet_autoscaling(instance_ids, region)
+    report = _fleet_report(instance_ids, autoscaling)
+    client = get_client("autoscaling", region)
+
+    def mark(instance_id):
+        def call():
+            response = client.set_instance_health(
+                InstanceId=instance_id,
+                ShouldRespectGracePeriod=False,
+                HealthStatus="Healthy" if healthy else "Unhealthy"
+            )
+            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        return call, [instance_id]
+
+    tasks = [mark(x) for x in sorted(autoscaling) if (
+        autoscaling[x]["HealthStatus"] == "HEALTHY") != bool(healthy)]
+    _run_tasks(tasks, max_workers, report)
+    return report
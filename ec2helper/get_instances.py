@@ -17,11 +17,11 @@ useful for the user.
     print(get_instances_by_tag('OS', 'Redhat'))
 """
 from __future__ import unicode_literals, absolute_import
-import boto3
-from ec2helper.utils import IS_EC2, metadata, tags_to_dict
+from ec2helper.clients import get_client
+from ec2helper.utils import tags_to_dict
 
 
-def get_instances_by_tag(key, value=None, region=metadata("region")):
+def get_instances_by_tag(key, value=None, region=None):
     """
     Get a list of instance data from any tag key or tag key-value combination.
     
@@ -65,7 +65,7 @@ def get_instances_by_tag(key, value=None, region=metadata("region")):
         Function :func:`ec2helper.utils.tags_to_dict`
             For details about tag value conversion.
     """
-    client = boto3.client("ec2", region_name=region)
+    client = get_client("ec2", region)
     if value is None:
         tag_filter = {"Name": "tag-key", "Values": [key]}
     else:
@@ -83,7 +83,7 @@ def get_instances_by_tag(key, value=None, region=metadata("region")):
     return instances
 
 
-def get_instance_tags_by_tag(key, value=None, region=metadata("region")):
+def get_instance_tags_by_tag(key, value=None, region=None):
     """
     Get instances and their tags from any tag key or tag key-value combination.
     
@@ -121,7 +121,7 @@ def get_instance_tags_by_tag(key, value=None, region=metadata("region")):
                  in get_instances_by_tag(key, value, region)])
 
 
-def get_instance_status_by_autoscaling_group(asg, region=metadata("region")):
+def get_instance_status_by_autoscaling_group(asg, region=None):
     """
     Get a list of instance status data from a given autoscaling group name.
     
@@ -150,7 +150,7 @@ def get_instance_status_by_autoscaling_group(asg, region=metadata("region")):
             
         autoscaling:DescribeAutoScalingGroups
     """
-    client = boto3.client("autoscaling", region_name=region)
+    client = get_client("autoscaling", region)
     response = client.describe_auto_scaling_groups(
         AutoScalingGroupNames=[asg]
     )
@@ -158,7 +158,7 @@ def get_instance_status_by_autoscaling_group(asg, region=metadata("region")):
     return response["AutoScalingGroups"][0]["Instances"]
 
 
-def get_instances_by_autoscaling_group(asg, region=metadata("region")):
+def get_instances_by_autoscaling_group(asg, region=None):
     """
     Get a list of instance data from an autoscaling group.
     
@@ -202,7 +202,7 @@ def get_instances_by_autoscaling_group(asg, region=metadata("region")):
             For details about tag value conversion.
     """
     asg_instances = get_instance_status_by_autoscaling_group(asg, region)
-    client = boto3.client("ec2", region_name=region)
+    client = get_client("ec2", region)
     paginator = client.get_paginator("describe_instances")
     instances = list()
     for page in paginator.paginate(
@@ -216,7 +216,7 @@ def get_instances_by_autoscaling_group(asg, region=metadata("region")):
     return instances
 
 
-def get_instance_tags_by_autoscaling_group(asg, region=metadata("region")):
+def get_instance_tags_by_autoscaling_group(asg, region=None):
     """
     Get instances and their tags from an autoscaling group.
     
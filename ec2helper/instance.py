@@ -18,18 +18,30 @@ Module :mod:`ec2helper.instance` provides the
 """
 from __future__ import unicode_literals, absolute_import
 import copy
+import threading
+import time
 import six
-import boto3
-import requests
-import psutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dateutil import tz
-from ec2helper.utils import IS_EC2, metadata, tags_to_dict, dict_to_tags
+from ec2helper.clients import get_client
+from ec2helper.utils import is_ec2, metadata, tags_to_dict, dict_to_tags
 from ec2helper.tag_lock import TagLock
 from ec2helper.as_protection import AutoscalingProtection
+from ec2helper.metrics import MetricBuffer, MetricPublisher, \
+    MetricAggregator, MetricDeduplicator, send_metric_data, MAX_DATUMS
+from ec2helper.emf import EmbeddedMetricSink
+from ec2helper.system_metrics import SystemMetricsCollector
+from ec2helper.snapshots import delete_snapshots, wait_for_snapshots
+from ec2helper.backup_state import BackupState
+from ec2helper.devices import get_device_index
 from ec2helper.errors import TagNotFound
 
 
+#: Usual root devices of AMIs, used if the local root device is unknown.
+_ROOT_DEVICES = ("/dev/xvda", "/dev/sda1", "/dev/sda")
+
+
 class Instance(object):
     """
     Interact with an EC2 instance. By default the instance the script is
@@ -41,14 +53,26 @@ class Instance(object):
         instance it defaults to its region.
     """
 
-    def __init__(self, instance_id=metadata("instance_id"),
-                 region=metadata("region")):
+    def __init__(self, instance_id=None, region=None):
         """Constructor - see class docu."""
-        self.id = instance_id
-        self.region = region
+        self.id = instance_id if instance_id is not None else metadata(
+            "instance_id")
+        self.region = region if region is not None else metadata("region")
+        #: The :class:`~ec2helper.metrics.MetricSink` receiving the datums of
+        #: :func:`~ec2helper.instance.Instance.put_metric_data`, :code:`None`
+        #: (default) sends every call as a separate request.
+        self.metric_sink = None
+        self._tag_cache = dict()
+        #: The seconds :attr:`~ec2helper.instance.Instance.volumes` are
+        #: cached.
+        self.volumes_ttl = 300
+        self._volume_cache = dict()
+        self._volume_time = None
+        self._volume_lock = threading.Lock()
+        self._root_device_name = None
 
     def lock(self, lock_name, group_tag=None, group_value=None, ttl=720,
-             check_health=True):
+             check_health=True, backend=None):
         """
         Context guard that acts as a locking system accross multiple EC2
         instances selected by autoscaling group, tag key or tag key-value
@@ -91,8 +115,14 @@ class Instance(object):
             considered unhealthy or not in service, raise
             :class:`~ec2helper.errors.InstanceUnhealthy` to avoid choosing it
             for task execution.
-        :return: The TagLock context guard.
-        :rtype: :class:`ec2helper.tag_lock.TagLock`
+        :param backend: The lock backend, a context guard class or factory
+            that is called with this instance and the parameters above. If
+            this value is :code:`None` (default)
+            :class:`~ec2helper.tag_lock.TagLock` is used. See
+            :mod:`ec2helper.base_lock` for the available backends.
+        :return: The lock context guard.
+        :rtype: :class:`ec2helper.tag_lock.TagLock` or the type returned by
+            :attr:`backend`
         :raises ec2helper.errors.ResourceAlreadyLocked: If another EC2 instance
             already holds the requested lock.
         :raises ec2helper.errors.InstanceUnhealthy: If this EC2 instance can't
@@ -130,8 +160,13 @@ class Instance(object):
 
             Function :func:`ec2helper.utils.tags_to_dict`
                 For details about ISO timestring tag values.
+            Class :class:`ec2helper.dynamodb_lock.DynamoDBLock`
+                Lock backend for high frequency locking with strict mutual
+                exclusion.
         """
-        return TagLock(self, lock_name, group_tag, group_value, ttl,
+        if backend is None:
+            backend = TagLock
+        return backend(self, lock_name, group_tag, group_value, ttl,
                        check_health)
 
     ##### tags #####
@@ -196,7 +231,7 @@ class Instance(object):
             Function :func:`ec2helper.utils.tags_to_dict`
                 For details about the value conversion.
         """
-        client = boto3.client("ec2", region_name=self.region)
+        client = get_client("ec2", self.region)
         response = client.describe_tags(
             Filters=[{
                 "Name": "resource-id",
@@ -204,7 +239,9 @@ class Instance(object):
             }]
         )
         assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
-        return tags_to_dict(response["Tags"])
+        tags = tags_to_dict(response["Tags"])
+        self._tag_cache = dict(tags)
+        return tags
 
     @tags.setter
     def tags(self, value):
@@ -232,12 +269,14 @@ class Instance(object):
             Function :func:`ec2helper.utils.tags_to_dict`
                 For details about the value conversion.
         """
-        client = boto3.client("ec2", region_name=self.region)
+        client = get_client("ec2", self.region)
         response = client.create_tags(
             Resources=[self.id],
             Tags=dict_to_tags(kwargs)
         )
         assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        for key in kwargs:
+            self._tag_cache.pop(key, None)
 
     def delete_tags(self, *args):
         """
@@ -258,12 +297,29 @@ class Instance(object):
             Function :func:`~ec2helper.instance.Instance.update_tags`
                 Update the instance's tags.
         """
-        client = boto3.client("ec2", region_name=self.region)
+        client = get_client("ec2", self.region)
         response = client.delete_tags(
             Resources=[self.id],
             Tags=[{"Key": k} for k in args]
         )
         assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        if args:
+            for key in args:
+                self._tag_cache.pop(key, None)
+        else:
+            self._tag_cache = dict()
+
+    def _cached_tag(self, key):
+        """
+        Get a tag value, reading the tags only if the value isn't known from a
+        former call yet.
+
+        :raises ec2helper.errors.TagNotFound: If the tag doesn't exist.
+        """
+        if key not in self._tag_cache:
+            if key not in self.tags:
+                raise TagNotFound(key)
+        return self._tag_cache[key]
 
     ##### autoscaling #####
 
@@ -293,7 +349,7 @@ class Instance(object):
 
             autoscaling:DescribeAutoScalingInstances
         """
-        client = boto3.client("autoscaling", region_name=self.region)
+        client = get_client("autoscaling", self.region)
         response = client.describe_auto_scaling_instances(
             InstanceIds=[self.id]
         )
@@ -341,10 +397,16 @@ class Instance(object):
         """Setter - see property"""
         data = self.autoscaling
         if data is None: return
-        client = boto3.client("autoscaling", region_name=self.region)
+        self._set_autoscaling_protected(data["AutoScalingGroupName"], value)
+
+    def _set_autoscaling_protected(self, asg, value):
+        """
+        Set scale in protection if the autoscaling group is already known.
+        """
+        client = get_client("autoscaling", self.region)
         response = client.set_instance_protection(
             InstanceIds=[self.id],
-            AutoScalingGroupName=data["AutoScalingGroupName"],
+            AutoScalingGroupName=asg,
             ProtectedFromScaleIn=bool(value)
         )
         assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
@@ -355,6 +417,11 @@ class Instance(object):
         if this EC2 instance is not a member of an autoscaling group. Resets the
         former state afterward.
 
+        The protection is reference counted per instance for the whole
+        process, nested or concurrent guards (and
+        :func:`~ec2helper.instance.Instance.lock`) don't reset it while
+        another one is still active and make no additional API calls.
+
         :return: The AutoscalingProtection context guard.
         :rtype: :class:`ec2helper.as_protection.AutoscalingProtection`
 
@@ -432,7 +499,7 @@ class Instance(object):
         """Setter - see property"""
         data = self.autoscaling
         if data is None: return
-        client = boto3.client("autoscaling", region_name=self.region)
+        client = get_client("autoscaling", self.region)
         response = client.set_instance_health(
             InstanceId=self.id,
             ShouldRespectGracePeriod=False,
@@ -507,7 +574,7 @@ class Instance(object):
         data = self.autoscaling
         if data is None: return
         raise NotImplementedError()
-        client = boto3.client("autoscaling", region_name=self.region)
+        client = get_client("autoscaling", self.region)
         # data["LifecycleState"] == "InService"
         if value:
             # response = client.put_scaling_policy(
@@ -545,7 +612,9 @@ class Instance(object):
         :type dimensions: list or dict
         :param string dimension_from_tag: Instead of :attr:`dimensions` use
             the given tag key and the value found for that tag as a dimension
-            pair.
+            pair. The tag value is read once and then cached by this object
+            (until the tag is changed through it or
+            :attr:`~ec2helper.instance.Instance.tags` is read again).
         :param bool add_instance_dimension: If :attr:`dimension_from_tag` or
             :attr:`dimensions` is used, :code:`True` will add 'InstanceId' and
             this instance's id to the list of dimensions.
@@ -578,16 +647,35 @@ class Instance(object):
 
             Function :func:`~ec2helper.instance.Instance.put_metric_data_ec2_group`
                 Both, by instance id and tag at the same time.
+            Attribute :attr:`~ec2helper.instance.Instance.metric_sink`
+                If a metric sink is installed it receives the datum instead.
+        """
+        namespace, datums = self._metric_data(metric_name, value, unit,
+            namespace, dimensions, dimension_from_tag, add_instance_dimension)
+        self._put_datums(namespace, datums)
+
+    def _put_datums(self, namespace, datums):
+        """
+        Pass datums to the metric sink or send them.
+        """
+        if self.metric_sink is not None:
+            for datum in datums:
+                self.metric_sink.add(namespace, datum)
+        else:
+            send_metric_data(self.region, namespace, datums)
+
+    def _metric_data(self, metric_name, value, unit='Count',
+        namespace='AWS/EC2', dimensions=None, dimension_from_tag=None,
+        add_instance_dimension=False):
+        """
+        Build the namespace and datums for
+        :func:`~ec2helper.instance.Instance.put_metric_data`.
         """
         if dimension_from_tag:
-            tags = self.tags
-            if dimension_from_tag in tags:
-                dimensions = [{
-                    'Name': dimension_from_tag,
-                    'Value': tags[dimension_from_tag]
-                }]
-            else:
-                raise TagNotFound(dimension_from_tag)
+            dimensions = [{
+                'Name': dimension_from_tag,
+                'Value': self._cached_tag(dimension_from_tag)
+            }]
         elif dimensions is None:
             dimensions = [{
                 'Name': 'InstanceId',
@@ -596,30 +684,308 @@ class Instance(object):
         elif isinstance(dimensions, dict):
             dimensions = [{"Name": k, "Value": v} for k, v in six.iteritems(
                          dimensions)]
+        else:
+            dimensions = list(dimensions)
         if add_instance_dimension:
             dimensions.append({
                 'Name': 'InstanceId',
                 'Value': self.id
             })
-        client = boto3.client("cloudwatch", region_name=self.region)
-        response = client.put_metric_data(
-            Namespace=namespace,
-            MetricData=[{
-                'MetricName': metric_name,
-                'Dimensions': dimensions,
-                'Value': value,
-                'Unit': unit
-            }]
-        )
-        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        return namespace, [{
+            'MetricName': metric_name,
+            'Dimensions': dimensions,
+            'Value': value,
+            'Unit': unit
+        }]
+
+    def metric_buffer(self, max_datums=MAX_DATUMS, max_age=60):
+        """
+        Buffer the datums of
+        :func:`~ec2helper.instance.Instance.put_metric_data` inside the
+        with-block and send them with as few requests as possible (up to 1000
+        datums per request). The buffer is flushed when it is full, when the
+        oldest datum is older than :attr:`max_age` and when the with-block is
+        left.
+
+        :param int max_datums: Flush when this number of datums is reached.
+        :param float max_age: Flush when the oldest datum is older (seconds,
+            only checked when a datum is added).
+        :return: The MetricBuffer context guard.
+        :rtype: :class:`ec2helper.metrics.MetricBuffer`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            with i.metric_buffer():
+                for n in range(5000):
+                    i.put_metric_data('Requests', 1)
+            # 5 put_metric_data requests
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+
+        .. seealso::
+
+            Module :mod:`ec2helper.metrics`
+                How metric sinks work.
+        """
+        return MetricBuffer(self, max_datums, max_age)
+
+    def metric_publisher(self, flush_interval=10, max_queue=10000,
+                         policy="drop"):
+        """
+        Publish the datums of
+        :func:`~ec2helper.instance.Instance.put_metric_data` from a background
+        thread, so the calls return immediately instead of waiting for
+        CloudWatch. Datums are sent batched every :attr:`flush_interval`
+        seconds and when the with-block is left. Use
+        :func:`~ec2helper.metrics.MetricPublisher.start` instead of a
+        with-block to publish for the lifetime of the process, queued datums
+        are flushed at interpreter exit.
+
+        :param float flush_interval: Send collected datums after this many
+            seconds.
+        :param int max_queue: The maximum number of queued datums.
+        :param string policy: What to do if the queue is full, "drop" the
+            datum (default) or "block" until there is room.
+        :return: The MetricPublisher context guard, see its :attr:`sent`,
+            :attr:`dropped` and :attr:`failed` counters.
+        :rtype: :class:`ec2helper.metrics.MetricPublisher`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            publisher = i.metric_publisher(flush_interval=5).start()
+            i.put_metric_data('Requests', 1)  # returns immediately
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+
+        .. seealso::
+
+            Module :mod:`ec2helper.metrics`
+                How metric sinks work.
+        """
+        return MetricPublisher(self, flush_interval, max_queue, policy)
+
+    def metric_aggregation(self, period=60, mode="statistics"):
+        """
+        Aggregate the datums of
+        :func:`~ec2helper.instance.Instance.put_metric_data` inside the
+        with-block per metric, dimensions, unit and :attr:`period`, so one
+        datum represents all values of a period. With mode "statistics" the
+        values are rolled up into sample count, sum, minimum and maximum, with
+        mode "values" into "Values" and "Counts" arrays, which also allows
+        CloudWatch to compute exact percentiles.
+
+        The aggregated datums are passed to the sink that was installed
+        before, so combine it with
+        :func:`~ec2helper.instance.Instance.metric_publisher` or
+        :func:`~ec2helper.instance.Instance.metric_buffer` to also batch the
+        requests.
+
+        :param int period: The aggregation period in seconds.
+        :param string mode: "statistics" (default) or "values".
+        :return: The MetricAggregator context guard.
+        :rtype: :class:`ec2helper.metrics.MetricAggregator`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            with i.metric_publisher(), i.metric_aggregation(mode="values"):
+                for request in requests:
+                    i.put_metric_data('Latency', request.time, 'Seconds')
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+
+        .. seealso::
+
+            Module :mod:`ec2helper.metrics`
+                How metric sinks work.
+        """
+        return MetricAggregator(self, period, mode)
+
+    def metric_deduplication(self, threshold=0, max_silence=300):
+        """
+        Suppress datums of
+        :func:`~ec2helper.instance.Instance.put_metric_data` inside the
+        with-block whose value didn't change by more than :attr:`threshold`
+        since the last datum of the same metric, dimensions and unit was
+        published. A datum is published anyway if the last one is
+        :attr:`max_silence` seconds old, so the metric never goes missing.
+        Useful for slow moving gauges that are published often.
+
+        The remaining datums are passed to the sink that was installed
+        before.
+
+        :param float threshold: The absolute change to publish a datum
+            (default 0, every change is published).
+        :param float max_silence: The heartbeat interval in seconds.
+        :return: The MetricDeduplicator context guard, see its
+            :attr:`suppressed` counter.
+        :rtype: :class:`ec2helper.metrics.MetricDeduplicator`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            with i.metric_deduplication(threshold=5, max_silence=600):
+                while True:
+                    i.put_metric_data('QueueDepth', queue.depth())
+                    time.sleep(5)
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+
+        .. seealso::
+
+            Module :mod:`ec2helper.metrics`
+                How metric sinks work.
+        """
+        return MetricDeduplicator(self, threshold, max_silence)
+
+    def embedded_metrics(self, target="stdout", max_lines=100, max_age=10):
+        """
+        Write the datums of
+        :func:`~ec2helper.instance.Instance.put_metric_data` inside the
+        with-block as CloudWatch Embedded Metric Format JSON lines instead of
+        sending them to the API, e.g. to the CloudWatch agent or a log file
+        shipped by an agent.
+
+        :param target: "stdout" (default), a file path to append to,
+            "tcp://<host>:<port>", "udp://<host>:<port>" or a writable text
+            file object.
+        :param int max_lines: Write when this number of lines is collected.
+        :param float max_age: Write when the oldest line is older (seconds,
+            only checked when a datum is added).
+        :return: The EmbeddedMetricSink context guard.
+        :rtype: :class:`ec2helper.emf.EmbeddedMetricSink`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            with i.embedded_metrics("/var/log/app/metrics.log"):
+                i.put_metric_data('JobsDone', 138)
+
+        .. seealso::
+
+            Module :mod:`ec2helper.emf`
+                The record format.
+        """
+        return EmbeddedMetricSink(self, target, max_lines, max_age)
+
+    def system_metrics(self, interval=60, namespace="System/Linux",
+                       disks=True, network=True):
+        """
+        Collect CPU, memory, disk and network metrics with psutil every
+        :attr:`interval` seconds in a background thread and publish them for
+        this instance (and its autoscaling group) through the current
+        :attr:`~ec2helper.instance.Instance.metric_sink`, or with one request
+        per sample if there is none. Use it as a with-block or call
+        :func:`~ec2helper.system_metrics.SystemMetricsCollector.start` to
+        collect for the lifetime of the process.
+
+        :param float interval: Seconds between two samples.
+        :param string namespace: The namespace (default is "System/Linux").
+        :param bool disks: Publish disk space and disk I/O metrics.
+        :param bool network: Publish network metrics.
+        :return: The SystemMetricsCollector context guard.
+        :rtype: :class:`ec2helper.system_metrics.SystemMetricsCollector`
+
+        .. code-block:: python
+
+            from ec2helper import Instance
+
+            i = Instance()
+            i.system_metrics(interval=60).start()
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+            ec2:DescribeTags
+
+        .. seealso::
+
+            Module :mod:`ec2helper.system_metrics`
+                The published metrics.
+        """
+        return SystemMetricsCollector(self, interval, namespace, disks,
+                                      network)
+
+    def put_metric_data_multi(self, metric_name, value, unit='Count',
+        namespace='AWS/EC2', dimension_sets=None):
+        """
+        Like :func:`~ec2helper.instance.Instance.put_metric_data` but puts the
+        provided data to several dimension sets with a single request.
+
+        :param string metric_name: The name of the metric to put data to.
+        :param float value: The value to upload.
+        :param string unit: The unit of the value (default is "Count").
+        :param string namespace: The namespace (default is "AWS/EC2").
+        :param list dimension_sets: A list of dicts, each with the dimension
+            keyword arguments of
+            :func:`~ec2helper.instance.Instance.put_metric_data`
+            (:attr:`dimensions`, :attr:`dimension_from_tag` and
+            :attr:`add_instance_dimension`). An empty dict stands for the
+            'InstanceId' dimension. Default is just the 'InstanceId'
+            dimension.
+        :raises ec2helper.errors.TagNotFound: If a :attr:`dimension_from_tag`
+            is used and the tag can't be found on this EC2 instance. Nothing is
+            sent in that case.
+
+        .. code-block:: python
+            :caption: Example: Put data by instance id, autoscaling group and
+                availability zone
+
+            from ec2helper import Instance
+
+            i = Instance()
+            i.put_metric_data_multi("JobsDone", 138, dimension_sets=[
+                {},
+                {"dimension_from_tag": "aws:autoscaling:groupName"},
+                {"dimensions": {"AvailabilityZone": "eu-central-1b"}}
+            ])
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            cloudwatch:PutMetricData
+            ec2:DescribeTags
+        """
+        datums = list()
+        for dimension_set in dimension_sets or [{}]:
+            datums.extend(self._metric_data(metric_name, value, unit,
+                namespace, **dimension_set)[1])
+        self._put_datums(namespace, datums)
 
     def put_metric_data_ec2_group(self, group_tag, metric_name, value,
         unit='Count'):
         """
         Like :func:`~ec2helper.instance.Instance.put_metric_data` but puts the
         provided data to two separate dimensions, "InstanceId" and the provided
-        :attr:`group_tag`. The namespace will be "AWS/EC2", the dimension
-        values will be this instances id and the value of the provided tag.
+        :attr:`group_tag`, with a single request. The namespace will be
+        "AWS/EC2", the dimension values will be this instances id and the value
+        of the provided tag (read once and cached, see
+        :func:`~ec2helper.instance.Instance.put_metric_data`).
 
         :param string group_tag: The tag to use for grouping the metric data
             accross several instances.
@@ -627,8 +993,7 @@ class Instance(object):
         :param float value: The value to upload.
         :param string unit: The unit of the value (default is "Count").
         :raises ec2helper.errors.TagNotFound: If :attr:`group_tag` can't be
-            found as a tag on this EC2 instance. At the time the exception is
-            raised the metric data was already saved for "InstanceId" dimension.
+            found as a tag on this EC2 instance. Nothing is sent in that case.
 
         .. code-block:: python
             :caption: Example: Put data by instance id and autoscaling group
@@ -649,18 +1014,36 @@ class Instance(object):
 
             Function :func:`~ec2helper.instance.Instance.put_metric_data`
                 For a single, configurable put_metric_data request.
+            Function :func:`~ec2helper.instance.Instance.put_metric_data_multi`
+                For any list of dimension sets.
         """
-        self.put_metric_data(metric_name, value, unit)
-        self.put_metric_data(metric_name, value, unit,
-            dimension_from_tag=group_tag)
+        self.put_metric_data_multi(metric_name, value, unit,
+            dimension_sets=[{}, {"dimension_from_tag": group_tag}])
 
     ##### ebs #####
 
+    def _is_local(self):
+        """
+        Check if this is the EC2 instance the script is running on.
+        """
+        return is_ec2() and self.id == metadata("instance_id")
+
     @property
     def volumes(self):
         """
         Get this EC2 instance's volumes.
 
+        On the EC2 instance itself the root volume is the one holding the root
+        filesystem (see :mod:`ec2helper.devices`), otherwise the one attached
+        as "/dev/xvda", "/dev/sda1" or "/dev/sda".
+
+        The volumes are cached for
+        :attr:`~ec2helper.instance.Instance.volumes_ttl` seconds (also for
+        :func:`~ec2helper.instance.Instance.create_backup`), so repeated reads
+        make no API calls, see
+        :func:`~ec2helper.instance.Instance.refresh_volumes`. Every read
+        returns a copy which may be modified.
+
         This attribute is readonly.
 
         .. code-block:: json
@@ -694,7 +1077,59 @@ class Instance(object):
 
             ec2:DescribeVolumes
         """
-        client = boto3.client("ec2", region_name=self.region)
+        with self._volume_lock:
+            if self._volume_time is None or \
+                    time.time() - self._volume_time >= self.volumes_ttl:
+                self._load_volumes()
+            return copy.deepcopy(self._volume_cache)
+
+    def refresh_volumes(self, volume_ids=None):
+        """
+        Refresh the cached :attr:`~ec2helper.instance.Instance.volumes`,
+        either all of them or only the given volumes (one
+        :func:`describe_volumes` call for just these volumes, volumes no longer
+        attached to this instance are removed). Refreshing single volumes
+        doesn't extend the lifetime of the cache.
+
+        :param list volume_ids: The volumes to refresh, all if :code:`None`
+            (default).
+
+        .. code-block:: none
+            :caption: AWS API permissions
+
+            ec2:DescribeVolumes
+        """
+        with self._volume_lock:
+            if volume_ids is None or self._volume_time is None:
+                self._load_volumes()
+                return
+            from botocore.exceptions import ClientError
+            client = get_client("ec2", self.region)
+            try:
+                response = client.describe_volumes(
+                    VolumeIds=sorted(set(volume_ids)))
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "InvalidVolume.NotFound":
+                    raise
+                self._load_volumes()
+                return
+            found = dict()
+            for volume in response["Volumes"]:
+                volume = self._parse_volume(volume)
+                if volume is not None:
+                    found[volume["VolumeId"]] = volume
+            for vid in volume_ids:
+                if vid in found:
+                    self._volume_cache[vid] = found[vid]
+                else:
+                    self._volume_cache.pop(vid, None)
+            self._mark_root(self._volume_cache)
+
+    def _load_volumes(self):
+        """
+        Describe all volumes of this instance into the cache.
+        """
+        client = get_client("ec2", self.region)
         paginator = client.get_paginator('describe_volumes')
         volumes = dict()
         for page in paginator.paginate(
@@ -704,29 +1139,72 @@ class Instance(object):
             }]
         ):
             for volume in page["Volumes"]:
-                vid = volume["VolumeId"]
-                volume["Attachment"] = sorted(volume["Attachments"])[-1]
-                volume["Attachment"]["Root"] = True if volume["Attachment"][
-                    "Device"] == "/dev/xvda" else False
-                del volume["Attachments"]
-                if "Tags" in volume:
-                    volume["Tags"] = tags_to_dict(volume["Tags"])
-                else:
-                    volume["Tags"] = {}
-                volumes[vid] = volume
-        return volumes
+                volume = self._parse_volume(volume)
+                if volume is not None:
+                    volumes[volume["VolumeId"]] = volume
+        self._mark_root(volumes)
+        self._volume_cache = volumes
+        self._volume_time = time.time()
+
+    def _parse_volume(self, volume):
+        """
+        Convert a volume as returned by :func:`describe_volumes`, :code:`None`
+        if it is not attached to this instance.
+        """
+        attachments = [x for x in volume.get("Attachments", []) if
+                       x["InstanceId"] == self.id]
+        if not attachments:
+            return None
+        volume["Attachment"] = attachments[-1]
+        del volume["Attachments"]
+        if "Tags" in volume:
+            volume["Tags"] = tags_to_dict(volume["Tags"])
+        else:
+            volume["Tags"] = {}
+        return volume
 
-    def delete_old_backups(self, delete_tag="DeleteAfter"):
+    def _mark_root(self, volumes):
+        """
+        Set the "Root" flag of the volume attachments.
         """
+        root = None
+        if self._is_local():
+            index = get_device_index()
+            if index.root_disk is not None:
+                for vid, volume in six.iteritems(volumes):
+                    if index.volume_disk(vid, volume["Attachment"][
+                            "Device"]) == index.root_disk:
+                        root = vid
+        for vid, volume in six.iteritems(volumes):
+            volume["Attachment"]["Root"] = vid == root if root is not None \
+                else volume["Attachment"]["Device"] in _ROOT_DEVICES
+
+    def delete_old_backups(self, delete_tag="DeleteAfter", max_workers=8,
+                           rate=5, dry_run=False):
+        """
+        Delete the expired backup snapshots of this EC2 instance (as created
+        by :func:`~ec2helper.instance.Instance.create_backup`). The snapshots
+        are deleted concurrently and rate limited by
+        :func:`~ec2helper.snapshots.delete_snapshots`.
+
+        :param string delete_tag: The tag key for the expiry time.
+        :param int max_workers: The maximum number of concurrent API calls.
+        :param float rate: The maximum number of delete calls per second,
+            :code:`None` for no limit.
+        :param bool dry_run: Only report the snapshots that would be deleted.
+        :return: A report of the deletion, see
+            :func:`~ec2helper.snapshots.delete_snapshots`.
+        :rtype: dict[string, list[string] or dict[string, string]]
+
         .. code-block:: none
             :caption: AWS API permissions
 
             ec2:DeleteSnapshot
             ec2:DescribeSnapshots
         """
-        client = boto3.client("ec2", region_name=self.region)
+        client = get_client("ec2", self.region)
         paginator = client.get_paginator('describe_snapshots')
-        snapshots = list()
+        snapshot_ids = list()
         now = datetime.now(tz=tz.tzutc())
         for page in paginator.paginate(
             Filters=[
@@ -743,80 +1221,275 @@ class Instance(object):
             for snapshot in page["Snapshots"]:
                 snapshot["Tags"] = tags_to_dict(snapshot["Tags"])
                 if now > snapshot["Tags"][delete_tag]:
-                    snapshots.append(snapshot)
-        for snapshot in snapshots:
-            response = client.delete_snapshot(
-                SnapshotId=snapshot["SnapshotId"]
-            )
-            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+                    snapshot_ids.append(snapshot["SnapshotId"])
+        return delete_snapshots(snapshot_ids, self.region, max_workers, rate,
+                                dry_run)
 
     def create_backup(self, volumes=None, retention=30,
-        delete_tag="DeleteAfter", tags=None):
+        delete_tag="DeleteAfter", tags=None, max_workers=8,
+        multi_volume=False, wait=False, wait_timeout=3600,
+        incremental=False):
         """
+        Create a snapshot of this EC2 instance's volumes. The snapshots are
+        created concurrently and tagged in the same call.
+
+        With :attr:`multi_volume` all selected volumes are snapshotted with one
+        :func:`create_snapshots` call instead, so the snapshots are crash
+        consistent across the volumes (e.g. of a RAID or LVM set). The call
+        tags the snapshots with the tags common to all of them, the volume
+        specific tags are added with one :func:`create_tags` call per snapshot
+        (made concurrently). To backup only some volumes this way the boot
+        volume is identified by the instance's "RootDeviceName" (one
+        :func:`describe_instances` call), if it is unknown the volumes are
+        snapshotted with one :func:`create_snapshot` call each instead.
+
+        With :attr:`incremental` volumes nothing was written to since their
+        last incremental backup are skipped, based on the write counters of
+        the local block devices (see :mod:`ec2helper.backup_state`).
+
+        Each snapshot is
+        tagged with :attr:`delete_tag` (the time it expires, see
+        :func:`~ec2helper.instance.Instance.delete_old_backups`),
+        "InstanceName", "InstanceId", "SnapshotType", "Device", "MountPoints",
+        the tags of its volume and the given :attr:`tags` (each overriding the
+        former) and a "Name" built of the name and the mount points or
+        device. Tags with the reserved "aws:" prefix are not copied.
+
+        :param list volumes: The devices (e.g. "/dev/xvdf") to backup, all
+            volumes if :code:`None` (default).
+        :param int retention: The days to keep the snapshots.
+        :param string delete_tag: The tag key for the expiry time.
+        :param dict tags: Additional tags for the snapshots.
+        :param int max_workers: The maximum number of concurrent API calls.
+        :param bool multi_volume: Snapshot all volumes at the same time with
+            one :func:`create_snapshots` call.
+        :param bool wait: Wait until all snapshots are completed, see
+            :func:`~ec2helper.snapshots.wait_for_snapshots`.
+        :param float wait_timeout: The maximum seconds to wait.
+        :param bool incremental: Skip volumes without writes since their last
+            backup.
+        :return: The snapshot id by device (skipped volumes are missing).
+        :rtype: dict[string, string]
+        :raises ~ec2helper.errors.SnapshotError: If waiting for the snapshots
+            failed or timed out.
+
+        .. code-block:: json
+            :caption: Example return value
+
+            {
+                "/dev/xvda": "snap-036167fc518855549",
+                "/dev/xvdf": "snap-0e3272af46c7d5d1e"
+            }
+
         .. code-block:: none
             :caption: AWS API permissions
 
             ec2:CreateSnapshot
+            ec2:CreateSnapshots
             ec2:CreateTags
+            ec2:DescribeInstances (only with multi_volume and volumes)
+            ec2:DescribeSnapshots (only with wait)
             ec2:DescribeTags
             ec2:DescribeVolumes
         """
-        # volumes to backup
+        if incremental:
+            with BackupState(self) as state:
+                snapshots = self._create_backup(volumes, retention,
+                    delete_tag, tags, max_workers, multi_volume, state)
+        else:
+            snapshots = self._create_backup(volumes, retention, delete_tag,
+                                            tags, max_workers, multi_volume)
+        if wait and snapshots:
+            wait_for_snapshots(list(snapshots.values()), self.region,
+                               wait_timeout)
+        return snapshots
+
+    def _create_backup(self, volumes, retention, delete_tag, tags,
+                       max_workers, multi_volume, state=None):
+        """
+        Create the snapshots of :func:`create_backup`, only of changed volumes
+        if a :class:`~ec2helper.backup_state.BackupState` is given.
+        """
         all_volumes = self.volumes
-        backup_volumes = dict()
-        if volumes is None:
-            backup_volumes = all_volumes
+        backup_volumes = self._backup_volumes(all_volumes, volumes)
+        if state is not None:
+            backup_volumes = state.changed(backup_volumes)
+        boot_volume = None
+        if multi_volume and backup_volumes and \
+                len(backup_volumes) < len(all_volumes):
+            # excluding volumes needs the boot volume, which can't be in
+            # ExcludeDataVolumeIds
+            boot_volume = self._boot_volume(all_volumes)
+            if boot_volume is None:
+                multi_volume = False
+        if multi_volume:
+            snapshots = self._create_snapshots(all_volumes, backup_volumes,
+                                               boot_volume, retention,
+                                               delete_tag, tags, max_workers)
         else:
-            for volume_id in all_volumes:
-                if all_volumes[volume_id]["Attachment"]["Device"] in volumes:
-                    backup_volumes[volume_id] = all_volumes[volume_id]
-        devices = [backup_volumes[x]["Attachment"]["Device"][-1] for x in
-                  backup_volumes]
-        # mount points
-        mounts = dict()
-        for part in psutil.disk_partitions():
-            for dev in devices:
-                if part.device.rstrip("1234567890")[-1] == dev:
-                    if dev not in mounts:
-                        mounts[dev[-1]] = list()
-                    mounts[dev[-1]].append(part.mountpoint)
-                    break
-        # tags
-        instance_tags = self.tags
-        backup_tags = {
-            delete_tag: datetime.now(tz=tz.tzutc()).replace(second=0,
-                        microsecond=0) + timedelta(days=int(retention)),
-            "InstanceName": instance_tags["Name"] if "Name" in instance_tags
-                        else "UnknownInstanceName",
-            "InstanceId": self.id,
-            "SnapshotType": "Backup"
-        }
-        # create and tag the snapshots
-        client = boto3.client("ec2", region_name=self.region)
-        for volume_id in backup_volumes:
+            snapshots = self._create_snapshot_each(backup_volumes, retention,
+                                                   delete_tag, tags,
+                                                   max_workers)
+        if state is not None:
+            state.record(dict((k, v) for k, v in six.iteritems(
+                backup_volumes) if v["Attachment"]["Device"] in snapshots))
+        return snapshots
+
+    def _create_snapshot_each(self, backup_volumes, retention, delete_tag,
+                              tags, max_workers):
+        """
+        Snapshot the volumes to backup with one concurrent
+        :func:`create_snapshot` call each.
+        """
+        if not backup_volumes:
+            return dict()
+        mounts = self._backup_mounts(backup_volumes)
+        backup_tags = self._backup_tags(retention, delete_tag)
+        client = get_client("ec2", self.region)
+
+        def snapshot(volume_id):
+            volume = backup_volumes[volume_id]
             description = "Backup {0} attached as {1} on {2} ({3})".format(
-                volume_id, backup_volumes[volume_id]["Attachment"]["Device"],
-                self.id, backup_tags["InstanceName"])
+                volume_id, volume["Attachment"]["Device"], self.id,
+                backup_tags["InstanceName"])
             response = client.create_snapshot(
                 Description=description,
-                VolumeId=volume_id
+                VolumeId=volume_id,
+                TagSpecifications=[{
+                    "ResourceType": "snapshot",
+                    "Tags": dict_to_tags(self._snapshot_tags(
+                        volume, backup_tags, mounts, tags))
+                }]
             )
             assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
-            backup_tags["Device"] = backup_volumes[volume_id]["Attachment"][
-                                    "Device"]
-            backup_tags["MountPoints"] = ",".join(mounts[backup_tags[
-                                         "Device"][-1]])
-            # volume tags > defaults
-            backup_tags.update(backup_volumes[volume_id]["Tags"])
-            # given tags > volume tags
-            if tags is not None:
-                backup_tags.update(tags)
-            backup_tags["Name"] = "{0} ({1})".format(backup_tags["Name"
-                ] if "Name" in backup_tags else backup_tags["InstanceName"],
-                backup_tags["MountPoints"] if backup_tags["MountPoints"] else
-                backup_tags["Device"])
+            return volume["Attachment"]["Device"], response["SnapshotId"]
+
+        with ThreadPoolExecutor(max_workers=min(max_workers,
+                                len(backup_volumes))) as pool:
+            return dict(pool.map(snapshot, sorted(backup_volumes)))
+
+    def _boot_volume(self, all_volumes):
+        """
+        The id of the boot volume (attached as the instance's
+        "RootDeviceName"), :code:`None` if unknown.
+        """
+        if self._root_device_name is None:
+            client = get_client("ec2", self.region)
+            response = client.describe_instances(InstanceIds=[self.id])
+            for reservation in response["Reservations"]:
+                for instance in reservation["Instances"]:
+                    self._root_device_name = instance.get("RootDeviceName")
+        for vid, volume in six.iteritems(all_volumes):
+            if volume["Attachment"]["Device"] == self._root_device_name:
+                return vid
+        return None
+
+    def _create_snapshots(self, all_volumes, backup_volumes, boot_volume,
+                          retention, delete_tag, tags, max_workers):
+        """
+        Snapshot the volumes to backup with one multi volume
+        :func:`create_snapshots` call, then add the volume specific tags.
+        The :attr:`boot_volume` must be known if not all volumes are backed
+        up.
+        """
+        if not backup_volumes:
+            return dict()
+        mounts = self._backup_mounts(backup_volumes)
+        backup_tags = self._backup_tags(retention, delete_tag)
+        instance_spec = {"InstanceId": self.id, "ExcludeBootVolume": False}
+        if len(backup_volumes) < len(all_volumes):
+            instance_spec["ExcludeBootVolume"] = \
+                boot_volume not in backup_volumes
+            excluded = sorted(k for k in all_volumes if
+                              k not in backup_volumes and k != boot_volume)
+            if excluded:
+                instance_spec["ExcludeDataVolumeIds"] = excluded
+        client = get_client("ec2", self.region)
+        response = client.create_snapshots(
+            Description="Backup of {0} ({1})".format(
+                self.id, backup_tags["InstanceName"]),
+            InstanceSpecification=instance_spec,
+            TagSpecifications=[{
+                "ResourceType": "snapshot",
+                "Tags": dict_to_tags(backup_tags)
+            }]
+        )
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        snapshots = [x for x in response["Snapshots"] if
+                     x["VolumeId"] in backup_volumes]
+
+        def tag(snapshot):
+            volume = backup_volumes[snapshot["VolumeId"]]
+            snapshot_tags = self._snapshot_tags(volume, backup_tags, mounts,
+                                                tags)
             response = client.create_tags(
-                Resources=[response["SnapshotId"]],
-                Tags=dict_to_tags(backup_tags)
+                Resources=[snapshot["SnapshotId"]],
+                Tags=dict_to_tags(dict(
+                    (k, v) for k, v in six.iteritems(snapshot_tags) if
+                    backup_tags.get(k) != v))
             )
             assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+            return volume["Attachment"]["Device"], snapshot["SnapshotId"]
+
+        if not snapshots:
+            return dict()
+        with ThreadPoolExecutor(max_workers=min(max_workers,
+                                len(snapshots))) as pool:
+            return dict(pool.map(tag, snapshots))
+
+    @staticmethod
+    def _backup_volumes(all_volumes, volumes):
+        """
+        Select the volumes to backup by device.
+        """
+        if volumes is None:
+            return all_volumes
+        return dict((k, v) for k, v in six.iteritems(all_volumes) if
+                    v["Attachment"]["Device"] in volumes)
+
+    def _backup_mounts(self, backup_volumes):
+        """
+        Find the mount points of the volumes to backup, by volume id (only
+        known on the EC2 instance itself).
+        """
+        if not self._is_local():
+            return dict()
+        index = get_device_index()
+        return dict((k, index.mount_points(index.volume_disk(
+            k, v["Attachment"]["Device"]))) for k, v in
+            six.iteritems(backup_volumes))
+
+    def _backup_tags(self, retention, delete_tag):
+        """
+        The tags common to all snapshots of a backup.
+        """
+        instance_tags = self.tags
+        return {
+            delete_tag: datetime.now(tz=tz.tzutc()).replace(second=0,
+                        microsecond=0) + timedelta(days=int(retention)),
+            "InstanceName": instance_tags["Name"] if "Name" in instance_tags
+                        else "UnknownInstanceName",
+            "InstanceId": self.id,
+            "SnapshotType": "Backup"
+        }
+
+    @staticmethod
+    def _snapshot_tags(volume, backup_tags, mounts, tags):
+        """
+        Merge the tags of one snapshot: defaults < volume tags < given tags.
+        """
+        snapshot_tags = dict(backup_tags)
+        snapshot_tags["Device"] = volume["Attachment"]["Device"]
+        snapshot_tags["MountPoints"] = ",".join(mounts.get(
+                                       volume["VolumeId"], []))
+        # volume tags > defaults
+        snapshot_tags.update(volume["Tags"])
+        # given tags > volume tags
+        if tags is not None:
+            snapshot_tags.update(tags)
+        snapshot_tags["Name"] = "{0} ({1})".format(snapshot_tags["Name"
+            ] if "Name" in snapshot_tags else snapshot_tags["InstanceName"],
+            snapshot_tags["MountPoints"] if snapshot_tags["MountPoints"] else
+            snapshot_tags["Device"])
+        return dict((k, v) for k, v in six.iteritems(snapshot_tags) if
+                    not k.startswith("aws:"))
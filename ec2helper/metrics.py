@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+"""
+.. _boto3: https://boto3.readthedocs.io/en/latest/
+
+CloudWatch metric sinks
+=======================
+
+By default :func:`ec2helper.instance.Instance.put_metric_data` sends every
+datum with its own :func:`put_metric_data` request. A metric sink installed as
+:attr:`~ec2helper.instance.Instance.metric_sink` of an instance receives the
+datums instead. Sinks are context guards that install themselves on enter and
+restore the former sink on exit, so call sites don't need to be changed.
+A sink passes the datums it emits to the sink that was installed before it,
+the last one in the chain sends them with
+:func:`~ec2helper.metrics.send_metric_data`.
+
+.. code-block:: python
+
+    from ec2helper import Instance
+
+    i = Instance()
+    with i.metric_buffer(max_age=30):
+        for job in jobs:
+            job.run()
+            i.put_metric_data('JobsDone', 1)
+"""
+from __future__ import unicode_literals, absolute_import
+import atexit
+import calendar
+import itertools
+import threading
+import time
+import weakref
+from datetime import datetime
+from collections import Counter
+import six
+from six.moves import queue
+from dateutil import tz
+from ec2helper.clients import get_client
+
+#: The maximum number of datums per :func:`put_metric_data` request.
+MAX_DATUMS = 1000
+#: The maximum payload of a :func:`put_metric_data` request in bytes.
+MAX_PAYLOAD = 1000000
+#: Estimated size of the request parameters besides the datums in bytes.
+REQUEST_OVERHEAD = 1000
+#: The maximum number of distinct values in the Values array of a datum.
+MAX_VALUES = 150
+
+
+def _datum_size(value, prefix="MetricData.member.1000."):
+    """
+    Estimate the size of a datum as encoded in a query API request, where
+    every leaf value is sent as "<path>=<value>&".
+    """
+    if isinstance(value, dict):
+        return sum(_datum_size(v, prefix + k + ".") for k, v in
+                   six.iteritems(value))
+    if isinstance(value, (list, tuple)):
+        return sum(_datum_size(v, "{0}member.{1}.".format(prefix, n + 1)) for
+                   n, v in enumerate(value))
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return len(prefix) + len(six.text_type(value)) + 1
+
+
+def _pack(datums, max_datums=MAX_DATUMS, max_payload=MAX_PAYLOAD):
+    """
+    Split datums into request sized lists regarding the datum and payload
+    limits of :func:`put_metric_data`.
+    """
+    batch = list()
+    size = REQUEST_OVERHEAD
+    for datum in datums:
+        datum_size = _datum_size(datum)
+        if batch and (len(batch) >= max_datums or
+                      size + datum_size > max_payload):
+            yield batch
+            batch = list()
+            size = REQUEST_OVERHEAD
+        batch.append(datum)
+        size += datum_size
+    if batch:
+        yield batch
+
+
+def send_metric_data(region, namespace, datums):
+    """
+    Send datums with as few :func:`put_metric_data` requests as possible.
+
+    :param string region: The region to make the API calls to.
+    :param string namespace: The namespace of all datums.
+    :param list datums: The datums as required by boto3_'s
+        :func:`~client.put_metric_data`.
+    :return: The number of requests made.
+    :rtype: int
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        cloudwatch:PutMetricData
+    """
+    client = get_client("cloudwatch", region)
+    requests = 0
+    for batch in _pack(datums):
+        response = client.put_metric_data(
+            Namespace=namespace,
+            MetricData=batch
+        )
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        requests += 1
+    return requests
+
+
+class MetricSink(object):
+    """
+    Common base class for metric sinks. A sink gets datums by
+    :func:`add` and emits datums by :func:`_emit`, either to the sink that was
+    installed at the instance before or straight to CloudWatch.
+
+    :param instance: The instance the sink is used for.
+    """
+
+    def __init__(self, instance):
+        """Constructor - see class docu."""
+        self._instance = instance
+        #: The sink receiving the emitted datums, :code:`None` sends them to
+        #: CloudWatch.
+        self.downstream = None
+
+    def __enter__(self):
+        """
+        Install this sink at the instance.
+        """
+        self.downstream = self._instance.metric_sink
+        self._instance.metric_sink = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Flush the sink and restore the former sink of the instance.
+        """
+        try:
+            self.flush()
+        finally:
+            self._instance.metric_sink = self.downstream
+
+    def add(self, namespace, datum):
+        """
+        Receive a datum.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        """
+        Emit everything held by the sink and flush the downstream sink.
+        """
+        if self.downstream is not None:
+            self.downstream.flush()
+
+    def put_metric_data(self, *args, **kwargs):
+        """
+        Like :func:`ec2helper.instance.Instance.put_metric_data`, but always
+        into this sink, regardless of the sink installed at the instance.
+        """
+        namespace, datums = self._instance._metric_data(*args, **kwargs)
+        for datum in datums:
+            self.add(namespace, datum)
+
+    def _emit(self, namespace, datums):
+        """
+        Pass datums on to the downstream sink or send them.
+        """
+        if self.downstream is not None:
+            for datum in datums:
+                self.downstream.add(namespace, datum)
+        else:
+            send_metric_data(self._instance.region, namespace, datums)
+
+
+class MetricBuffer(MetricSink):
+    """
+    Metric sink that accumulates datums and sends them with as few
+    :func:`put_metric_data` requests as the API limits allow. The buffer is
+    flushed when it holds :attr:`max_datums` datums, when a datum is added
+    and the oldest one is older than :attr:`max_age` seconds and when the
+    context guard is left.
+    Datums get the time they were added as timestamp. The buffer is thread
+    safe.
+
+    This class is not meant to be used directly, use
+    :func:`ec2helper.instance.Instance.metric_buffer` instead.
+
+    :param instance: The instance the sink is used for.
+    :param int max_datums: Flush when this number of datums is reached.
+    :param float max_age: Flush when the oldest datum is older (seconds).
+    """
+
+    def __init__(self, instance, max_datums=MAX_DATUMS, max_age=60):
+        """Constructor - see class docu."""
+        super(MetricBuffer, self).__init__(instance)
+        #: The :code:`max_datums` parameter.
+        self.max_datums = max_datums
+        #: The :code:`max_age` parameter.
+        self.max_age = max_age
+        self._datums = dict()
+        self._count = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, namespace, datum):
+        """
+        Add a datum to the buffer and flush if it is full or too old.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        if "Timestamp" not in datum:
+            datum = dict(datum, Timestamp=datetime.now(tz=tz.tzutc()))
+        now = time.time()
+        with self._lock:
+            self._datums.setdefault(namespace, []).append(datum)
+            self._count += 1
+            if self._oldest is None:
+                self._oldest = now
+            full = self._count >= self.max_datums or \
+                now - self._oldest >= self.max_age
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send all buffered datums.
+        """
+        with self._lock:
+            datums, self._datums = self._datums, dict()
+            self._count = 0
+            self._oldest = None
+        for namespace in sorted(datums):
+            self._emit(namespace, datums[namespace])
+        super(MetricBuffer, self).flush()
+
+
+#: The started publishers, stopped (and thus flushed) at interpreter exit.
+_publishers = weakref.WeakSet()
+_start_order = itertools.count()
+#: Seconds between checks whether a publisher thread is still alive while
+#: waiting for it.
+_POLL_INTERVAL = 0.1
+
+
+@atexit.register
+def _stop_publishers():
+    """
+    Stop all running publishers, newest first so datums they pass on reach
+    the publishers started before them.
+    """
+    for publisher in sorted(list(_publishers), key=lambda x: -x._started):
+        publisher.stop()
+
+
+class MetricPublisher(MetricSink):
+    """
+    Metric sink that publishes datums from a background thread, so
+    :func:`add` (and thus :func:`~ec2helper.instance.Instance.put_metric_data`)
+    returns immediately. Datums are queued in a bounded queue, the daemon
+    thread collects them and sends them every :attr:`flush_interval` seconds
+    or as soon as a full request is collected. Datums still queued when the
+    interpreter exits are flushed by an :py:mod:`atexit` handler.
+
+    This class is not meant to be used directly, use
+    :func:`ec2helper.instance.Instance.metric_publisher` instead.
+
+    :param instance: The instance the sink is used for.
+    :param float flush_interval: Send collected datums after this many
+        seconds.
+    :param int max_queue: The maximum number of queued datums.
+    :param string policy: What to do if the queue is full, "drop" the datum
+        or "block" until there is room.
+    """
+    _STOP = object()
+
+    def __init__(self, instance, flush_interval=10, max_queue=10000,
+                 policy="drop"):
+        """Constructor - see class docu."""
+        super(MetricPublisher, self).__init__(instance)
+        assert policy in ("drop", "block"), "policy must be drop or block"
+        #: The :code:`flush_interval` parameter.
+        self.flush_interval = flush_interval
+        #: The :code:`policy` parameter.
+        self.policy = policy
+        #: Number of datums sent (or passed downstream).
+        self.sent = 0
+        #: Number of datums dropped because the queue was full.
+        self.dropped = 0
+        #: Number of datums that could not be sent.
+        self.failed = 0
+        #: The last exception raised while sending or flushing downstream,
+        #: :code:`None` if none.
+        self.last_error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._started = 0
+        self._counter_lock = threading.Lock()
+
+    def __enter__(self):
+        """
+        Install this sink at the instance and start the background thread.
+        """
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        """
+        Flush, stop the background thread and restore the former sink.
+        """
+        self.stop()
+
+    def start(self):
+        """
+        Like entering the context guard, for publishers living as long as the
+        process.
+
+        :return: The publisher itself.
+        """
+        if self._thread is None:
+            super(MetricPublisher, self).__enter__()
+            self._thread = threading.Thread(target=self.__run,
+                                            name="ec2helper-metrics")
+            self._thread.daemon = True
+            self._thread.start()
+            self._started = next(_start_order)
+            _publishers.add(self)
+        return self
+
+    def stop(self):
+        """
+        Flush all queued datums, stop the background thread and restore the
+        former sink of the instance. Calling it again has no effect.
+        """
+        if self._thread is None:
+            return
+        _publishers.discard(self)
+        self.__put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        if self._instance.metric_sink is self:
+            self._instance.metric_sink = self.downstream
+        if self.downstream is not None:
+            self.downstream.flush()
+
+    def add(self, namespace, datum):
+        """
+        Queue a datum, depending on :attr:`policy` drop it or wait if the
+        queue is full.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        if "Timestamp" not in datum:
+            datum = dict(datum, Timestamp=datetime.now(tz=tz.tzutc()))
+        try:
+            self._queue.put((namespace, datum), block=self.policy == "block")
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+
+    def flush(self):
+        """
+        Wait until all datums queued so far are sent (returns early if the
+        background thread died).
+        """
+        if self._thread is None:
+            return
+        done = threading.Event()
+        if not self.__put(done):
+            return
+        while not done.wait(_POLL_INTERVAL):
+            if not self._thread.is_alive():
+                return
+
+    def __put(self, item):
+        """
+        Queue a control item, waiting for room only as long as the background
+        thread is alive.
+
+        :return: :code:`True` if queued, :code:`False` if the thread is dead.
+        :rtype: bool
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __run(self):
+        """
+        The background thread collecting and sending datums.
+        """
+        datums = dict()
+        count = 0
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(deadline - time.time(), 0.001))
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                datums.setdefault(item[0], []).append(item[1])
+                count += 1
+                if count < MAX_DATUMS:
+                    continue
+            elif item is None and time.time() < deadline:
+                continue
+            self.__send(datums)
+            datums = dict()
+            count = 0
+            deadline = time.time() + self.flush_interval
+            if item is self._STOP:
+                return
+            if isinstance(item, threading.Event):
+                try:
+                    if self.downstream is not None:
+                        self.downstream.flush()
+                except Exception as e:
+                    with self._counter_lock:
+                        self.last_error = e
+                finally:
+                    item.set()
+
+    def __send(self, datums):
+        """
+        Send collected datums and update the counters.
+        """
+        for namespace in sorted(datums):
+            try:
+                self._emit(namespace, datums[namespace])
+            except Exception as e:
+                with self._counter_lock:
+                    self.failed += len(datums[namespace])
+                    self.last_error = e
+            else:
+                with self._counter_lock:
+                    self.sent += len(datums[namespace])
+
+
+class MetricAggregator(MetricSink):
+    """
+    Metric sink that rolls up the values of datums with the same namespace,
+    metric name, dimensions and unit per :attr:`period` seconds into a single
+    datum, either as "StatisticValues" (sample count, sum, minimum and
+    maximum) or as "Values" and "Counts" arrays (every distinct value with the
+    number of its occurrences, which keeps percentiles exact). Datums of
+    periods that are over are emitted when the next datum is added, all others
+    when the sink is flushed. Datums that already carry statistic values are
+    passed on unchanged. The aggregator is thread safe.
+
+    This class is not meant to be used directly, use
+    :func:`ec2helper.instance.Instance.metric_aggregation` instead.
+
+    :param instance: The instance the sink is used for.
+    :param int period: The aggregation period in seconds.
+    :param string mode: "statistics" or "values".
+    """
+
+    def __init__(self, instance, period=60, mode="statistics"):
+        """Constructor - see class docu."""
+        super(MetricAggregator, self).__init__(instance)
+        assert mode in ("statistics", "values"), \
+            "mode must be statistics or values"
+        #: The :code:`period` parameter.
+        self.period = period
+        #: The :code:`mode` parameter.
+        self.mode = mode
+        self._aggregates = dict()
+        self._next_end = None
+        self._lock = threading.Lock()
+
+    def add(self, namespace, datum):
+        """
+        Aggregate a datum.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        if "Value" not in datum:
+            self._emit(namespace, [datum])
+            return
+        now = time.time()
+        if "Timestamp" in datum:
+            timestamp = calendar.timegm(datum["Timestamp"].utctimetuple())
+        else:
+            timestamp = now
+        start = int(timestamp // self.period * self.period)
+        dimensions = datum.get("Dimensions", [])
+        key = (namespace, datum["MetricName"], tuple(sorted(
+            (x["Name"], x["Value"]) for x in dimensions)),
+            datum.get("Unit"), datum.get("StorageResolution"), start)
+        value = datum["Value"]
+        with self._lock:
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = {
+                    "Dimensions": list(dimensions),
+                    "Values": Counter()
+                } if self.mode == "values" else {
+                    "Dimensions": list(dimensions),
+                    "SampleCount": 0,
+                    "Sum": 0,
+                    "Minimum": value,
+                    "Maximum": value
+                }
+                if self._next_end is None or start + self.period < \
+                        self._next_end:
+                    self._next_end = start + self.period
+            if self.mode == "values":
+                aggregate["Values"][value] += 1
+            else:
+                aggregate["SampleCount"] += 1
+                aggregate["Sum"] += value
+                aggregate["Minimum"] = min(aggregate["Minimum"], value)
+                aggregate["Maximum"] = max(aggregate["Maximum"], value)
+            due = self._next_end is not None and now >= self._next_end
+        if due:
+            self.__emit_aggregates(now)
+
+    def flush(self):
+        """
+        Emit the aggregates of all periods, including the current ones.
+        """
+        self.__emit_aggregates(None)
+        super(MetricAggregator, self).flush()
+
+    def __emit_aggregates(self, now):
+        """
+        Emit the aggregates of periods that ended before :attr:`now` (all if
+        :code:`None`).
+        """
+        with self._lock:
+            if now is None:
+                done, self._aggregates = self._aggregates, dict()
+                self._next_end = None
+            else:
+                done = dict((k, v) for k, v in six.iteritems(self._aggregates)
+                            if k[-1] + self.period <= now)
+                for key in done:
+                    del self._aggregates[key]
+                self._next_end = min(k[-1] for k in self._aggregates
+                                     ) + self.period if self._aggregates \
+                    else None
+        datums = dict()
+        for key in sorted(done, key=lambda x: (x[0], x[-1])):
+            datums.setdefault(key[0], []).extend(
+                self.__datums(key, done[key]))
+        for namespace in sorted(datums):
+            self._emit(namespace, datums[namespace])
+
+    def __datums(self, key, aggregate):
+        """
+        Build the datums of an aggregate, "Values" are split into datums of
+        at most 150 distinct values.
+        """
+        namespace, metric_name, _, unit, resolution, start = key
+        datum = {
+            "MetricName": metric_name,
+            "Dimensions": aggregate["Dimensions"],
+            "Timestamp": datetime.fromtimestamp(start, tz.tzutc())
+        }
+        if unit is not None:
+            datum["Unit"] = unit
+        if resolution is not None:
+            datum["StorageResolution"] = resolution
+        if self.mode == "statistics":
+            datum["StatisticValues"] = dict((k, aggregate[k]) for k in (
+                "SampleCount", "Sum", "Minimum", "Maximum"))
+            return [datum]
+        values = sorted(aggregate["Values"].items())
+        return [dict(datum, Values=[v for v, _ in values[n:n + MAX_VALUES]],
+                     Counts=[c for _, c in values[n:n + MAX_VALUES]])
+                for n in range(0, len(values), MAX_VALUES)]
+
+
+class MetricDeduplicator(MetricSink):
+    """
+    Metric sink that only passes on datums whose value changed by more than
+    :attr:`threshold` since the last datum passed on for the same namespace,
+    metric name, dimensions and unit. A datum is passed on regardless of its
+    value if the last one is :attr:`max_silence` seconds old, as heartbeat.
+    Datums without a single "Value" are passed on unchanged. The
+    deduplicator is thread safe.
+
+    This class is not meant to be used directly, use
+    :func:`ec2helper.instance.Instance.metric_deduplication` instead.
+
+    :param instance: The instance the sink is used for.
+    :param float threshold: The absolute change to pass a datum on.
+    :param float max_silence: Pass a datum on if the last one is this many
+        seconds old.
+    """
+
+    def __init__(self, instance, threshold=0, max_silence=300):
+        """Constructor - see class docu."""
+        super(MetricDeduplicator, self).__init__(instance)
+        #: The :code:`threshold` parameter.
+        self.threshold = threshold
+        #: The :code:`max_silence` parameter.
+        self.max_silence = max_silence
+        #: Number of datums suppressed so far.
+        self.suppressed = 0
+        self._last = dict()
+        self._lock = threading.Lock()
+
+    def add(self, namespace, datum):
+        """
+        Pass the datum on if it changed enough or the heartbeat is due.
+
+        :param string namespace: The namespace of the datum.
+        :param dict datum: The datum as required by boto3_'s
+            :func:`~client.put_metric_data`.
+        """
+        if "Value" in datum:
+            key = (namespace, datum["MetricName"], tuple(sorted(
+                (x["Name"], x["Value"]) for x in datum.get("Dimensions", []))),
+                datum.get("Unit"))
+            now = time.time()
+            with self._lock:
+                last = self._last.get(key)
+                if last is not None and now - last[1] < self.max_silence and \
+                        abs(datum["Value"] - last[0]) <= self.threshold:
+                    self.suppressed += 1
+                    return
+                self._last[key] = (datum["Value"], now)
+        self._emit(namespace, [datum])
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+.. _boto3: https://boto3.readthedocs.io/en/latest/
+
+Snapshot operations
+===================
+
+Module :mod:`ec2helper.snapshots` provides functions to manage many EBS
+snapshots at once. Deletions are made concurrently by a bounded number of
+workers and throttled by a :class:`RateLimiter`, so large numbers of snapshots
+are processed quickly without hitting the API request limits. Waiting for
+many snapshots to complete costs one request per poll for up to 200 snapshots.
+These functions get exposed via :mod:`ec2helper`.
+
+.. code-block:: python
+
+    from ec2helper import sweep_expired_snapshots
+
+    report = sweep_expired_snapshots(rate=5)
+    print(report["Failed"])
+"""
+from __future__ import unicode_literals, absolute_import
+import threading
+import time
+from datetime import datetime
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from dateutil import parser, tz
+from ec2helper.clients import get_client
+from ec2helper.errors import SnapshotFailed, SnapshotTimeout
+from ec2helper.utils import ISOTIME
+
+
+class RateLimiter(object):
+    """
+    Thread safe token bucket: allows :attr:`rate` calls per second on average
+    and bursts of up to :attr:`burst` calls.
+
+    :param float rate: The calls per second, :code:`None` for no limit.
+    :param int burst: The maximum number of calls made at once, defaults to
+        :attr:`rate`.
+    """
+
+    def __init__(self, rate, burst=None):
+        """Constructor - see class docu."""
+        #: The :code:`rate` parameter.
+        self.rate = rate
+        #: The :code:`burst` parameter.
+        self.burst = max(1, burst if burst is not None else int(rate or 1))
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / float(self.rate)
+            time.sleep(wait)
+
+
+def delete_snapshots(snapshot_ids, region=None, max_workers=8,
+                     rate=5, dry_run=False):
+    """
+    Delete many snapshots concurrently. Snapshots that don't exist (anymore)
+    count as deleted, failures (e.g. snapshots in use by an AMI) are reported
+    and don't stop the other deletions.
+
+    :param list snapshot_ids: The ids of the snapshots to delete.
+    :param string region: The region to make the API calls to, on an EC2
+        instance it defaults to its region.
+    :param int max_workers: The maximum number of concurrent API calls.
+    :param float rate: The maximum number of API calls per second,
+        :code:`None` for no limit.
+    :param bool dry_run: Only report the snapshots that would be deleted.
+    :return: A report of the deletion.
+    :rtype: dict[string, list[string] or dict[string, string]]
+
+    .. code-block:: json
+        :caption: Example return value
+
+        {
+            "Expired": ["snap-036167fc518855549", "snap-0e3272af46c7d5d1e"],
+            "Deleted": ["snap-036167fc518855549"],
+            "Failed": {
+                "snap-0e3272af46c7d5d1e": "ClientError: An error occurred (InvalidSnapshot.InUse) when calling the DeleteSnapshot operation: ..."
+            }
+        }
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        ec2:DeleteSnapshot
+    """
+    return _delete_snapshots(sorted(set(snapshot_ids)), region,
+                             max_workers, rate, dry_run)
+
+
+def _delete_snapshots(snapshot_ids, region, max_workers, rate, dry_run):
+    """
+    Delete the snapshots of an iterable while it is consumed, so deletions
+    start before e.g. all pages of a listing are read.
+    """
+    report = {"Expired": [], "Deleted": [], "Failed": {}}
+    client = get_client("ec2", region)
+    limiter = RateLimiter(rate)
+
+    def delete(snapshot_id):
+        limiter.acquire()
+        try:
+            response = client.delete_snapshot(SnapshotId=snapshot_id)
+            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidSnapshot.NotFound":
+                return snapshot_id, "{0}: {1}".format(type(e).__name__, e)
+        except Exception as e:
+            return snapshot_id, "{0}: {1}".format(type(e).__name__, e)
+        return snapshot_id, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = list()
+        for snapshot_id in snapshot_ids:
+            report["Expired"].append(snapshot_id)
+            if not dry_run:
+                futures.append(pool.submit(delete, snapshot_id))
+        for future in futures:
+            snapshot_id, error = future.result()
+            if error is None:
+                report["Deleted"].append(snapshot_id)
+            else:
+                report["Failed"][snapshot_id] = error
+    return report
+
+
+def _parse_expiry(value):
+    """
+    Parse the value of a delete tag, :code:`None` if it is no time in the
+    ISO format :func:`~ec2helper.utils.tags_to_dict` parses (as written by
+    :func:`~ec2helper.instance.Instance.create_backup`), so numbers or words
+    are never taken for dates. Times without time zone are taken as UTC.
+    """
+    if not ISOTIME.match(value):
+        return None
+    try:
+        expiry = parser.parse(value)
+    except (ValueError, OverflowError):
+        return None
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=tz.tzutc())
+    return expiry
+
+
+def _expired_snapshot_ids(pages, delete_tag, now):
+    """
+    Yield the ids of the snapshots of :func:`describe_snapshots` pages whose
+    delete tag lies before :attr:`now`. Only the delete tag is parsed.
+    """
+    for page in pages:
+        for snapshot in page["Snapshots"]:
+            for tag in snapshot.get("Tags", ()):
+                if tag["Key"] == delete_tag:
+                    expiry = _parse_expiry(tag["Value"])
+                    if expiry is not None and expiry < now:
+                        yield snapshot["SnapshotId"]
+                    break
+
+
+def sweep_expired_snapshots(delete_tag="DeleteAfter",
+                            region=None, max_workers=8, rate=5,
+                            dry_run=False):
+    """
+    Delete all expired snapshots of the account in one pass, e.g. from a
+    scheduled job. All snapshots owned by the account that carry the
+    :attr:`delete_tag` are listed once (1000 per request) and those whose
+    expiry time lies in the past are deleted concurrently while the listing
+    continues, no matter if the instance they were taken from still exists.
+    Snapshots with a delete tag that is no ISO time (like
+    "2018-02-07T16:07:54+00:00") are left alone.
+
+    :param string delete_tag: The tag key for the expiry time, see
+        :func:`~ec2helper.instance.Instance.create_backup`.
+    :param string region: The region to clean up, on an EC2 instance it
+        defaults to its region.
+    :param int max_workers: The maximum number of concurrent delete calls.
+    :param float rate: The maximum number of delete calls per second,
+        :code:`None` for no limit.
+    :param bool dry_run: Only report the snapshots that would be deleted.
+    :return: A report of the deletion, see
+        :func:`~ec2helper.snapshots.delete_snapshots`.
+    :rtype: dict[string, list[string] or dict[string, string]]
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        ec2:DeleteSnapshot
+        ec2:DescribeSnapshots
+    """
+    client = get_client("ec2", region)
+    paginator = client.get_paginator("describe_snapshots")
+    pages = paginator.paginate(
+        OwnerIds=["self"],
+        Filters=[{"Name": "tag-key", "Values": [delete_tag]}],
+        PaginationConfig={"PageSize": 1000}
+    )
+    return _delete_snapshots(
+        _expired_snapshot_ids(pages, delete_tag,
+                              datetime.now(tz=tz.tzutc())),
+        region, max_workers, rate, dry_run)
+
+
+#: The maximum number of snapshot ids per :func:`describe_snapshots` request
+#: of :func:`wait_for_snapshots`.
+MAX_SNAPSHOT_IDS = 200
+
+
+def _describe_snapshots(client, snapshot_ids):
+    """
+    Describe snapshots, leaving out those not found (yet). A request failing
+    because of missing snapshots is split in halves, so the found snapshots
+    are still described with a few requests per missing one.
+
+    :rtype: list[dict]
+    """
+    try:
+        return client.describe_snapshots(
+            SnapshotIds=snapshot_ids)["Snapshots"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "InvalidSnapshot.NotFound":
+            raise
+    if len(snapshot_ids) == 1:
+        return []
+    half = len(snapshot_ids) // 2
+    return _describe_snapshots(client, snapshot_ids[:half]) + \
+        _describe_snapshots(client, snapshot_ids[half:])
+
+
+def _progress(snapshot):
+    """
+    The progress of a snapshot in percent, 0 if not reported yet.
+    """
+    try:
+        return float(snapshot.get("Progress", "").rstrip("%") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _poll_interval(history, now, min_interval, max_interval):
+    """
+    Estimate when the slowest pending snapshot completes from the progress
+    it made since it was first seen and poll at half that time.
+    """
+    remaining = 0
+    for start, start_progress, progress in history.values():
+        if progress > start_progress and now > start:
+            rate = (progress - start_progress) / (now - start)
+            remaining = max(remaining, (100 - progress) / rate)
+        else:
+            return min_interval
+    return min(max_interval, max(min_interval, remaining / 2))
+
+
+def wait_for_snapshots(snapshot_ids, region=None, timeout=3600,
+                       min_interval=5, max_interval=60, callback=None):
+    """
+    Wait until all snapshots are completed. Each poll describes all pending
+    snapshots with one :func:`describe_snapshots` call per 200 snapshots.
+    The time to the next poll adapts to the progress the snapshots report:
+    it is half the estimated time until the slowest snapshot completes,
+    bounded by :attr:`min_interval` and :attr:`max_interval`. Snapshots that
+    are not found yet (right after their creation) are polled again, without
+    holding up the others polled with them.
+
+    :param list snapshot_ids: The ids of the snapshots to wait for.
+    :param string region: The region to make the API calls to, on an EC2
+        instance it defaults to its region.
+    :param float timeout: The maximum seconds to wait in total.
+    :param float min_interval: The minimum seconds between two polls.
+    :param float max_interval: The maximum seconds between two polls.
+    :param callback: Called after every poll with the snapshot data of all
+        snapshots found so far by snapshot id, e.g. to report progress.
+    :type callback: callable(dict[string, dict])
+    :return: The snapshot data as returned by :func:`describe_snapshots` by
+        snapshot id.
+    :rtype: dict[string, dict]
+    :raises ~ec2helper.errors.SnapshotFailed: If a snapshot went to state
+        "error".
+    :raises ~ec2helper.errors.SnapshotTimeout: If the snapshots didn't
+        complete within :attr:`timeout` seconds.
+
+    .. code-block:: none
+        :caption: AWS API permissions
+
+        ec2:DescribeSnapshots
+    """
+    client = get_client("ec2", region)
+    pending = sorted(set(snapshot_ids))
+    snapshots = dict()
+    history = dict()
+    deadline = time.time() + timeout
+    while pending:
+        for n in range(0, len(pending), MAX_SNAPSHOT_IDS):
+            for snapshot in _describe_snapshots(
+                    client, pending[n:n + MAX_SNAPSHOT_IDS]):
+                snapshots[snapshot["SnapshotId"]] = snapshot
+        now = time.time()
+        if callback is not None:
+            callback(snapshots)
+        failed = sorted(x for x in pending if x in snapshots and
+                        snapshots[x]["State"] == "error")
+        if failed:
+            raise SnapshotFailed("Snapshots failed: {0}".format(
+                ", ".join(failed)), snapshots)
+        pending = [x for x in pending if x not in snapshots or
+                   snapshots[x]["State"] != "completed"]
+        for snapshot_id in list(history):
+            if snapshot_id not in pending:
+                del history[snapshot_id]
+        for snapshot_id in pending:
+            progress = _progress(snapshots.get(snapshot_id, {}))
+            if snapshot_id in history:
+                history[snapshot_id][2] = progress
+            else:
+                history[snapshot_id] = [now, progress, progress]
+        if not pending:
+            break
+        interval = _poll_interval(history, now, min_interval, max_interval)
+        if now + interval > deadline:
+            if now < deadline:
+                time.sleep(deadline - now)
+                continue
+            raise SnapshotTimeout("Snapshots not completed: {0}".format(
+                ", ".join(pending)), snapshots)
+        time.sleep(interval)
+    return snapshots
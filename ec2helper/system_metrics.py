@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+.. _psutil: https://psutil.readthedocs.io/en/latest/
+
+The SystemMetricsCollector
+==========================
+
+This class is not meant to be used directly, use
+:func:`ec2helper.instance.Instance.system_metrics` instead.
+
+A lightweight replacement for a metrics agent: a daemon thread samples
+CPU, memory, swap, disk space, disk I/O and network counters with psutil_
+every :attr:`interval` seconds, computes rates from the counter deltas and
+publishes all datums of a sample at once through the
+:attr:`~ec2helper.instance.Instance.metric_sink` of the instance (or with a
+single batched request if there is none).
+
+Every metric is published for the "InstanceId" dimension and, if the instance
+is an autoscaling instance, for the "AutoScalingGroupName" dimension. Disk
+space is published per "MountPoint" together with the instance id. The
+dimension lists are built once and shared by all datums, the previous counters
+are kept for the rates, so a sample allocates little more than the datums.
+
+.. list-table:: Metrics
+    :header-rows: 1
+
+    * - Name
+      - Unit
+    * - CPUUtilization, MemoryUtilization, SwapUtilization
+      - Percent
+    * - MemoryAvailable
+      - Bytes
+    * - DiskSpaceUtilization (per mount point)
+      - Percent
+    * - DiskReadBytes, DiskWriteBytes, NetworkIn, NetworkOut
+      - Bytes/Second
+    * - DiskReadOps, DiskWriteOps, NetworkPacketsIn, NetworkPacketsOut
+      - Count/Second
+"""
+from __future__ import unicode_literals, absolute_import, division
+import threading
+import time
+import psutil
+from ec2helper.errors import TagNotFound
+
+_DISK_RATES = (
+    ("DiskReadBytes", "read_bytes", "Bytes/Second"),
+    ("DiskWriteBytes", "write_bytes", "Bytes/Second"),
+    ("DiskReadOps", "read_count", "Count/Second"),
+    ("DiskWriteOps", "write_count", "Count/Second"),
+)
+_NETWORK_RATES = (
+    ("NetworkIn", "bytes_recv", "Bytes/Second"),
+    ("NetworkOut", "bytes_sent", "Bytes/Second"),
+    ("NetworkPacketsIn", "packets_recv", "Count/Second"),
+    ("NetworkPacketsOut", "packets_sent", "Count/Second"),
+)
+
+
+def _cpu_times():
+    """
+    The busy and total CPU time of all CPUs in seconds.
+    """
+    times = psutil.cpu_times()
+    total = sum(times)
+    # guest time is also counted as user time on Linux
+    total -= getattr(times, "guest", 0) + getattr(times, "guest_nice", 0)
+    return total - times.idle - getattr(times, "iowait", 0), total
+
+
+class SystemMetricsCollector(object):
+    """
+    Periodically publish psutil_ system metrics.
+
+    :param instance: The instance to publish the metrics for.
+    :param float interval: Seconds between two samples.
+    :param string namespace: The namespace of the metrics.
+    :param bool disks: Publish disk space and disk I/O metrics.
+    :param bool network: Publish network metrics.
+    """
+
+    def __init__(self, instance, interval=60, namespace="System/Linux",
+                 disks=True, network=True):
+        """Constructor - see class docu."""
+        self._instance = instance
+        #: The :code:`interval` parameter.
+        self.interval = interval
+        #: The :code:`namespace` parameter.
+        self.namespace = namespace
+        #: The :code:`disks` parameter.
+        self.disks = disks
+        #: The :code:`network` parameter.
+        self.network = network
+        #: The number of samples published so far.
+        self.samples = 0
+        #: The last exception raised while sampling or publishing,
+        #: :code:`None` if none.
+        self.last_error = None
+        self._dimension_sets = None
+        self._mountpoints = None
+        self._previous = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        """
+        Start collecting.
+        """
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        """
+        Stop collecting.
+        """
+        self.stop()
+
+    def start(self):
+        """
+        Start the background thread, the first sample is taken immediately
+        (CPU utilization and rates are published from the second sample on).
+
+        :return: The collector itself.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.__run,
+                                            name="ec2helper-system-metrics")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        """
+        Take a sample and publish it.
+
+        :return: The number of datums published.
+        :rtype: int
+        """
+        datums = list()
+        self.__collect(datums)
+        if datums:
+            self._instance._put_datums(self.namespace, datums)
+        self.samples += 1
+        return len(datums)
+
+    def __run(self):
+        """
+        The background thread.
+        """
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                self.last_error = e
+            if self._stop.wait(self.interval):
+                return
+
+    def __get_dimension_sets(self):
+        """
+        Resolve the dimension sets once: instance id and, if available,
+        autoscaling group name.
+        """
+        if self._dimension_sets is None:
+            sets = [[{"Name": "InstanceId", "Value": self._instance.id}]]
+            try:
+                sets.append([{"Name": "AutoScalingGroupName",
+                              "Value": self._instance._cached_tag(
+                                  "aws:autoscaling:groupName")}])
+            except TagNotFound:
+                pass
+            self._dimension_sets = sets
+        return self._dimension_sets
+
+    def __add(self, datums, name, value, unit, dimension_sets=None):
+        """
+        Append the datums of one value for all dimension sets.
+        """
+        for dimensions in dimension_sets or self.__get_dimension_sets():
+            datums.append({"MetricName": name, "Dimensions": dimensions,
+                           "Value": value, "Unit": unit})
+
+    def __collect(self, datums):
+        """
+        Sample all metrics into :attr:`datums`.
+        """
+        now = time.time()
+        cpu = _cpu_times()
+        memory = psutil.virtual_memory()
+        self.__add(datums, "MemoryUtilization", memory.percent, "Percent")
+        self.__add(datums, "MemoryAvailable", memory.available, "Bytes")
+        self.__add(datums, "SwapUtilization", psutil.swap_memory().percent,
+                   "Percent")
+        disk = network = None
+        if self.disks:
+            self.__collect_disk_space(datums)
+            disk = psutil.disk_io_counters()
+        if self.network:
+            network = psutil.net_io_counters()
+        if self._previous is not None:
+            last, last_cpu, last_disk, last_network = self._previous
+            total = cpu[1] - last_cpu[1]
+            if total > 0:
+                busy = max(cpu[0] - last_cpu[0], 0)
+                self.__add(datums, "CPUUtilization",
+                           min(100.0 * busy / total, 100.0), "Percent")
+            elapsed = now - last
+            if elapsed > 0:
+                for counters, last_counters, rates in (
+                        (disk, last_disk, _DISK_RATES),
+                        (network, last_network, _NETWORK_RATES)):
+                    if counters is None or last_counters is None:
+                        continue
+                    for name, field, unit in rates:
+                        delta = getattr(counters, field) - getattr(
+                            last_counters, field)
+                        self.__add(datums, name, max(delta, 0) / elapsed,
+                                   unit)
+        self._previous = (now, cpu, disk, network)
+
+    def __collect_disk_space(self, datums):
+        """
+        Sample the disk space of all mount points, the list of mount points
+        (and their dimensions) is refreshed every 10 samples.
+        """
+        if self._mountpoints is None or self.samples % 10 == 0:
+            self._mountpoints = [(x.mountpoint, [
+                {"Name": "InstanceId", "Value": self._instance.id},
+                {"Name": "MountPoint", "Value": x.mountpoint}
+            ]) for x in psutil.disk_partitions()]
+        for mountpoint, dimensions in self._mountpoints:
+            try:
+                usage = psutil.disk_usage(mountpoint)
+            except OSError:
+                continue
+            self.__add(datums, "DiskSpaceUtilization", usage.percent,
+                       "Percent", [dimensions])
@@ -13,50 +13,83 @@ useful for the user.
 
 .. code-block:: python
     
-    from ec2helper import IS_EC2, metadata
+    from ec2helper import is_ec2, metadata
     
-    if IS_EC2:
+    if is_ec2():
         print(metadata('ami_id'))
 """
 from __future__ import unicode_literals, absolute_import
 import six
 import re
+import sys
 import json
-import requests
-from ec2_metadata import ec2_metadata
+import threading
 from datetime import datetime, date
-from dateutil import parser
 
 INTEGER = re.compile(r"^-?\d+$")
 FLOAT = re.compile(r"^-?\d+(\.\d+)?$")
 ISOTIME = re.compile(
     r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{6})?([+-]\d{2}:\d{2})?$")
 
-try:
-    # This request still succeeded with a timeout of 0.001, so 0.5 should be a
-    # good compromise between stability and load time on none EC2 instances.
-    requests.get("http://169.254.169.254/latest/meta-data/reservation-id",
-                 timeout=0.5)
-except requests.exceptions.ConnectTimeout:
-    IS_EC2 = False
-else:
+_is_ec2 = None
+_is_ec2_lock = threading.Lock()
+
+
+def is_ec2():
+    """
+    Check if calling the EC2 metadata API succeeds, thus if we're on an EC2
+    instance. The API is probed on the first call only, the module attribute
+    :attr:`~ec2helper.utils.IS_EC2` gives the same result.
+
+    :rtype: bool
+    """
+    global _is_ec2
+    if _is_ec2 is None:
+        with _is_ec2_lock:
+            if _is_ec2 is None:
+                import requests
+                try:
+                    # This request still succeeded with a timeout of 0.001, so
+                    # 0.5 should be a good compromise between stability and
+                    # load time on none EC2 instances.
+                    requests.get("http://169.254.169.254/latest/meta-data/"
+                                 "reservation-id", timeout=0.5)
+                except requests.exceptions.RequestException:
+                    _is_ec2 = False
+                else:
+                    _is_ec2 = True
+    return _is_ec2
+
+
+def __getattr__(name):
+    """
+    Probe the metadata API only when :attr:`IS_EC2` is accessed.
+    """
+    if name == "IS_EC2":
+        return is_ec2()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover - no module __getattr__
     #: This variable indicates if calling the EC2 metadata API succeeded, thus
-    #: if we're on an EC2 instance.
-    IS_EC2 = True
+    #: if we're on an EC2 instance (probed when first accessed).
+    IS_EC2 = is_ec2()
 
 
 def metadata(attribute):
     """
     Get EC2 metadata from local EC2 metadata API via ec2_metadata_.
     But check if we are actually running on an EC2 instance (using
-    :attr:`~ec2helper.utils.IS_EC2`) and return :code:`None` otherwise.
+    :func:`~ec2helper.utils.is_ec2`) and return :code:`None` otherwise.
     
     :param string attribute: The attribute to get from ec2_metadata_.
     :return: The value from ec2_metadata_ if running on an EC2 instance,
         :code:`None` otherwise.
     :rtype: None or string or any other data returned by ec2_metadata
     """
-    if IS_EC2:
+    if is_ec2():
+        from ec2_metadata import ec2_metadata
         return getattr(ec2_metadata, attribute)
     return None
 
@@ -101,7 +134,9 @@ def _parse_value(value):
     if value == "False": return False
     if INTEGER.match(value): return int(value)
     if FLOAT.match(value): return float(value)
-    if ISOTIME.match(value): return parser.parse(value)
+    if ISOTIME.match(value):
+        from dateutil import parser
+        return parser.parse(value)
     return value
 
 